@@ -8,13 +8,21 @@ extracts the text, and prepares it for AI-generated feedback.
 Features:
 - PDF upload and text extraction
 - Session state management
-- File cleanup on startup
+- Uploads are kept in a shared content-addressed store; a repeat upload reuses the stored text
+- The text is prepared for the prompts (dehyphenation, line joining, no headers, footers or references, see src/preprocess.py)
+- A revised draft uploaded in the same session is analysed incrementally against the previous one
+- Tracing of the text extraction and the metrics endpoint (see src/tracing.py)
 """
 
-import shutil
 import streamlit as st
-import os
 import time
+from src.analysis import archive_analysis
+from src.extract_text import extract_text
+from src.literature import cancel_literature
+from src.preprocess import prepare_text
+from src.spelling import warm_up
+from src.tracing import current_session_id, span, start_metrics_server
+from src.upload_store import get_upload_store
 
 st.set_page_config(page_title="Upload your PDF!", 
                    page_icon="📄",
@@ -22,6 +30,11 @@ st.set_page_config(page_title="Upload your PDF!",
                    layout="centered"
                    )
 
+# Serve the pipeline metrics for Prometheus, once per process
+start_metrics_server()
+# Load the spelling dictionary while the user picks a file
+warm_up()
+
 with open( "assets/style.css" ) as css:
     st.markdown( f'<style>{css.read()}</style>' , unsafe_allow_html= True)
 
@@ -35,48 +48,45 @@ with explanation:
 
     uploaded_file = st.file_uploader("Upload your paper in PDF format here:", type="pdf", key="file_uploader_text")
 
-def initialize_app():
-    """
-    Cleans up the 'uploads' directory by removing all files and subdirectories.
-    This ensures a fresh state each time the app is started.
-    """
-    for filename in os.listdir("uploads"):
-        file_path = os.path.join("uploads", filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f'Failed to delete {file_path}. Reason: {e}')
+if uploaded_file is not None:
+    # Store the uploaded PDF once per content, referenced by this session
+    data = bytes(uploaded_file.getbuffer())
+    store = get_upload_store()
+    session_id = current_session_id() or "local"
+    digest = store.put(data, session_id)
+    previous_digest = st.session_state.get("upload_digest")
+    if previous_digest is not None and previous_digest != digest:
+        store.release(previous_digest, session_id)
 
-if "files_initialized" not in st.session_state:
-    initialize_app()                        
-    st.session_state["files_initialized"] = True
+    # Reuse the text extracted from an earlier upload of the same PDF, otherwise extract it in memory
+    extracted = store.get_text(digest)
+    if extracted is not None:
+        file_content, page_offsets = extracted
+        print(f"Using the stored text of {uploaded_file.name}")
+    else:
+        with span("pdf_extraction", pdf_bytes=len(data)) as extraction_span:
+            file_content, page_offsets = extract_text(data)
+            extraction_span.set(pages=len(page_offsets), chars=len(file_content))
+        store.set_text(digest, file_content, page_offsets)
 
-if uploaded_file is not None:
-    # Save uploaded PDF to 'uploads' directory
-    save_path = os.path.join("uploads", uploaded_file.name)
-    with open(save_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # Literature requests for a previous upload are no longer needed
+    cancel_literature()
 
-    import pymupdf  # Used for PDF text extraction
+    # A revised draft is analysed incrementally against the previous version
+    if st.session_state.get("text") not in (None, file_content):
+        archive_analysis()
+
+    # Prepare the text for the prompts, the extracted text is what the user sees
+    with span("preprocessing", chars=len(file_content)) as preprocessing_span:
+        prepared = prepare_text(file_content, page_offsets)
+        preprocessing_span.set(prepared_chars=len(prepared.text), map_entries=len(prepared.prepared_starts))
 
-    # Extract text from PDF and save to output.txt
-    doc = pymupdf.open(save_path)
-    out = open("output.txt", "wb")
-    for page in doc:
-        text = page.get_text().encode("utf8")
-        out.write(text)
-    out.close()
-    file_path = 'output.txt'
-    with open(file_path, 'r', encoding="utf8") as file:
-        lines = file.readlines()
-        file_content = '\n'.join(lines)
-    
     # Store extracted text and file info in session state
     st.session_state["text"] = file_content
+    st.session_state["page_offsets"] = page_offsets
+    st.session_state["prepared_text"] = prepared
     st.session_state["pdf_path"] = uploaded_file.name
+    st.session_state["upload_digest"] = digest
     st.session_state["dry_run"] = False
     
     # Switch to feedback page after processing
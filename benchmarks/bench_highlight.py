@@ -0,0 +1,95 @@
+"""
+bench_highlight.py
+
+Micro-benchmark for highlighting corrections and arguments in long papers.
+Compares the single-pass span renderer with the previous approach of rebuilding
+the whole string once per highlight.
+
+Usage:
+    python -m benchmarks.bench_highlight [--pages 120] [--corrections 5000]
+"""
+
+import argparse
+import random
+import time
+from src.render_spans import Span, render_spans
+
+WORDS = ["moonlight", "intelligence", "analysis", "evidence", "cognitive", "function", "the", "of",
+         "study", "results", "exposure", "human", "research", "significant", "data", "paper"]
+
+def synthetic_text(pages : int, seed : int = 0):
+    """
+    Builds a synthetic paper of roughly 3000 characters per page, in paragraphs.
+
+    Args:
+        pages (int): Number of pages.
+        seed (int): Random seed.
+
+    Returns:
+        str: The synthetic text.
+    """
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(pages * 5):
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(80)))
+    return "\n\n".join(paragraphs)
+
+def synthetic_spans(text : str, count : int, seed : int = 0):
+    """
+    Builds random, possibly overlapping correction spans.
+
+    Args:
+        text (str): The text to highlight.
+        count (int): Number of spans.
+        seed (int): Random seed.
+
+    Returns:
+        list: Span objects.
+    """
+    rng = random.Random(seed)
+    spans = []
+    for _ in range(count):
+        start = rng.randrange(len(text) - 20)
+        spans.append(Span(start, start + rng.randint(3, 20), '<span style="border-bottom: 3px solid red;" title="Suggestion: x">'))
+    return spans
+
+def legacy_render(text : str, spans):
+    """
+    The previous approach: rebuild the whole string once per span, from the end of the text.
+    """
+    highlighted_text = text
+    for span in sorted(spans, key=lambda x: x.start, reverse=True):
+        highlighted_text = (
+            highlighted_text[:span.start] +
+            span.open_tag + highlighted_text[span.start:span.end] + span.close_tag +
+            highlighted_text[span.end:]
+        )
+    return highlighted_text
+
+def bench(function, *args, repeat : int = 3):
+    """
+    Returns the best wall time of a number of runs, in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--corrections", type=int, default=5000)
+    args = parser.parse_args()
+
+    text = synthetic_text(args.pages)
+    print(f"Text: {args.pages} pages, {len(text)} characters")
+    for count in (args.corrections // 10, args.corrections // 2, args.corrections):
+        spans = synthetic_spans(text, count)
+        new = bench(render_spans, text, spans)
+        old = bench(legacy_render, text, spans)
+        print(f"{count:>6} spans: single-pass {new * 1000:8.1f} ms, per-span rebuild {old * 1000:8.1f} ms ({old / new:.1f}x)")
+
+if __name__ == "__main__":
+    main()
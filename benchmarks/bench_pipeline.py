@@ -0,0 +1,280 @@
+"""
+bench_pipeline.py
+
+End-to-end benchmark of the feedback pipeline on synthetic papers, without API keys.
+Gemini and the feedback assistant are replaced by the replay transport (see replay.py), with
+configurable latency and failure injection. Each paper goes through the stages of the app:
+
+- extraction: text extraction from the PDF bytes
+- preprocessing: preparing the extracted text for the prompts (see preprocess.py)
+- analysis: general feedback, corrections and arguments on the prepared text, concurrently (as the analysis jobs run)
+- reanalysis: incremental corrections and arguments for a revision with one edited and one new paragraph
+- highlighting: anchoring the arguments and corrections in the prepared text and highlighting them in the extracted text
+- rendering: a script run of pages/Feedback.py per feedback type, with the results in session state
+
+Wall time, CPU time and peak traced memory (in a separate run) are reported per stage. CPU time and memory of the
+extraction worker processes (large PDFs) are not included. Results can be saved as a baseline and
+later runs compared against it; the run fails if a stage regressed by more than the tolerance.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--pages 2,10,50,200] [--latency 0.05] [--failure-rate 0.0]
+    python -m benchmarks.bench_pipeline --save-baseline
+    python -m benchmarks.bench_pipeline --record recordings.json   (needs GEMINI_API_KEY and PERPLEXITY_API_KEY)
+"""
+
+import os
+
+# Keep benchmark runs out of the analysis cache, the trace log and the metrics port
+os.environ.setdefault("PAPERHELP_CACHE", "off")
+os.environ.setdefault("PAPERHELP_TRACE_FILE", "off")
+os.environ.setdefault("PAPERHELP_METRICS_PORT", "off")
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import pymupdf
+from benchmarks.bench_highlight import synthetic_text
+from benchmarks.replay import RecordingClient, ReplayAgent, ReplayClient, install
+from src.analysis import get_general_feedback
+from src.correction_store import CorrectionStore
+from src.extract_text import extract_text
+from src.find_arguments import extract_arguments
+from src.preprocess import prepare_text
+from src.incremental import update_arguments, update_corrections
+from src.retrieval import PassageIndex
+from src.spelling import get_dictionary, spelling_available
+from src.text_corrections import find_corrections, highlight_text_arguments, highlight_text_corrections
+from src.text_index import NormalizedText, locate_arguments
+
+BASELINE_FILE = os.path.join("benchmarks", "baseline.json")
+STAGES = ["extraction", "preprocessing", "analysis", "reanalysis", "highlighting", "rendering"]
+FEEDBACK_TYPES = ["General", "Arguments", "Corrections"]
+# Differences below these floors are noise, not regressions
+MIN_SECONDS = 0.1
+MIN_MEGABYTES = 1.0
+
+def synthetic_pdf(pages : int, seed : int = 0):
+    """
+    Builds a PDF with roughly one page of synthetic text per requested page.
+
+    Args:
+        pages (int): Number of pages.
+        seed (int): Random seed.
+
+    Returns:
+        bytes: The PDF.
+    """
+    document = pymupdf.open()
+    paragraphs = synthetic_text(pages, seed).split("\n\n")
+    per_page = max(1, len(paragraphs) // pages)
+    for first in range(0, per_page * pages, per_page):
+        page = document.new_page()
+        page.insert_textbox(pymupdf.Rect(50, 50, 545, 790), "\n\n".join(paragraphs[first:first + per_page]), fontsize=7)
+    data = document.tobytes()
+    document.close()
+    return data
+
+def measure(function, *args, memory : bool = True, verbose : bool = False):
+    """
+    Runs a stage and measures it. Memory tracing slows Python code down considerably,
+    so the peak memory is measured in a second, traced run of the stage.
+
+    Returns:
+        tuple: The result of the function and a dict with wall and cpu seconds and peak megabytes.
+    """
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    with output:
+        result = function(*args)
+    metrics = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu}
+    if memory:
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args)
+        metrics["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, metrics
+
+def analyse(text : str, client):
+    """
+    Runs the three analyses concurrently, like the analysis jobs, without Streamlit session state.
+    """
+    index = PassageIndex(text)
+    agent = ReplayAgent(index.summary, client)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        general = executor.submit(get_general_feedback, agent, text, False)
+        corrections = executor.submit(find_corrections, text, "replay", False, None, lambda item: None)
+        arguments = executor.submit(extract_arguments, text, "replay", False, lambda item: None)
+        return {"general_feedback": general.result(), "corrections_llm": corrections.result() or [], "arguments": arguments.result() or []}
+
+def revise(text : str):
+    """
+    Returns a revision of the text with one paragraph edited and one paragraph inserted.
+    """
+    paragraphs = text.split("\n\n")
+    middle = len(paragraphs) // 2
+    paragraphs[middle] += " This sentence was added in the revision."
+    paragraphs.insert(middle + 2, "This paragraph was added in the revision, it explains the method in more detail.")
+    return "\n\n".join(paragraphs)
+
+def reanalyse(text : str, results : dict):
+    """
+    Updates the corrections and arguments incrementally for a revision of the text.
+    """
+    revision = revise(text)
+    return (update_corrections(text, results["corrections_llm"], revision, "replay", False),
+            update_arguments(text, results["arguments"], revision, "replay", False))
+
+def highlight(text : str, prepared, results : dict):
+    """
+    Anchors and highlights the arguments and corrections, like the display functions do.
+    """
+    normalized = NormalizedText(prepared.text, prepared)
+    arguments = results["arguments"]
+    located = [{"error": arguments[i]["context"], "suggestion": ["Correction"], "offset": start, "length": end - start, "type": "argument"}
+               for i, start, end in locate_arguments(normalized, [argument["context"] for argument in arguments])]
+    return highlight_text_arguments(text, located), highlight_text_corrections(text, results["corrections_llm"], normalized)
+
+def render(text : str, page_offsets : list, prepared, results : dict, client):
+    """
+    Runs pages/Feedback.py once per feedback type with the analysis results in session state.
+    """
+    from streamlit.testing.v1 import AppTest
+    for feedback_type in FEEDBACK_TYPES:
+        app = AppTest.from_file("pages/Feedback.py", default_timeout=600)
+        app.secrets["GEMINI_API_KEY"] = "replay"
+        app.secrets["PERPLEXITY_API_KEY"] = "replay"
+        app.session_state["text"] = text
+        app.session_state["page_offsets"] = page_offsets
+        app.session_state["prepared_text"] = prepared
+        app.session_state["dry_run"] = False
+        app.session_state["instructions_done"] = True
+        app.session_state["feedback_type"] = feedback_type
+        app.session_state["agent"] = ReplayAgent(PassageIndex(prepared.text).summary, client)
+        # Stored the way store_analysis stores them
+        for key, value in results.items():
+            app.session_state[key] = CorrectionStore.from_items(value) if key == "corrections_llm" else value
+        app.session_state["updated_arguments"] = [False] * len(results["arguments"])
+        app.run()
+        if app.exception:
+            raise RuntimeError(f"Rendering {feedback_type} failed: {app.exception[0].message}")
+
+def run(pages : int, client, memory : bool = True, verbose : bool = False):
+    """
+    Runs all stages for a synthetic paper.
+
+    Returns:
+        dict: The metrics per stage.
+    """
+    data = synthetic_pdf(pages)
+    stages = {}
+    (text, page_offsets), stages["extraction"] = measure(extract_text, data, memory=memory, verbose=verbose)
+    prepared, stages["preprocessing"] = measure(prepare_text, text, page_offsets, memory=memory, verbose=verbose)
+    results, stages["analysis"] = measure(analyse, prepared.text, client, memory=memory, verbose=verbose)
+    _, stages["reanalysis"] = measure(reanalyse, prepared.text, results, memory=memory, verbose=verbose)
+    _, stages["highlighting"] = measure(highlight, text, prepared, results, memory=memory, verbose=verbose)
+    _, stages["rendering"] = measure(render, text, page_offsets, prepared, results, client, memory=memory, verbose=verbose)
+    print(f"{pages:>4} pages, {len(text):>8} characters ({len(prepared.text)} prepared), {len(results['arguments'])} arguments, {len(results['corrections_llm'])} corrections")
+    for stage in STAGES:
+        metrics = stages[stage]
+        memory_text = f", peak {metrics['peak_mb']:8.1f} MB" if "peak_mb" in metrics else ""
+        print(f"     {stage:<13} wall {metrics['wall']:7.2f} s, cpu {metrics['cpu']:7.2f} s{memory_text}")
+    return stages
+
+def compare(results : dict, baseline : dict, tolerance : float):
+    """
+    Compares the results with a baseline.
+
+    Returns:
+        list: Descriptions of the regressions.
+    """
+    regressions = []
+    for pages, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get(pages, {}).get(stage)
+            if reference is None:
+                continue
+            for metric, value in metrics.items():
+                if metric not in reference:
+                    continue
+                floor = MIN_MEGABYTES if metric == "peak_mb" else MIN_SECONDS
+                if value > reference[metric] * tolerance and value - reference[metric] > floor:
+                    regressions.append(f"{pages} pages, {stage} {metric}: {value:.2f} (baseline {reference[metric]:.2f})")
+    return regressions
+
+def record(path : str, pages : list):
+    """
+    Runs the analysis with the real providers and records the responses for replay.
+    """
+    import google.genai
+    from src.assistant import create_agent
+    recorder = RecordingClient(google.genai.Client(api_key=os.environ["GEMINI_API_KEY"]), path)
+    agent_factory = lambda summary, api_key: recorder.record_agent(create_agent(summary, os.environ["PERPLEXITY_API_KEY"]))
+    with install(recorder, agent_factory):
+        for count in pages:
+            text = prepare_text(*extract_text(synthetic_pdf(count))).text
+            index = PassageIndex(text)
+            get_general_feedback(agent_factory(index.summary, None), text, False)
+            find_corrections(text, os.environ["GEMINI_API_KEY"], False)
+            extract_arguments(text, os.environ["GEMINI_API_KEY"], False)
+    recorder.save()
+    print(f"Recorded {len(recorder.recordings)} responses to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="2,10,50,200", help="Comma-separated paper sizes in pages")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean latency of a replayed request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum deviation from the mean latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a replayed request fails")
+    parser.add_argument("--recordings", help="Recording file with responses to replay")
+    parser.add_argument("--record", metavar="PATH", help="Record real responses to PATH instead of benchmarking")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed slowdown factor before a stage counts as a regression")
+    parser.add_argument("--no-memory", action="store_true", help="Don't measure peak memory (saves a traced second run per stage)")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the pipeline")
+    args = parser.parse_args()
+    pages = [int(count) for count in args.pages.split(",")]
+    # Session state is set up outside a script run, which Streamlit warns about on every access
+    logging.disable(logging.WARNING)
+
+    if args.record:
+        record(args.record, pages)
+        return
+
+    # The spelling dictionary is loaded once per process, like in the app
+    if spelling_available():
+        get_dictionary()
+    client = ReplayClient(args.recordings, args.latency, args.jitter, args.failure_rate)
+    results = {}
+    with install(client):
+        for count in pages:
+            results[str(count)] = run(count, client, memory=not args.no_memory, verbose=args.verbose)
+    print(f"Replayed {client.calls} requests, {client.failures} injected failures")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
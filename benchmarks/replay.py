@@ -0,0 +1,357 @@
+"""
+replay.py
+
+Offline stand-ins for the LLM providers, so the pipeline can be benchmarked without API keys.
+The replay transport mimics the parts of the google.genai client and the agno Agent that the
+app uses. Responses come from a recording file when one matches the request, and are otherwise
+synthesized from the paper text, so arguments and corrections can be anchored and highlighted.
+
+Features:
+- ReplayClient: replaces google.genai.Client (generate_content, generate_content_stream, caches)
+- ReplayAgent: replaces the agno feedback assistant (general feedback, literature, streamed chat)
+- Configurable latency, jitter and failure injection (transient errors that the client retries)
+- RecordingClient: wraps a real client (and agents) and records their responses for later replay
+- install(): patches the app to use the stand-ins
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import typing
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+from unittest import mock
+from src.document_session import DOCUMENT_TEMPLATE
+
+DOCUMENT_PREFIX = DOCUMENT_TEMPLATE.split("{text}")[0]
+WORD = re.compile(r"[A-Za-z]{4,}")
+CORRECTION_TYPES = ["spelling", "grammar", "style"]
+
+class InjectedFailure(ConnectionError):
+    """
+    Transient error raised by the stand-ins. It is a ConnectionError, so the LLM client retries it.
+    """
+
+def _item_model(config : dict):
+    """
+    Returns the name of the item model of a list response schema, or None.
+    """
+    schema = (config or {}).get("response_schema")
+    args = typing.get_args(schema)
+    return args[0].__name__ if args else None
+
+def record_key(document : str, prompt : str, item_model : str):
+    """
+    Returns the key of a request in a recording file. Model independent, so fallbacks replay as well.
+
+    Args:
+        document (str): The paper text the request is about, or None.
+        prompt (str): The instruction of the request.
+        item_model (str): The name of the item model of the response schema, or None.
+
+    Returns:
+        str: The hex SHA-256 digest.
+    """
+    return hashlib.sha256(json.dumps([document, prompt, item_model]).encode("utf-8")).hexdigest()
+
+class _Transport:
+    """
+    Shared request handling of the replay and recording clients: resolves the paper text of a
+    request, whether it is sent inline or registered as cached content.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self._lock = threading.Lock()
+        self._cache_ids = 0
+
+    def split_request(self, contents, config : dict):
+        """
+        Returns the paper text and the instruction of a request.
+
+        Returns:
+            tuple: The document (or None) and the prompt.
+        """
+        config = config or {}
+        if isinstance(contents, str):
+            prompt, document = contents, None
+        else:
+            parts = [part for part in contents if isinstance(part, str)]
+            document, prompt = (parts[0], parts[-1]) if len(parts) > 1 else (None, parts[0])
+        if config.get("cached_content") is not None:
+            document = self.documents.get(config["cached_content"])
+        if document is not None and document.startswith(DOCUMENT_PREFIX):
+            document = document[len(DOCUMENT_PREFIX):]
+        return document, prompt
+
+    def create_cache(self, model : str, config : dict):
+        with self._lock:
+            self._cache_ids += 1
+            name = f"cachedContents/replay-{self._cache_ids}"
+            self.documents[name] = config["contents"][0]
+        return SimpleNamespace(name=name, model=model)
+
+class ReplayClient(_Transport):
+    """
+    Stand-in for google.genai.Client.
+
+    Attributes:
+        latency (float): Mean latency of a request in seconds.
+        jitter (float): Maximum deviation from the mean latency in seconds.
+        failure_rate (float): Probability that a request fails with a transient error.
+        chunk_size (int): Number of characters per streamed chunk.
+        calls (int): Number of requests.
+        failures (int): Number of injected failures.
+    """
+
+    def __init__(self, recordings : str = None, latency : float = 0.0, jitter : float = 0.0,
+                 failure_rate : float = 0.0, chunk_size : int = 256, seed : int = 0):
+        super().__init__()
+        self.recordings = {}
+        if recordings is not None:
+            with open(recordings, encoding="utf-8") as f:
+                self.recordings = json.load(f)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self.models = SimpleNamespace(generate_content=self.generate_content, generate_content_stream=self.generate_content_stream)
+        self.caches = SimpleNamespace(create=self.create_cache, delete=lambda name: self.documents.pop(name, None))
+
+    def wait(self, latency : float = None):
+        """
+        Sleeps for the configured latency and raises an injected failure with the configured probability.
+        """
+        with self._lock:
+            self.calls += 1
+            latency = self.latency if latency is None else latency
+            delay = max(0.0, latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep(delay)
+        if fail:
+            raise InjectedFailure("Injected failure")
+
+    def respond(self, contents, config : dict):
+        """
+        Returns the response text of a request: the recorded one if available, otherwise a synthetic one.
+        """
+        document, prompt = self.split_request(contents, config)
+        item_model = _item_model(config)
+        recorded = self.recordings.get(record_key(document, prompt, item_model))
+        if recorded is not None:
+            return recorded
+        if "previous answer was cut off" in prompt:
+            return "[]"
+        seed = int(hashlib.sha1((document or prompt).encode("utf-8")).hexdigest()[:8], 16)
+        if item_model == "Argument":
+            return json.dumps(synthetic_arguments(document or "", seed))
+        if item_model == "Correction":
+            return json.dumps(synthetic_corrections(document or "", seed))
+        return "This is a replayed response."
+
+    def usage(self, contents, config : dict, text : str):
+        document, prompt = self.split_request(contents, config)
+        cached = len(document) // 4 if document is not None and (config or {}).get("cached_content") else 0
+        return SimpleNamespace(prompt_token_count=(len(document or "") + len(prompt)) // 4,
+                               candidates_token_count=len(text) // 4, cached_content_token_count=cached)
+
+    def generate_content(self, model : str, contents, config : dict = None):
+        self.wait()
+        text = self.respond(contents, config)
+        return SimpleNamespace(text=text, usage_metadata=self.usage(contents, config, text))
+
+    def generate_content_stream(self, model : str, contents, config : dict = None):
+        # The first chunk takes the full latency, later chunks arrive quickly
+        self.wait()
+        text = self.respond(contents, config)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for i, chunk in enumerate(chunks):
+            last = i == len(chunks) - 1
+            yield SimpleNamespace(text=chunk, usage_metadata=self.usage(contents, config, text) if last else None)
+            time.sleep(self.latency / 50)
+
+class ReplayAgent:
+    """
+    Stand-in for the agno feedback assistant.
+
+    Attributes:
+        description (str): The description the agent was created with.
+        model: Object with the model id.
+    """
+
+    def __init__(self, summary : str, transport : ReplayClient):
+        self.description = summary
+        self.model = SimpleNamespace(id="replay-sonar")
+        self.run_response = None
+        self._transport = transport
+
+    def run(self, prompt : str, stream : bool = False):
+        self._transport.wait()
+        recorded = self._transport.recordings.get(record_key(None, prompt, "agent"))
+        if recorded is not None:
+            content = recorded
+        elif "papers" in prompt and "general" in prompt:
+            content = json.dumps({
+                "papers": [{"title": f"Replayed paper {i}", "authors": "A. Author", "year": 2020 + i,
+                            "url": f"https://example.org/paper{i}", "abstract": "A replayed abstract."} for i in range(3)],
+                "general": "These papers can be used to improve the argument.",
+            })
+        else:
+            content = "This is replayed feedback on the paper draft [1]."
+        citations = SimpleNamespace(urls=[SimpleNamespace(url="https://example.org/source")])
+        self.run_response = SimpleNamespace(content=content, citations=citations)
+        if stream:
+            return self._stream(content)
+        return self.run_response
+
+    def _stream(self, content : str):
+        # Like agno, the chunks are RunResponse-like objects with the text in .content
+        size = self._transport.chunk_size
+        for start in range(0, len(content), size):
+            yield SimpleNamespace(content=content[start:start + size], citations=None)
+
+class RecordingClient(_Transport):
+    """
+    Wraps a real google.genai client and records the text of every response,
+    keyed with record_key, so the responses can be replayed with ReplayClient.
+    """
+
+    def __init__(self, client, path : str):
+        super().__init__()
+        self._client = client
+        self.path = path
+        self.recordings = {}
+        self.models = SimpleNamespace(generate_content=self.generate_content, generate_content_stream=self.generate_content_stream)
+        self.caches = SimpleNamespace(create=self.create_cache, delete=client.caches.delete)
+
+    def create_cache(self, model : str, config : dict):
+        cache = self._client.caches.create(model=model, config=config)
+        with self._lock:
+            self.documents[cache.name] = config["contents"][0]
+        return cache
+
+    def _store(self, contents, config : dict, text : str):
+        document, prompt = self.split_request(contents, config)
+        with self._lock:
+            self.recordings[record_key(document, prompt, _item_model(config))] = text
+
+    def generate_content(self, model : str, contents, config : dict = None):
+        response = self._client.models.generate_content(model=model, contents=contents, config=config)
+        if response.text is not None:
+            self._store(contents, config, response.text)
+        return response
+
+    def generate_content_stream(self, model : str, contents, config : dict = None):
+        parts = []
+        for chunk in self._client.models.generate_content_stream(model=model, contents=contents, config=config):
+            parts.append(chunk.text or "")
+            yield chunk
+        self._store(contents, config, "".join(parts))
+
+    def record_agent(self, agent):
+        """
+        Wraps a real agno agent so its responses are recorded as well.
+
+        Args:
+            agent: The agno Agent.
+
+        Returns:
+            The wrapped agent.
+        """
+        recorder = self
+        class RecordingAgent:
+            description = agent.description
+            model = agent.model
+            memory = agent.memory
+            def run(self, prompt : str, stream : bool = False):
+                if stream:
+                    return self._stream(prompt)
+                response = agent.run(prompt)
+                with recorder._lock:
+                    recorder.recordings[record_key(None, prompt, "agent")] = response.content
+                return response
+            def _stream(self, prompt : str):
+                parts = []
+                for chunk in agent.run(prompt, stream=True):
+                    parts.append(chunk.content or "")
+                    yield chunk
+                with recorder._lock:
+                    recorder.recordings[record_key(None, prompt, "agent")] = "".join(parts)
+            @property
+            def run_response(self):
+                return agent.run_response
+        return RecordingAgent()
+
+    def save(self):
+        """
+        Writes the recorded responses to the recording file.
+        """
+        with self._lock, open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.recordings, f)
+
+def synthetic_arguments(text : str, seed : int, per_chars : int = 6000, limit : int = 40):
+    """
+    Builds arguments whose context is a verbatim piece of a paragraph of the text.
+    """
+    rng = random.Random(seed)
+    paragraphs = [paragraph for paragraph in text.split("\n\n") if len(paragraph) > 80]
+    count = min(limit, len(paragraphs), max(1, len(text) // per_chars))
+    arguments = []
+    for paragraph in sorted(rng.sample(paragraphs, count), key=text.find):
+        context = paragraph[:220].rsplit(" ", 1)[0]
+        arguments.append({
+            "context": context,
+            "claim": context[:80],
+            "evidence": "The evidence given in the paragraph.",
+            "counterargument": "",
+            "feedback": "The claim is not fully supported by the evidence.",
+            "actionable_feedback": "Add a reference that supports the claim.",
+        })
+    return arguments
+
+def synthetic_corrections(text : str, seed : int, per_chars : int = 400):
+    """
+    Builds corrections for random words of the text, with a few words of context around them.
+    """
+    rng = random.Random(seed)
+    words = list(WORD.finditer(text))
+    corrections = []
+    for match in sorted(rng.sample(words, min(len(words), max(1, len(text) // per_chars))), key=lambda match: match.start()):
+        start = text.rfind(" ", 0, max(0, match.start() - 15)) + 1
+        end = text.find(" ", match.end() + 15)
+        end = len(text) if end == -1 else end
+        corrections.append({
+            "error": match.group(),
+            "context": text[start:end],
+            "suggestion": match.group().capitalize(),
+            "offset": match.start(),
+            "length": len(match.group()),
+            "type": rng.choice(CORRECTION_TYPES),
+        })
+    return corrections
+
+@contextmanager
+def install(client, agent_factory=None):
+    """
+    Makes the app use a replay (or recording) client and replay agents.
+
+    Args:
+        client: The ReplayClient or RecordingClient.
+        agent_factory: Function (summary, api_key) -> agent. Defaults to ReplayAgents on the client.
+    """
+    if agent_factory is None:
+        agent_factory = lambda summary, api_key: ReplayAgent(summary, client)
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch("src.llm_client.get_client", lambda api_key: client))
+        stack.enter_context(mock.patch("src.assistant.create_agent", agent_factory))
+        stack.enter_context(mock.patch("src.literature.create_agent", agent_factory))
+        stack.enter_context(mock.patch("src.analysis.create_agent", agent_factory))
+        yield client
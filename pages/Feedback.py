@@ -6,23 +6,33 @@ It shows the uploaded paper, provides three types of AI-generated feedback (Gene
 and includes a chat-based feedback assistant.
 
 Features:
-- Displays uploaded paper text
+- Displays uploaded paper text, page by page for long papers
 - Provides general, argument-based, and correction feedback
-- Interactive chat assistant for further questions and literature search
+- Interactive chat assistant for further questions and literature search, with streamed answers
 - Session state management for feedback, arguments, corrections, and chat history
 - Custom CSS styling
+- Analyses and literature requests run as background jobs, polled by a fragment so the page never blocks
+- The paper pane, argument cards, corrections list and chat are fragments, an interaction reruns only its part
+- Tracing spans for the page run, agent initialization and chat turns
 """
 
 import time
 import streamlit as st
-from agno.agent import Agent
-from textwrap import dedent
-from agno.models.perplexity import Perplexity
-from src.display_text import display_citations, display_feedback, display_message, display_text
-from src.find_arguments import generate_arguments
-
-tic_overall = time.time()
-print(f"Starting the app... It's now {time.localtime().tm_hour}:{time.localtime().tm_min}:{time.localtime().tm_sec}")
+from src.display_text import display_citations, display_feedback, display_paper
+from src.assistant import create_agent
+from src.analysis import ANALYSIS_KEYS, FEEDBACK_TYPE_KEYS, analysis_running, collect_analysis, submit_analysis
+from src.literature import collect_literature, prefetch_literature
+from src.retrieval import get_passage_index
+from src.chat import add_turn, chat_prompt, get_chat_history, stream_answer
+from src.correction_store import CorrectionStore
+from src.tracing import Span, record, span, start_metrics_server
+
+# Seconds between two checks for finished analyses while they run
+POLL_INTERVAL = 1.0
+
+# The page run is recorded by hand, the whole script can't be one with block
+page_span = Span("page_run", {})
+start_metrics_server()
 
 st.set_page_config(
     page_title="Paper Feedback Tool", 
@@ -48,16 +58,75 @@ def instructions():
     st.write("3. **Corrections**: Corrections for spelling, grammar, and style in your paper draft.")
     st.write("A **feedback assistant** is available in the sidebar. You can ask it anything about your paper draft or relevant literature.")
 
+def poll_background_work():
+    """
+    Picks up the progress and results of the analysis jobs of this session and shows what is still running.
+    Runs as a fragment every POLL_INTERVAL seconds, so only this part of the page reruns while nothing
+    new can be shown. The whole page is rerun when the selected feedback type has new results or
+    streamed items, or when all analyses are done. Literature is picked up by the argument cards themselves.
+    """
+    feedback_type = st.session_state["feedback_type"]
+    changed = collect_analysis()
+    if FEEDBACK_TYPE_KEYS[feedback_type] in changed:
+        st.rerun()
+    if changed and not analysis_running():
+        st.rerun()
+    running = [key.replace("_llm", "").replace("_", " ") for key in ANALYSIS_KEYS if key in st.session_state.get("analysis_jobs", {})]
+    if running:
+        st.caption(f"Working on: {', '.join(running)}...")
+
+@st.fragment
+def display_chat():
+    """
+    Displays the chat with the feedback assistant and answers new questions.
+    The chat is a fragment, so a chat turn reruns only the sidebar. The answer is streamed, and the
+    conversation is kept within a token budget (see chat.py).
+    """
+    chat_container = st.container(height=610, border=False, key="chat_container")
+    with chat_container:
+        if get_chat_history()["dropped"]:
+            st.caption("Older messages are no longer shown, the assistant keeps a summary of them.")
+        chat = st.container(height=520, border=False)
+        with chat:
+            for message in st.session_state.messages:
+                with st.chat_message(message["role"]):
+                    st.write(message["content"], unsafe_allow_html=True) 
+                    if message["role"] == "assistant" and message["citations"] is not None:
+                        display_citations(message["citations"])
+        # Handle chat input and response
+        if prompt := st.chat_input("Ask me about your pdf!"):
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            with chat:
+                with st.chat_message("user"):
+                    st.write(prompt)
+                with st.chat_message("assistant"), span("chat", prompt_chars=len(prompt)) as chat_span:
+                    agent = st.session_state["agent"]
+                    scoped_prompt = chat_prompt(prompt)
+                    # The answer is shown as it is generated, the citations come with the last chunk
+                    content = st.write_stream(stream_answer(agent, scoped_prompt, chat_span))
+                    if not isinstance(content, str):
+                        content = "".join(str(part) for part in content)
+                    citations = agent.run_response.citations
+                    if citations is not None:
+                        display_citations(citations)
+                    chat_span.set(model=agent.model.id, scoped_prompt_chars=len(scoped_prompt), response_chars=len(content))
+                    st.session_state["test_citations"] = citations
+            st.session_state.messages.append({"role": "assistant", "content": content, "citations": citations})
+            add_turn(prompt, content, agent)
+
 # Initialize session state for dry run/testing
-if st.session_state["dry_run"] == True:
+if st.session_state.get("dry_run") == True:
     st.session_state["feedback_type"] = "General"
-    st.session_state["arguments"] = {"arguments": [{"context" : "This is context.",
-                                                    "parts" : {"claim" : "This is claim.", "evidence" : "This is evidence."},
-                                                    "counterargument" : "This is counterargument.",
-                                                    "feedback" : "This is feedback.",
-                                                    "actionable_feedback" : "This is actionable feedback."}]}
+    # Same shape as the output of extract_arguments, which display_feedback expects
+    st.session_state["arguments"] = [{"context" : "This is context.",
+                                      "claim" : "This is claim.",
+                                      "evidence" : "This is evidence.",
+                                      "counterargument" : "This is counterargument.",
+                                      "feedback" : "This is feedback.",
+                                      "actionable_feedback" : "This is actionable feedback."}]
+    st.session_state["updated_arguments"] = [False]
     st.session_state["general_feedback"] = "This is general feedback."
-    st.session_state["corrections_llm"] = []
+    st.session_state["corrections_llm"] = CorrectionStore.from_items([])
 
 # Set default feedback type if not set
 if "feedback_type" not in st.session_state:
@@ -85,58 +154,9 @@ if st.session_state["feedback_type"] == "Corrections":
 
 # Initialize the feedback agent if not already in session state
 if "agent" not in st.session_state:
-    tic = time.time()
-    researcher = Agent(
-        model=Perplexity(id="sonar-pro", api_key=st.secrets["PERPLEXITY_API_KEY"]),
-        debug_mode=True,
-        description=dedent(f"""
-            You are an academic assistant that provides feedback on research paper drafts. 
-            The user has uploaded a draft, which is at the end of this description.
-            This can be a scientific paper, a thesis, or any other type of research-related document.
-            It is important to note that it can also be part of a larger document. 
-            Please keep this in mind when providing feedback.
-            You can be asked by the system to provide feedback on the paper,
-            but you can also be asked anything else by the user.
-
-            You also can be asked to generate new text or provide scientific papers on a certain topic. 
-                       
-            Always search your knowledge base before answering questions. 
-            You may reference uploaded documents directly even if they don't include formal citations.
-            If relevant information exists, include it in your response. 
-            If no relevant data is found, politely ask the user for clarification.
-                       
-            Always cite your sources in a scientific style. Preferably, these sources are scientific papers.
-            In your text, use square brackets to indicate the citations, e.g. [1].
-                           
-            What follows is the user's uploaded paper draft:
-            {st.session_state["text"]}\
-            """),
-        instructions=[
-            "When asked a question about the user's paper, first search your memory.",
-            "When asked about existing literature, provide scientific papers from reliable sources.",
-            "Always provide scientific citations.",
-            "Make sure not to go over 1024 tokens in your response.",
-        ],
-        markdown=True,
-    )
+    with span("agent_init"):
+        researcher = create_agent(get_passage_index().summary, st.secrets["PERPLEXITY_API_KEY"])
     st.session_state["agent"] = researcher
-    toc = time.time()
-    print(f"Initializing agent took {toc - tic:.2f} seconds")
-
-# Generate general feedback if not already present
-if "general_feedback" not in st.session_state:
-    agent = st.session_state["agent"]
-    query = f"Given the user's paper draft text, provide general feedback on it, no longer than 150 words. Don't cite anything."
-    general_feedback = agent.run(query)
-    st.session_state["general_feedback"] = general_feedback.content
-
-# Generate corrections using LLM if not already present
-if "corrections_llm" not in st.session_state:
-    tic = time.time()
-    from src.text_corrections import get_corrections_llm
-    get_corrections_llm()
-    toc = time.time()
-    print(f"Text correction (llm) took {toc - tic:.2f} seconds")
 
 # Initialize chat messages if not already present
 if "messages" not in st.session_state:
@@ -146,46 +166,25 @@ if "messages" not in st.session_state:
         "citations": None
     }]
 
-# Generate arguments if not already present
-if "arguments" not in st.session_state:
-    tic = time.time()
-    generate_arguments()
-    toc = time.time()
-    print(f"Argument generation took {toc - tic:.2f} seconds")
+# Start the pending analyses in the background and pick up what finished since the last rerun
+submit_analysis()
+collect_analysis()
+collect_literature()
+
+# Prefetch literature for the first arguments while the user reads the general feedback
+if st.session_state["feedback_type"] == "General":
+    prefetch_literature()
 
 # Layout: left column (paper), right column (feedback), sidebar (chat)
 left_col, right_col = st.columns(spec=[8,6], border=True)
 
 with left_col:
     st.subheader("Your Paper")
-    text_container = st.container(height=705, border=False, key="text_container")
-    with text_container:
-        display_text()
+    display_paper()
 
 with st.sidebar:
     st.header("Feedback Assistant")
-    chat_container = st.container(height=610, border=False, key="chat_container")
-    with chat_container:
-        chat = st.container(height=520, border=False)
-        with chat:
-            for message in st.session_state.messages:
-                with st.chat_message(message["role"]):
-                    st.write(message["content"], unsafe_allow_html=True) 
-                    if message["role"] == "assistant" and message["citations"] is not None:
-                        display_citations(message["citations"])
-        # Handle chat input and response
-        if prompt := st.chat_input("Ask me about your pdf!"):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with chat:
-                with st.chat_message("user"):
-                    st.write(prompt)
-                with st.chat_message("assistant"):
-                    with st.spinner("Thinking of a response..."):
-                        agent = st.session_state["agent"]
-                        response = agent.run(prompt)
-                        st.session_state["test_citations"] = response.citations
-                        message = display_message(response.content, response.citations)
-                st.session_state.messages.append({"role": "assistant", "content": message, "citations": response.citations})
+    display_chat()
 
 with right_col:
     st.subheader("Feedback")
@@ -202,6 +201,9 @@ with right_col:
         if st.button("Corrections", key="correct", type="secondary"):
             st.session_state["feedback_type"] = "Corrections"
             st.rerun()
+    # Poll the analysis jobs only while there are any, the next full run stops the polling
+    if analysis_running():
+        st.fragment(poll_background_work, run_every=POLL_INTERVAL)()
     display_feedback()
 
 # Show instructions dialog on first load
@@ -209,5 +211,5 @@ if "instructions_done" not in st.session_state:
     instructions()
     st.session_state["instructions_done"] = True
 
-toc_overall = time.time()
-print(f"Overall execution time: {toc_overall - tic_overall:.2f} seconds")
+page_span.set(feedback_type=st.session_state["feedback_type"])
+record(page_span, time.time() - page_span.start)
@@ -0,0 +1,305 @@
+"""
+analysis.py
+
+Runs the initial analysis of the user's paper draft for the feedback page.
+General feedback, corrections and argument extraction are independent LLM calls, so they are
+submitted together as background jobs (see jobs.py). The page never waits for them: it picks up
+progress and results whenever it runs.
+
+Features:
+- Concurrent general feedback, correction and argument generation on a process-wide job queue
+- Jobs survive reruns and are merged with jobs for the same document
+- Results are written to Streamlit session state from the script thread only
+- Streamed arguments and corrections, collected in partial lists while the rest is generated
+- Failed analyses are reported, and submitted again when the user retries
+- The analyses read the prepared text (see preprocess.py), their results are anchored back in the displayed text
+- A revised draft is analysed incrementally against the previous version (see incremental.py)
+- Results are cached on disk, set st.session_state["bypass_cache"] to force new LLM calls
+- Tracing spans for each analysis, recorded under the session that submitted it
+"""
+
+import copy
+import json
+import streamlit as st
+from src.cache import ANALYSIS_CACHE
+from src.llm_client import model_stats
+from src.document_session import MIN_CACHE_CHARS, get_document_session
+from src.assistant import create_agent
+from src.find_arguments import extract_arguments
+from src.text_corrections import find_corrections
+from src.incremental import update_arguments, update_corrections
+from src.render_cache import bump_version
+from src.correction_store import CorrectionStore
+from src.jobs import JobQueue, document_key, job_outcome
+from src.preprocess import get_prepared_text
+from src.retrieval import get_passage_index
+from src.tracing import span
+
+# Session state keys filled by the analysis stage, in the order they are shown to the user
+ANALYSIS_KEYS = ["general_feedback", "corrections_llm", "arguments"]
+
+# Session state key holding the result shown for each feedback type
+FEEDBACK_TYPE_KEYS = {
+    "General": "general_feedback",
+    "Arguments": "arguments",
+    "Corrections": "corrections_llm",
+}
+
+# Session state keys of the analyses that are updated incrementally for a revised draft
+INCREMENTAL_KEYS = ["corrections_llm", "arguments"]
+
+# Maximum number of analyses running at the same time, over all sessions
+ANALYSIS_WORKERS = 12
+
+# Process-wide queue running the analyses of all sessions
+ANALYSIS_JOBS = JobQueue("analysis", ANALYSIS_WORKERS)
+
+GENERAL_FEEDBACK_QUERY = "Given the user's paper draft text, provide general feedback on it, no longer than 150 words. Don't cite anything."
+
+# General feedback is about the whole draft, so this one-off (cached) request carries the full text
+GENERAL_FEEDBACK_PROMPT = """{query}
+
+The user's paper draft:
+{text}"""
+
+def get_general_feedback(agent, text : str, use_cache : bool = True):
+    """
+    Asks the feedback agent for general feedback on the paper draft.
+
+    Args:
+        agent: The agno Agent holding the summary of the paper draft.
+        text (str): The paper draft text.
+        use_cache (bool): If False, bypass the analysis cache.
+
+    Returns:
+        str: The general feedback.
+    """
+    cache_key = ANALYSIS_CACHE.key(agent.description, GENERAL_FEEDBACK_PROMPT, GENERAL_FEEDBACK_QUERY, agent.model.id, text)
+    cached = ANALYSIS_CACHE.get(cache_key, bypass=not use_cache)
+    if cached is not None:
+        print("Using cached general feedback")
+        return cached
+    response = agent.run(GENERAL_FEEDBACK_PROMPT.format(query=GENERAL_FEEDBACK_QUERY, text=text))
+    ANALYSIS_CACHE.set(cache_key, response.content, bypass=not use_cache)
+    return response.content
+
+def pending_analyses():
+    """
+    Returns the session state keys of the analyses that still have to run.
+
+    Returns:
+        list: Keys from ANALYSIS_KEYS that are not yet in session state.
+    """
+    return [key for key in ANALYSIS_KEYS if key not in st.session_state]
+
+def store_analysis(key : str, result):
+    """
+    Stores the result of one analysis in session state.
+    Corrections are validated once and stored as a CorrectionStore.
+    Must be called from the Streamlit script thread.
+
+    Args:
+        key (str): The session state key of the analysis.
+        result: The result returned by the analysis function. It is copied, a merged job returns
+            the same result to every session that joined it.
+    """
+    result = copy.deepcopy(result)
+    if key == "corrections_llm":
+        result = CorrectionStore.from_items(result)
+    st.session_state[key] = result
+    bump_version(key)
+    if key == "arguments":
+        # Arguments carried over from a previous version keep their literature
+        st.session_state["updated_arguments"] = [isinstance(argument["counterargument"], dict) for argument in result]
+
+def _release_job(job_id : str):
+    """
+    Releases an analysis job of the session, cancelling it if it is queued and not shared with another session.
+    """
+    job = ANALYSIS_JOBS.get(job_id)
+    if job is not None:
+        job.release()
+
+def archive_analysis():
+    """
+    Keeps the corrections and arguments of the current text as the previous version and clears
+    the analysis, when a revised draft is uploaded. The revised draft is then analysed
+    incrementally against the previous version. If the current text has no results yet,
+    an older previous version is kept. Queued analyses of the current text are cancelled,
+    unless another session waits for them too.
+    """
+    for job_id in st.session_state.get("analysis_jobs", {}).values():
+        _release_job(job_id)
+    if "text" in st.session_state and any(key in st.session_state for key in INCREMENTAL_KEYS):
+        previous = {"text": get_prepared_text().text}
+        for key in INCREMENTAL_KEYS:
+            if key in st.session_state:
+                previous[key] = st.session_state[key]
+        st.session_state["previous_analysis"] = previous
+    # The agent holds the summary of the old text
+    for key in ANALYSIS_KEYS + ["updated_arguments", "partial_analysis", "analysis_jobs", "analysis_errors", "agent"]:
+        st.session_state.pop(key, None)
+
+def incremental_base(key : str, text : str, previous : dict):
+    """
+    Returns the previous version an analysis is updated from, if it is run incrementally.
+
+    Args:
+        key (str): The session state key of the analysis.
+        text (str): The paper draft text.
+        previous (dict): The text and results of the previous version of the draft, or None.
+
+    Returns:
+        dict: The previous version, or None if the analysis runs from scratch.
+    """
+    if previous is not None and key in previous and previous["text"] != text:
+        return previous
+    return None
+
+def previous_version_key(key : str, text : str, previous : dict):
+    """
+    Returns the part of the job key that identifies the previous version an analysis is updated from,
+    so sessions with different previous versions don't join each other's incremental jobs.
+
+    Returns:
+        str: The hex SHA-256 digest of the previous text and results, or None if the analysis runs from scratch.
+    """
+    base = incremental_base(key, text, previous)
+    if base is None:
+        return None
+    results = base[key].to_items() if isinstance(base[key], CorrectionStore) else base[key]
+    return document_key(json.dumps([base["text"], results], sort_keys=True, default=str))
+
+def analysis_job(key : str, text : str, api_key : str, use_cache : bool, agent, previous : dict = None):
+    """
+    Returns the job function of an analysis. It doesn't touch session state, so it can run on a worker.
+    Arguments and corrections are streamed, each generated item is reported to the job as progress.
+    With a previous version, they are updated incrementally instead of generated from scratch.
+
+    Args:
+        key (str): The session state key of the analysis.
+        text (str): The paper draft text.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        agent: A feedback agent of the job's own, used for general feedback.
+        previous (dict): The text and results of the previous version of the draft, or None.
+
+    Returns:
+        The function, called with the Job.
+    """
+    def run(job):
+        with span("analysis", analysis=key):
+            if key == "general_feedback":
+                return get_general_feedback(agent, text, use_cache)
+            incremental = incremental_base(key, text, previous) is not None
+            if key == "corrections_llm" and incremental:
+                return update_corrections(previous["text"], previous[key], text, api_key, use_cache, job.add_item)
+            if key == "corrections_llm":
+                return find_corrections(text, api_key, use_cache, None, job.add_item)
+            if incremental:
+                return update_arguments(previous["text"], previous[key], text, api_key, use_cache, job.add_item)
+            return extract_arguments(text, api_key, use_cache, job.add_item)
+    return run
+
+def submit_analysis():
+    """
+    Submits a background job for every pending analysis that has no job or error yet, and returns
+    immediately. The job IDs are kept in st.session_state["analysis_jobs"]; a job for the same
+    document that is already queued, running or finished (e.g. started before a reconnect, or by
+    another session) is joined instead of starting a new one.
+    """
+    jobs = st.session_state.setdefault("analysis_jobs", {})
+    errors = st.session_state.setdefault("analysis_errors", {})
+    pending = [key for key in pending_analyses() if key not in jobs and key not in errors]
+    if not pending:
+        return
+
+    # Read everything the workers need up front, worker threads have no script context
+    text = get_prepared_text().text
+    api_key = str(st.secrets["GEMINI_API_KEY"])
+    use_cache = not st.session_state.get("bypass_cache", False)
+    # General feedback gets its own agent, the session's agent is used by the chat at the same time
+    agent = create_agent(get_passage_index().summary, str(st.secrets["PERPLEXITY_API_KEY"])) if "general_feedback" in pending else None
+    previous = st.session_state.get("previous_analysis")
+    for key in pending:
+        job_key = (key, document_key(text), use_cache, previous_version_key(key, text, previous))
+        job = ANALYSIS_JOBS.submit(job_key, analysis_job(key, text, api_key, use_cache, agent, previous))
+        if jobs.get(key) not in (None, job.job_id):
+            _release_job(jobs[key])
+        jobs[key] = job.job_id
+        print(f"Analysis '{key}' is job {job.job_id} ({job.status})")
+
+def collect_analysis():
+    """
+    Picks up the progress and results of the analysis jobs of this session.
+    Finished results are stored in session state, streamed items are copied to
+    st.session_state["partial_analysis"] and failures to st.session_state["analysis_errors"].
+    Must be called from the Streamlit script thread.
+
+    Returns:
+        set: The session state keys of the analyses that finished or streamed new items.
+    """
+    jobs = st.session_state.get("analysis_jobs", {})
+    partial = st.session_state.setdefault("partial_analysis", {})
+    errors = st.session_state.setdefault("analysis_errors", {})
+    changed = set()
+    for key, job_id in list(jobs.items()):
+        job = ANALYSIS_JOBS.get(job_id)
+        if job is None:
+            # Expired before this session collected it, it is submitted again on the next run
+            del jobs[key]
+            continue
+        if not job.done():
+            items = job.items()
+            if len(items) != len(partial.get(key, [])):
+                partial[key] = items
+                changed.add(key)
+            continue
+        del jobs[key]
+        job.release()
+        partial.pop(key, None)
+        changed.add(key)
+        result, error = job_outcome(job)
+        if result is None:
+            print(f"Analysis '{key}' failed: {error}")
+            errors[key] = error
+            continue
+        store_analysis(key, result)
+    if changed and not jobs:
+        text = get_prepared_text().text
+        print(f"Analysis cache: {ANALYSIS_CACHE.stats()}")
+        print(f"Model statistics: {model_stats()}")
+        if len(text) >= MIN_CACHE_CHARS:
+            print(f"Document session: {get_document_session(str(st.secrets['GEMINI_API_KEY']), text).stats()}")
+        print(f"Analysis jobs: {ANALYSIS_JOBS.stats()}")
+    return changed
+
+def analysis_running():
+    """
+    Returns whether this session is waiting for analysis jobs.
+
+    Returns:
+        bool: True if any analysis job hasn't been collected yet.
+    """
+    return bool(st.session_state.get("analysis_jobs"))
+
+def analysis_error(key : str):
+    """
+    Returns the error of a failed analysis.
+
+    Args:
+        key (str): The session state key of the analysis.
+
+    Returns:
+        str: The error message, or None if the analysis didn't fail.
+    """
+    return st.session_state.get("analysis_errors", {}).get(key)
+
+def retry_analysis(key : str):
+    """
+    Forgets the error of a failed analysis, so it is submitted again on the next run.
+
+    Args:
+        key (str): The session state key of the analysis.
+    """
+    st.session_state.get("analysis_errors", {}).pop(key, None)
@@ -0,0 +1,64 @@
+"""
+assistant.py
+
+Provides the feedback assistant agent used for general feedback, literature suggestions and the chat.
+
+Features:
+- Creates Perplexity-backed agno agents holding a summary of the user's paper draft
+- Relevant passages of the draft are sent with each request (see retrieval.py)
+"""
+
+from textwrap import dedent
+from agno.agent import Agent
+from agno.models.perplexity import Perplexity
+
+# Perplexity model used by the feedback assistant
+ASSISTANT_MODEL = "sonar-pro"
+
+def create_agent(summary : str, api_key : str):
+    """
+    Creates a feedback assistant agent for a paper draft.
+    Agents keep per-run state, so every thread that runs requests at the same time needs its own agent.
+    The agent only holds a summary of the draft, the passages relevant to a request are sent with the request.
+
+    Args:
+        summary (str): The summary of the paper draft, see PassageIndex.summary.
+        api_key (str): The Perplexity API key.
+
+    Returns:
+        Agent: The agno agent.
+    """
+    return Agent(
+        model=Perplexity(id=ASSISTANT_MODEL, api_key=api_key),
+        debug_mode=True,
+        description=dedent(f"""
+            You are an academic assistant that provides feedback on research paper drafts. 
+            The user has uploaded a draft. A summary of it is at the end of this description,
+            and the passages of the draft that are relevant to a request are included with the request.
+            This can be a scientific paper, a thesis, or any other type of research-related document.
+            It is important to note that it can also be part of a larger document. 
+            Please keep this in mind when providing feedback.
+            You can be asked by the system to provide feedback on the paper,
+            but you can also be asked anything else by the user.
+
+            You also can be asked to generate new text or provide scientific papers on a certain topic. 
+                       
+            Always search your knowledge base before answering questions. 
+            You may reference uploaded documents directly even if they don't include formal citations.
+            If relevant information exists, include it in your response. 
+            If no relevant data is found, politely ask the user for clarification.
+                       
+            Always cite your sources in a scientific style. Preferably, these sources are scientific papers.
+            In your text, use square brackets to indicate the citations, e.g. [1].
+                           
+            What follows is a summary of the user's uploaded paper draft:
+            {summary}\
+            """),
+        instructions=[
+            "When asked a question about the user's paper, first search your memory.",
+            "When asked about existing literature, provide scientific papers from reliable sources.",
+            "Always provide scientific citations.",
+            "Make sure not to go over 1024 tokens in your response.",
+        ],
+        markdown=True,
+    )
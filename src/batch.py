@@ -0,0 +1,356 @@
+"""
+batch.py
+
+Runs the feedback pipeline over a folder of PDFs without the Streamlit app, e.g. to pre-compute
+the feedback for a whole cohort of submissions overnight. The stages are the ones the app runs
+(extraction, preprocessing, general feedback, corrections, arguments and literature), called
+without session state. Documents are processed by a pool of worker processes, with a bound on the
+number of LLM requests in flight over all workers.
+
+Each document gets one JSON result in the output folder, written atomically when the document is
+done. PDFs in subfolders are included, their results go to the same subfolders of the output folder. A run that is interrupted can be started again with the same arguments: documents with a
+complete result for the same PDF are skipped, failed and missing ones are processed again.
+
+Usage:
+    python -m src.batch submissions/ --output results/ --workers 4 --llm-concurrency 16
+
+The API keys are read from the GEMINI_API_KEY and PERPLEXITY_API_KEY environment variables, or
+from .streamlit/secrets.toml like the app does.
+
+Features:
+- Session-free pipeline for one PDF (process_document)
+- Process pool over the documents, bounded LLM concurrency per worker process
+- One JSON result per document, named after its path in the folder, with the offsets of corrections and arguments in the extracted text
+- Resumable: complete results of unchanged PDFs are kept
+- Shares the analysis cache with the app, so documents the app has seen are not analysed again
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from src.analysis import get_general_feedback
+from src.assistant import create_agent
+from src.extract_text import extract_text
+from src.find_arguments import extract_arguments
+from src.literature import LITERATURE_WORKERS, fetch_literature
+from src.llm_client import request_slot, set_request_limit
+from src.preprocess import prepare_text
+from src.retrieval import PassageIndex
+from src.text_corrections import find_corrections
+from src.text_index import NormalizedText, locate_arguments, locate_corrections
+from src.tracing import flush_traces, span
+
+# Default number of worker processes, each processes one document at a time
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+# Default maximum number of LLM requests in flight over all worker processes
+DEFAULT_LLM_CONCURRENCY = 16
+# Version of the result format, results of another version are processed again
+RESULT_VERSION = 1
+
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+API_KEYS = ("GEMINI_API_KEY", "PERPLEXITY_API_KEY")
+
+def load_api_keys():
+    """
+    Reads the API keys from the environment, or from the Streamlit secrets file.
+
+    Returns:
+        dict: The keys by name, see API_KEYS.
+
+    Raises:
+        KeyError: If a key is missing.
+    """
+    secrets = {}
+    if os.path.exists(SECRETS_FILE):
+        with open(SECRETS_FILE, "rb") as file:
+            secrets = tomllib.load(file)
+    keys = {}
+    for name in API_KEYS:
+        value = os.environ.get(name) or secrets.get(name)
+        if not value:
+            raise KeyError(f"{name} is not set in the environment or in {SECRETS_FILE}")
+        keys[name] = str(value)
+    return keys
+
+def file_digest(data : bytes):
+    """
+    Returns the hex SHA-256 digest of a PDF, used to recognize unchanged documents when resuming.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def result_path(output : str, name : str):
+    """
+    Returns the path of the JSON result of a PDF, e.g. "results/cohort/a.pdf.json" for "cohort/a.pdf".
+    The extension is kept, so "a.pdf" and "a.PDF" don't share a result.
+
+    Args:
+        output (str): The output folder.
+        name (str): The path of the PDF relative to the input folder.
+    """
+    return os.path.join(output, name + ".json")
+
+def is_complete(path : str, digest : str):
+    """
+    Returns whether a result file holds the complete result of a PDF, in the current format.
+
+    Args:
+        path (str): The path of the result file.
+        digest (str): The digest of the PDF.
+
+    Returns:
+        bool: True if the document doesn't have to be processed again.
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            result = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return result.get("version") == RESULT_VERSION and result.get("sha256") == digest and not result.get("errors")
+
+def write_result(path : str, result : dict):
+    """
+    Writes a result file atomically, so an interrupted run never leaves a partial result.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def _attempt(errors : dict, stage : str, function, *args):
+    """
+    Runs a stage and records its error instead of raising it, so the other stages still run.
+
+    Returns:
+        The result of the stage, or None if it failed.
+    """
+    try:
+        result = function(*args)
+    except Exception as e:
+        errors[stage] = f"{type(e).__name__}: {e}"
+        return None
+    if result is None:
+        errors[stage] = "No valid response"
+    return result
+
+def _general_feedback(index : PassageIndex, text : str, api_key : str, use_cache : bool):
+    agent = create_agent(index.summary, api_key)
+    with request_slot():
+        return get_general_feedback(agent, text, use_cache)
+
+def _literature(index : PassageIndex, api_key : str, context : str):
+    with request_slot():
+        return fetch_literature(index, api_key, context)
+
+def process_document(data : bytes, keys : dict, use_cache : bool = True, literature : bool = True):
+    """
+    Runs the feedback pipeline on one PDF. Does not touch Streamlit session state.
+    General feedback, corrections and arguments run concurrently, then the literature for all arguments.
+    A failed stage is reported in the "errors" of the result, the other stages still run.
+
+    Args:
+        data (bytes): The PDF file contents.
+        keys (dict): The API keys, see load_api_keys.
+        use_cache (bool): If False, bypass the analysis cache.
+        literature (bool): If False, skip the literature stage.
+
+    Returns:
+        dict: The result: page count, general feedback, corrections and arguments (offsets in the
+            extracted text, "offset" -1 if an item couldn't be found) and errors per stage.
+    """
+    gemini_key = keys["GEMINI_API_KEY"]
+    perplexity_key = keys["PERPLEXITY_API_KEY"]
+    errors = {}
+    # The batch runs one document per process, the pages are extracted in this process
+    with span("pdf_extraction", pdf_bytes=len(data)):
+        text, page_offsets = extract_text(data, max_workers=1)
+    with span("preprocessing", chars=len(text)):
+        prepared = prepare_text(text, page_offsets)
+    index = PassageIndex(prepared.text)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        general = executor.submit(_attempt, errors, "general_feedback", _general_feedback, index, prepared.text, perplexity_key, use_cache)
+        corrections = executor.submit(_attempt, errors, "corrections", find_corrections, prepared.text, gemini_key, use_cache)
+        arguments = executor.submit(_attempt, errors, "arguments", extract_arguments, prepared.text, gemini_key, use_cache)
+        general, corrections, arguments = general.result(), corrections.result() or [], arguments.result() or []
+
+    if literature and arguments:
+        with ThreadPoolExecutor(max_workers=LITERATURE_WORKERS) as executor:
+            futures = [executor.submit(_attempt, errors, f"literature_{i}", _literature, index, perplexity_key, argument["context"])
+                       for i, argument in enumerate(arguments)]
+            for argument, future in zip(arguments, futures):
+                if future.result() is not None:
+                    argument["counterargument"] = future.result()
+
+    # Anchored in the extracted text like the highlights of the app, the offsets counted by the model are approximate
+    normalized = NormalizedText(prepared.text, prepared)
+    located = {id(correction): (start, end) for correction, start, end in locate_corrections(normalized, corrections)}
+    for correction in corrections:
+        start, end = located.get(id(correction), (-1, -1))
+        correction["offset"], correction["length"] = start, end - start if start != -1 else len(correction["error"])
+    positions = {i: (start, end) for i, start, end in locate_arguments(normalized, [argument["context"] for argument in arguments])}
+    for i, argument in enumerate(arguments):
+        start, end = positions.get(i, (-1, -1))
+        argument["offset"], argument["length"] = start, end - start if start != -1 else len(argument["context"])
+
+    return {
+        "pages": len(page_offsets),
+        "chars": len(text),
+        "general_feedback": general,
+        "corrections": corrections,
+        "arguments": arguments,
+        "errors": errors,
+    }
+
+def _init_worker(request_limit : int):
+    """
+    Sets up a worker process: limits its LLM requests in flight.
+    """
+    set_request_limit(request_limit)
+
+def run_document(folder : str, name : str, output : str, keys : dict, use_cache : bool = True, literature : bool = True):
+    """
+    Processes one PDF and writes its result file. Runs in a worker process.
+
+    Args:
+        folder (str): The folder with the PDFs.
+        name (str): The path of the PDF relative to the folder.
+        output (str): The output folder.
+        keys (dict): The API keys, see load_api_keys.
+        use_cache (bool): If False, bypass the analysis cache.
+        literature (bool): If False, skip the literature stage.
+
+    Returns:
+        tuple: The name of the PDF, the number of seconds it took and the stages that failed.
+    """
+    tic = time.time()
+    with open(os.path.join(folder, name), "rb") as file:
+        data = file.read()
+    result = {"version": RESULT_VERSION, "file": name, "sha256": file_digest(data)}
+    try:
+        result.update(process_document(data, keys, use_cache, literature))
+    except Exception as e:
+        # E.g. a PDF that can't be opened
+        result["errors"] = {"document": f"{type(e).__name__}: {e}"}
+    result["seconds"] = round(time.time() - tic, 2)
+    path = result_path(output, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_result(path, result)
+    # Worker processes exit without running exit handlers, so the spans are written now
+    flush_traces()
+    return name, result["seconds"], sorted(result["errors"])
+
+def pending_documents(folder : str, output : str):
+    """
+    Returns the PDFs of a folder and its subfolders that don't have a complete result yet.
+
+    Args:
+        folder (str): The folder with the PDFs.
+        output (str): The output folder.
+
+    Returns:
+        tuple: The paths of the pending PDFs relative to the folder, and the number of PDFs that are done.
+
+    Raises:
+        ValueError: If two PDFs would share a result file, e.g. on a case-insensitive file system.
+    """
+    names = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        names += [os.path.relpath(os.path.join(root, name), folder) for name in sorted(files) if name.lower().endswith(".pdf")]
+    # Checked before anything is processed, a collision would otherwise overwrite a result halfway through the run
+    seen = {}
+    for name in names:
+        other = seen.setdefault(result_path(output, name).casefold(), name)
+        if other != name:
+            raise ValueError(f"{other} and {name} would share a result file, rename one of them")
+
+    pending = []
+    done = 0
+    for name in names:
+        with open(os.path.join(folder, name), "rb") as file:
+            digest = file_digest(file.read())
+        if is_complete(result_path(output, name), digest):
+            done += 1
+        else:
+            pending.append(name)
+    return pending, done
+
+def run_batch(folder : str, output : str, workers : int = DEFAULT_WORKERS, llm_concurrency : int = DEFAULT_LLM_CONCURRENCY,
+              use_cache : bool = True, literature : bool = True):
+    """
+    Processes the pending PDFs of a folder with a pool of worker processes.
+    With one worker, the documents are processed in this process.
+
+    Args:
+        folder (str): The folder with the PDFs.
+        output (str): The output folder, created if needed.
+        workers (int): The number of worker processes.
+        llm_concurrency (int): The maximum number of LLM requests in flight over all workers.
+            Every worker needs at least one request slot, so there are at most this many workers.
+        use_cache (bool): If False, bypass the analysis cache.
+        literature (bool): If False, skip the literature stage.
+
+    Returns:
+        int: The number of documents with failed stages.
+
+    Raises:
+        ValueError: If two PDFs would share a result file, see pending_documents.
+    """
+    keys = load_api_keys()
+    os.makedirs(output, exist_ok=True)
+    pending, done = pending_documents(folder, output)
+    print(f"{len(pending)} documents to process, {done} already done")
+    if llm_concurrency < 1:
+        raise ValueError("llm_concurrency must be at least 1")
+    if workers > llm_concurrency:
+        print(f"Using {llm_concurrency} workers instead of {workers}, each worker needs at least one LLM request slot")
+        workers = llm_concurrency
+    request_limit = llm_concurrency // max(1, workers)
+    failed = 0
+    tic = time.time()
+
+    def report(finished : int, name : str, seconds : float, errors : list):
+        status = f"failed: {', '.join(errors)}" if errors else "done"
+        print(f"[{finished}/{len(pending)}] {name} {status} ({seconds:.1f} seconds)")
+
+    if workers <= 1:
+        _init_worker(request_limit)
+        for finished, name in enumerate(pending, 1):
+            name, seconds, errors = run_document(folder, name, output, keys, use_cache, literature)
+            failed += bool(errors)
+            report(finished, name, seconds, errors)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(request_limit,)) as executor:
+            futures = [executor.submit(run_document, folder, name, output, keys, use_cache, literature) for name in pending]
+            for finished, future in enumerate(as_completed(futures), 1):
+                name, seconds, errors = future.result()
+                failed += bool(errors)
+                report(finished, name, seconds, errors)
+    print(f"Processed {len(pending)} documents in {time.time() - tic:.1f} seconds, {failed} with failed stages")
+    return failed
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description="Runs the feedback pipeline over a folder of PDFs and writes one JSON result per document.")
+    parser.add_argument("folder", help="Folder with the PDFs")
+    parser.add_argument("--output", default="results", help="Folder for the JSON results (default: results)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Number of worker processes (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--llm-concurrency", type=int, default=DEFAULT_LLM_CONCURRENCY,
+                        help=f"Maximum number of LLM requests in flight over all workers (default: {DEFAULT_LLM_CONCURRENCY})")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the analysis cache")
+    parser.add_argument("--no-literature", action="store_true", help="Skip the literature for the arguments")
+    args = parser.parse_args(argv)
+    if args.llm_concurrency < 1:
+        parser.error("--llm-concurrency must be at least 1")
+    try:
+        failed = run_batch(args.folder, args.output, args.workers, args.llm_concurrency, not args.no_cache, not args.no_literature)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+cache.py
+
+Provides a persistent, content-addressed cache for LLM analysis results.
+Students often re-upload the same draft, so results are stored on disk keyed on
+everything that determines the answer: the extracted text, the prompt template,
+the model and the response schema.
+
+Features:
+- Disk-backed JSON entries keyed on a SHA-256 hash
+- LRU eviction by number of entries and total size, and expiry by age
+- Hit and miss counters
+- Bypass switch per call and globally (PAPERHELP_CACHE=off)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = os.path.join(".cache", "analysis")
+
+class AnalysisCache:
+    """
+    Disk-backed LRU cache for analysis results.
+    Each entry is a JSON file named after its key. The modification time of the file
+    is refreshed on every hit and is used as the recency for LRU eviction.
+
+    Attributes:
+        directory (str): Directory holding the cache entries.
+        max_entries (int): Maximum number of entries kept.
+        max_bytes (int): Maximum total size of the entries in bytes.
+        max_age (float): Maximum age of an entry in seconds.
+        enabled (bool): If False, every lookup is a miss and nothing is stored.
+        hits (int): Number of cache hits.
+        misses (int): Number of cache misses.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_entries=512, max_bytes=64 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = os.environ.get("PAPERHELP_CACHE", "on").lower() not in ("off", "0", "false")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """
+        Builds a cache key from the parts that determine an analysis result.
+
+        Args:
+            *parts: Strings or JSON-serializable values (text, prompt template, model, schema, ...).
+
+        Returns:
+            str: The hex SHA-256 digest of the parts.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, str):
+                part = json.dumps(part, sort_keys=True)
+            digest.update(part.encode("utf8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, bypass=False):
+        """
+        Looks up a cached result.
+
+        Args:
+            key (str): The cache key.
+            bypass (bool): If True, skip the cache and count a miss.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        path = self._path(key)
+        value = None
+        if self.enabled and not bypass:
+            try:
+                if time.time() - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+                else:
+                    with open(path, "r", encoding="utf8") as file:
+                        value = json.load(file)
+                    os.utime(path)  # Mark as recently used
+            except (OSError, ValueError):
+                value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, bypass=False):
+        """
+        Stores a result and evicts old entries if the cache is over its limits.
+
+        Args:
+            key (str): The cache key.
+            value: A JSON-serializable result.
+            bypass (bool): If True, don't store anything.
+        """
+        if not self.enabled or bypass:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf8") as file:
+                json.dump(value, file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write cache entry {key}. Reason: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the cache
+        is within its entry and size limits.
+        """
+        with self._lock:
+            entries = []
+            now = time.time()
+            try:
+                filenames = os.listdir(self.directory)
+            except OSError:
+                return
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            total_size = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self.max_entries or total_size > self.max_bytes):
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total_size -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        with self._lock:
+            if os.path.isdir(self.directory):
+                for filename in os.listdir(self.directory):
+                    self._remove(os.path.join(self.directory, filename))
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit and miss counters.
+
+        Returns:
+            dict: Number of hits, misses and the hit rate.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+# Shared cache for all sessions of the app
+ANALYSIS_CACHE = AnalysisCache()
+
+def schema_of(model):
+    """
+    Returns the JSON schema of a list of pydantic models, used as part of cache keys.
+
+    Args:
+        model: The pydantic model class of the list items.
+
+    Returns:
+        dict: The JSON schema.
+    """
+    return {"type": "array", "items": model.model_json_schema()}
@@ -0,0 +1,150 @@
+"""
+chat.py
+
+Runs the chat with the feedback assistant in the sidebar.
+The answer is streamed into the chat as it is generated, and the conversation the assistant sees
+is kept within a token budget: the most recent turns are sent as they are, older turns are folded
+into a short summary. The chat shown to the user and the agent's own run history are bounded as
+well, so the cost of a turn and the memory of a session stay flat over long conversations.
+
+Features:
+- Streamed answers, the citations are attached when the stream completes
+- Recent turns within HISTORY_TOKEN_BUDGET, older turns summarized (extractive, no extra LLM call)
+- Only the passages relevant to the question are sent, not the full paper (see retrieval.py)
+- Bounded chat messages in session state and a bounded agent run history
+"""
+
+import re
+import time
+import streamlit as st
+from src.retrieval import get_passage_index
+
+# Rough number of characters per token, used to estimate the size of the history
+CHARS_PER_TOKEN = 4
+# Estimated tokens of recent turns sent with each question
+HISTORY_TOKEN_BUDGET = 1500
+# Estimated tokens of the summary of older turns
+SUMMARY_TOKEN_BUDGET = 400
+# Maximum length in characters of a question or answer in the summary
+SUMMARY_EXCERPT_LENGTH = 160
+# Maximum number of chat messages kept in session state, the welcome message included
+MAX_MESSAGES = 40
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+CHAT_PROMPT = """Earlier in this conversation:
+{history}
+
+The user's new question:
+{request}"""
+
+def estimate_tokens(text : str):
+    """
+    Estimates the number of tokens of a text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def excerpt(text : str, max_length : int = SUMMARY_EXCERPT_LENGTH):
+    """
+    Returns the first sentence of a text, cut at a word boundary if it is too long.
+
+    Args:
+        text (str): The text.
+        max_length (int): Maximum length of the excerpt in characters.
+
+    Returns:
+        str: The excerpt.
+    """
+    text = " ".join(text.split())
+    text = SENTENCE_END.split(text, 1)[0]
+    if len(text) > max_length:
+        text = text[:max_length].rsplit(" ", 1)[0] + " [...]"
+    return text
+
+def get_chat_history():
+    """
+    Returns the conversation the assistant sees, created on first use.
+
+    Returns:
+        dict: "summary" (list of summarized older turns), "turns" (list of recent (question, answer)
+            tuples) and "dropped" (number of chat messages no longer shown).
+    """
+    return st.session_state.setdefault("chat_history", {"summary": [], "turns": [], "dropped": 0})
+
+def chat_prompt(question : str):
+    """
+    Builds the request for a chat question: the passages relevant to it, the summary of
+    older turns, the recent turns and the question.
+
+    Args:
+        question (str): The question of the user.
+
+    Returns:
+        str: The request for the assistant.
+    """
+    history = get_chat_history()
+    lines = list(history["summary"])
+    for earlier_question, answer in history["turns"]:
+        lines.append(f"User: {earlier_question}\nAssistant: {answer}")
+    request = CHAT_PROMPT.format(history="\n\n".join(lines), request=question) if lines else question
+    return get_passage_index().scoped_prompt(request, query=question)
+
+def add_turn(question : str, answer : str, agent = None):
+    """
+    Adds a turn to the conversation and applies the history policy: recent turns over
+    HISTORY_TOKEN_BUDGET are summarized, the oldest summaries over SUMMARY_TOKEN_BUDGET and
+    chat messages over MAX_MESSAGES are dropped, and the agent's run history is cleared.
+
+    Args:
+        question (str): The question of the user.
+        answer (str): The answer of the assistant.
+        agent: The agno Agent that answered, or None.
+    """
+    history = get_chat_history()
+    history["turns"].append((question, answer))
+    while len(history["turns"]) > 1 and sum(estimate_tokens(q) + estimate_tokens(a) for q, a in history["turns"]) > HISTORY_TOKEN_BUDGET:
+        old_question, old_answer = history["turns"].pop(0)
+        history["summary"].append(f"The user asked: {excerpt(old_question)} You answered: {excerpt(old_answer)}")
+    while len(history["summary"]) > 1 and sum(estimate_tokens(line) for line in history["summary"]) > SUMMARY_TOKEN_BUDGET:
+        history["summary"].pop(0)
+
+    # The welcome message stays, the oldest messages after it are dropped
+    messages = st.session_state.messages
+    if len(messages) > MAX_MESSAGES:
+        dropped = len(messages) - MAX_MESSAGES
+        del messages[1:1 + dropped]
+        history["dropped"] += dropped
+
+    # The conversation is sent with each request, the agent doesn't need to remember its runs
+    memory = getattr(agent, "memory", None)
+    if memory is not None:
+        memory.clear()
+
+def stream_answer(agent, prompt : str, chat_span = None):
+    """
+    Runs the agent with streaming and yields the text of the answer as it is generated,
+    for st.write_stream. The citations are in agent.run_response.citations once the stream completes.
+
+    Args:
+        agent: The agno Agent.
+        prompt (str): The request.
+        chat_span: The tracing span of the chat turn, gets the time to the first chunk.
+
+    Yields:
+        str: The chunks of the answer.
+    """
+    start = time.time()
+    first = True
+    for chunk in agent.run(prompt, stream=True):
+        if not chunk.content:
+            continue
+        if first and chat_span is not None:
+            chat_span.set(first_chunk_seconds=round(time.time() - start, 3))
+        first = False
+        yield chunk.content
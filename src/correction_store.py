@@ -0,0 +1,241 @@
+"""
+correction_store.py
+
+Provides a compact, typed store for corrections and other highlighted items of the paper text.
+The LLM and the spelling pass return lists of dicts. They are validated once when they are stored,
+and kept as parallel arrays of offsets, lengths and type codes plus tuples of the strings, sorted by
+offset. The feedback page and the highlighters then filter, sort and look up items without
+re-scanning and string-comparing dicts on every rerun.
+
+Features:
+- Validation at ingest: missing or invalid offsets, lengths and suggestions are fixed, unknown types become "other"
+- Items sorted by offset, with an index per type
+- Fast filtering by type and overlap queries on text ranges
+- Read-only sequence of Correction dicts, so code that iterates the corrections keeps working
+- Compact binary serialization (also used when the store is pickled)
+"""
+
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+# Item types in the order of their type codes. Arguments are stored with type "argument" for highlighting.
+TYPES = ("spelling", "grammar", "style", "argument", "other")
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+# Header of the binary form: magic bytes, format version and number of items
+HEADER = struct.Struct("<4sBI")
+MAGIC = b"PFCS"
+VERSION = 1
+
+def _little_endian(values : array):
+    """
+    Returns an array in little-endian byte order, for the binary form.
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+class CorrectionStore:
+    """
+    Immutable store of corrections, sorted by offset.
+    Items without a known offset have offset -1 and come first.
+
+    Attributes:
+        offsets (array): Offset of each item in the text, or -1.
+        lengths (array): Length of each item in the text.
+        types (array): Type code of each item, see TYPES.
+        errors (tuple): The error text of each item.
+        contexts (tuple): The context of each item.
+        suggestions (tuple): The suggestion of each item.
+    """
+
+    __slots__ = ("offsets", "lengths", "types", "errors", "contexts", "suggestions", "max_length", "_by_type")
+
+    def __init__(self, offsets : array, lengths : array, types : array, errors : tuple, contexts : tuple, suggestions : tuple):
+        """
+        Use from_items or from_bytes instead, the arrays must already be sorted by offset.
+        """
+        self.offsets = offsets
+        self.lengths = lengths
+        self.types = types
+        self.errors = errors
+        self.contexts = contexts
+        self.suggestions = suggestions
+        self.max_length = max(lengths, default=0)
+        self._by_type = {code: array("I") for code in range(len(TYPES))}
+        for i, code in enumerate(types):
+            self._by_type[code].append(i)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Validates a list of correction dicts and builds the store.
+        Items without an error string are dropped.
+
+        Args:
+            items (list): Dicts with error, context, suggestion, offset, length and type (see Correction),
+                or a CorrectionStore, which is returned as it is.
+
+        Returns:
+            CorrectionStore: The store.
+        """
+        if isinstance(items, CorrectionStore):
+            return items
+        rows = []
+        dropped = 0
+        for item in items:
+            error = item.get("error")
+            if not isinstance(error, str) or not error:
+                dropped += 1
+                continue
+            offset = item.get("offset")
+            offset = offset if isinstance(offset, int) and offset >= 0 else -1
+            length = item.get("length")
+            length = length if isinstance(length, int) and length > 0 else len(error)
+            kind = str(item.get("type") or "").strip().lower()
+            suggestion = item.get("suggestion")
+            rows.append((offset, length, TYPE_CODES.get(kind, TYPE_CODES["other"]), error,
+                         str(item.get("context") or ""), suggestion if isinstance(suggestion, str) else ""))
+        if dropped:
+            print(f"Dropped {dropped} invalid corrections")
+        rows.sort(key=lambda row: row[0])
+        return cls(array("i", [row[0] for row in rows]), array("I", [row[1] for row in rows]), array("B", [row[2] for row in rows]),
+                   tuple(row[3] for row in rows), tuple(row[4] for row in rows), tuple(row[5] for row in rows))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def item(self, i : int):
+        """
+        Returns an item as a Correction dict.
+
+        Args:
+            i (int): The index of the item.
+
+        Returns:
+            dict: A new dict with error, context, suggestion, offset, length and type.
+        """
+        return {
+            "error": self.errors[i],
+            "context": self.contexts[i],
+            "suggestion": self.suggestions[i],
+            "offset": self.offsets[i],
+            "length": self.lengths[i],
+            "type": TYPES[self.types[i]],
+        }
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.item(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("correction index out of range")
+        return self.item(i)
+
+    def __iter__(self):
+        return (self.item(i) for i in range(len(self)))
+
+    def type_of(self, i : int):
+        """
+        Returns the type name of an item.
+        """
+        return TYPES[self.types[i]]
+
+    def of_type(self, *types : str):
+        """
+        Returns the indices of the items of the given types.
+
+        Args:
+            *types (str): Type names, see TYPES.
+
+        Returns:
+            list: The indices, in offset order.
+        """
+        if len(types) == 1:
+            return list(self._by_type[TYPE_CODES[types[0]]])
+        codes = {TYPE_CODES[name] for name in types}
+        return [i for i, code in enumerate(self.types) if code in codes]
+
+    def overlapping(self, start : int, end : int):
+        """
+        Returns the items with a known offset that overlap a range of the text.
+
+        Args:
+            start (int): Start of the range (inclusive).
+            end (int): End of the range (exclusive).
+
+        Returns:
+            list: The indices, in offset order.
+        """
+        first = bisect_left(self.offsets, max(0, start - self.max_length + 1))
+        last = bisect_left(self.offsets, end)
+        return [i for i in range(first, last) if self.offsets[i] + self.lengths[i] > start]
+
+    def to_items(self):
+        """
+        Returns the items as a list of Correction dicts, e.g. for the JSON analysis cache.
+
+        Returns:
+            list: The dicts, in offset order.
+        """
+        return [self.item(i) for i in range(len(self))]
+
+    def to_bytes(self):
+        """
+        Serializes the store: a header, the little-endian arrays, the byte lengths of the strings and the UTF-8 strings.
+
+        Returns:
+            bytes: The binary form.
+        """
+        strings = [string.encode("utf-8") for string in self.errors + self.contexts + self.suggestions]
+        string_lengths = array("I", [len(string) for string in strings])
+        return b"".join([HEADER.pack(MAGIC, VERSION, len(self)), _little_endian(self.offsets).tobytes(),
+                         _little_endian(self.lengths).tobytes(), self.types.tobytes(),
+                         _little_endian(string_lengths).tobytes(), *strings])
+
+    @classmethod
+    def from_bytes(cls, data : bytes):
+        """
+        Builds a store from its binary form, see to_bytes.
+
+        Args:
+            data (bytes): The binary form.
+
+        Returns:
+            CorrectionStore: The store.
+
+        Raises:
+            ValueError: If the data is not a serialized store of this version.
+        """
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a serialized correction store")
+        position = HEADER.size
+        arrays = []
+        for typecode in ("i", "I", "B", "I"):
+            values = array(typecode)
+            size = values.itemsize * (count * 3 if len(arrays) == 3 else count)
+            values.frombytes(data[position:position + size])
+            if sys.byteorder == "big":
+                values.byteswap()
+            arrays.append(values)
+            position += size
+        offsets, lengths, types, string_lengths = arrays
+        strings = []
+        for length in string_lengths:
+            strings.append(data[position:position + length].decode("utf-8"))
+            position += length
+        return cls(offsets, lengths, types, tuple(strings[:count]), tuple(strings[count:2 * count]), tuple(strings[2 * count:]))
+
+    def __reduce__(self):
+        return (CorrectionStore.from_bytes, (self.to_bytes(),))
+
+    def __eq__(self, other):
+        return isinstance(other, CorrectionStore) and self.to_bytes() == other.to_bytes()
+
+    def __repr__(self):
+        return f"CorrectionStore({len(self)} items)"
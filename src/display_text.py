@@ -8,14 +8,37 @@ and displaying citations and chat messages.
 Features:
 - Displays general, argument-based, and correction feedback
 - Highlights arguments and corrections in the paper text
+- Windowed paper pane: only the selected page and the next are rendered, with page navigation
+- Jumps to the page of an argument or correction
+- The paper pane, each argument card and the corrections list are fragments that rerun on their own
+- Read-only previews of arguments and corrections while they are still streaming in
+- Progress of literature requests and retry of failed analyses
 - Displays chat messages and citations
 """
 
 import html
 import re
+from bisect import bisect_right
 import streamlit as st
-from src.text_corrections import highlight_text_arguments, highlight_text_corrections
+from src.extract_text import PARAGRAPH_SEPARATOR
+from src.text_corrections import argument_spans, correction_spans, locate_highlights, paragraph_spans
 from src.find_arguments import generate_papers
+from src.literature import collect_argument_literature, literature_failed, literature_pending, request_all_literature
+from src.analysis import FEEDBACK_TYPE_KEYS, analysis_error, retry_analysis
+from src.text_index import NormalizedText, locate_arguments
+from src.preprocess import get_prepared_text
+from src.render_cache import render_cached
+from src.correction_store import CorrectionStore
+from src.render_spans import render_range, resolve_spans
+
+# Number of pages shown in the paper pane at the same time: the selected page and the pages after it
+WINDOW_PAGES = 2
+# Texts without page offsets are split into pages of about this many characters
+SEGMENT_SIZE = 4000
+# Seconds between two checks of an argument card for the literature it is loading
+LITERATURE_POLL_INTERVAL = 1.0
+# Number of corrections shown at first, and added with every "Show more corrections"
+CORRECTIONS_PAGE_SIZE = 50
 
 def display_feedback():
     """
@@ -24,149 +47,420 @@ def display_feedback():
     """
     feedback_type = st.session_state["feedback_type"]
 
+    key = FEEDBACK_TYPE_KEYS[feedback_type]
+    if key not in st.session_state and analysis_error(key) is not None:
+        st.error(f"Your {feedback_type.lower()} feedback could not be generated. Please try again.")
+        if st.button("Try again", key="retry_analysis_button"):
+            retry_analysis(key)
+            st.rerun()
+        return
+    if key not in st.session_state:
+        # The analysis for this feedback type is still running
+        partial = get_partial(key)
+        if partial:
+            st.info(f"Your {feedback_type.lower()} feedback is being generated. {len(partial)} found so far...")
+            display_preview(feedback_type, partial)
+        else:
+            st.info(f"Your {feedback_type.lower()} feedback is being generated. It will appear here as soon as it is ready.")
+        return
+
     if feedback_type == "General":
         general_feedback_container = st.container(border=False, key="general_feedback_container")
         with general_feedback_container:
             st.markdown(st.session_state['general_feedback'])
 
     if feedback_type == "Arguments":
+        # Intervals of the literature pollers end with every full run, see display_argument_card
+        st.session_state["literature_pollers"] = set()
+        if not all(st.session_state["updated_arguments"]):
+            if st.button("Load all literature", key="all_literature_button", help="Load relevant literature for all arguments at once. Might take a while."):
+                request_all_literature()
+                st.rerun()
         arguments_container = st.container(height=650, border=False, key="arguments_container")
-        arguments = st.session_state["arguments"]
-        i = 0
-        for argument in arguments:
-            long_argument = argument['context']
-            if st.session_state["updated_arguments"][i] == False:
-                with arguments_container:
-                    argument_container = st.container(border=False, key=f"argument_container_{i}")
-                    with argument_container:
-                        st.markdown(f"Full argument: <strong>{long_argument.replace('*', '')}</strong>", unsafe_allow_html=True)
-                        parts_argument_container = st.container(border=False, key=f"argument_parts_container_{i}")
-                        with parts_argument_container:
-                            st.markdown(f"**Claim**: {argument['claim']}")
-                            st.markdown(f"**Evidence**: {argument['evidence']}")
-                        improvements_container = st.container(border=False, key=f"improvements_container_{i}")
-                        with improvements_container:
-                            st.markdown(f"**What is wrong with this argument?** {argument['feedback']}")
-                            st.markdown(f"**How to improve this argument?** {argument['actionable_feedback']}")
-                        relevant_literature_container = st.container(border=False, key=f"relevant_literature_container_{i}")
-                        with relevant_literature_container:
-                            st.markdown(f"**Relevant literature**")
-                            button_key = f"literature_button_{i}"
-                            literature_button = st.button("Load relevant literature", key=button_key, help="Load relevant literature for this argument. Might take a while.")
-                            if literature_button:
-                                generate_papers(i)
-            elif st.session_state["updated_arguments"][i] == True:
-                with arguments_container:
-                    argument_container = st.container(border=False, key=f"argument_container_{i}")
-                    with argument_container:
-                        st.markdown(f"Full argument: **{long_argument.replace('*', '')}**")
-                        parts_argument_container = st.container(border=False, key=f"argument_parts_container_{i}")
-                        with parts_argument_container:
-                            st.markdown(f"**Claim**: {argument['claim']}")
-                            st.markdown(f"**Evidence**: {argument['evidence']}")
-                        improvements_container = st.container(border=False, key=f"improvements_container_{i}")
-                        with improvements_container:
-                            st.markdown(f"**What is wrong with this argument?** {argument['feedback']}")
-                            st.markdown(f"**How to improve this argument?** {argument['actionable_feedback']}")
-                        relevant_literature_container = st.container(border=False, key=f"relevant_literature_container_{i}")
-                        with relevant_literature_container:
-                            st.markdown(f"**Relevant literature**")
-                            st.markdown(f"{argument['counterargument']['general']}")
-                            with st.expander("**Literature**", expanded=False):
-                                for paper in argument['counterargument']['papers']:
-                                    paper_container = st.container(border=True)
-                                    with paper_container:
-                                        st.markdown(f"**{paper['title']}** by {paper['authors']} ({paper['year']}) [Link to article]({paper['url']})")
-                                        st.markdown(f"**Summary**: {paper['abstract']}")
-            i = i + 1
+        with arguments_container:
+            for i in range(len(st.session_state["arguments"])):
+                display_argument_card(i)
 
     if feedback_type == "Corrections":
-        corrections_llm = st.session_state["corrections_llm"]
         corrections_container = st.container(height=650, border=False)
         with corrections_container:
-            for correction in corrections_llm:
-                if correction["suggestion"] is not None:
-                    suggestion = html.escape(correction["suggestion"])
-                else:
-                    suggestion = ""
-                if "\n" in correction['error']:
-                    continue
-                if correction["type"] == "spelling":
-                    st.write(f"<div class='item-spelling' title='{html.escape(suggestion)}'>{correction['error']} → <span style='color: red'><b>{correction['suggestion']}</b></span><br><small>Spelling mistake</small></div>",	unsafe_allow_html=True)
-                    continue
-                if correction["type"] == "grammar":
-                    st.write(f"<div class='item-grammar' title='{html.escape(suggestion)}'>{correction['error']} → <span style='color: blue'><b>{correction['suggestion']}</b></span><br><small>Grammar mistake</small></div>",	unsafe_allow_html=True)
-                    continue
-                if correction["type"] == "style":
-                    st.write(f"<div class='item-style' title='{html.escape(suggestion)}'>{correction['error']} → <span style='color: green'><b>{correction['suggestion']}</b></span><br><small>Style suggestion</small></div>",	unsafe_allow_html=True)
-                    continue
-                #else:
-                #    st.write(f"<div class='item-other' title='{html.escape(correction['suggestion'])}'>{correction['error']} → <span style='color: purple'><b>{correction['suggestion']}</b></span><br><small>Other</small></div>",	unsafe_allow_html=True)
-            
+            display_correction_list()
+
+@st.fragment
+def display_argument_card(i : int):
+    """
+    Displays the card of an argument with its literature.
+    The card is a fragment, so loading its literature reruns only this card.
+
+    Args:
+        i (int): The index of the argument in st.session_state["arguments"].
+    """
+    argument = st.session_state["arguments"][i]
+    argument_container = st.container(border=False, key=f"argument_container_{i}")
+    with argument_container:
+        st.markdown(f"Full argument: **{argument['context'].replace('*', '')}**")
+        parts_argument_container = st.container(border=False, key=f"argument_parts_container_{i}")
+        with parts_argument_container:
+            st.markdown(f"**Claim**: {argument['claim']}")
+            st.markdown(f"**Evidence**: {argument['evidence']}")
+        improvements_container = st.container(border=False, key=f"improvements_container_{i}")
+        with improvements_container:
+            st.markdown(f"**What is wrong with this argument?** {argument['feedback']}")
+            st.markdown(f"**How to improve this argument?** {argument['actionable_feedback']}")
+        relevant_literature_container = st.container(border=False, key=f"relevant_literature_container_{i}")
+        with relevant_literature_container:
+            st.markdown(f"**Relevant literature**")
+            if literature_pending(i):
+                # A fragment only gets its interval when it is created, and it keeps it until the next full run,
+                # so the poller is created with an interval once per full run
+                pollers = st.session_state.setdefault("literature_pollers", set())
+                run_every = None if i in pollers else LITERATURE_POLL_INTERVAL
+                pollers.add(i)
+                st.fragment(display_literature_progress, run_every=run_every)(i)
+            else:
+                display_literature(i)
+
+def display_literature_progress(i : int):
+    """
+    Displays the literature of an argument that is being loaded. Runs as a fragment inside the card
+    every LITERATURE_POLL_INTERVAL seconds, and shows the literature (or the error) once the request finished.
+
+    Args:
+        i (int): The index of the argument.
+    """
+    collect_argument_literature(i)
+    if literature_pending(i):
+        st.caption("Loading relevant literature...")
+    else:
+        display_literature(i)
+
+def display_literature(i : int):
+    """
+    Displays the literature of an argument, or the button to load it.
+
+    Args:
+        i (int): The index of the argument.
+    """
+    argument = st.session_state["arguments"][i]
+    if st.session_state["updated_arguments"][i] == True:
+        st.markdown(f"{argument['counterargument']['general']}")
+        with st.expander("**Literature**", expanded=False):
+            for paper in argument['counterargument']['papers']:
+                paper_container = st.container(border=True)
+                with paper_container:
+                    st.markdown(f"**{paper['title']}** by {paper['authors']} ({paper['year']}) [Link to article]({paper['url']})")
+                    st.markdown(f"**Summary**: {paper['abstract']}")
+        return
+    if literature_failed(i):
+        st.error("Relevant literature could not be loaded for this argument. Please try again.")
+    st.button("Load relevant literature", key=f"literature_button_{i}", help="Load relevant literature for this argument. Might take a while.",
+              on_click=generate_papers, args=(i,))
+
+@st.fragment
+def display_correction_list():
+    """
+    Displays the corrections, CORRECTIONS_PAGE_SIZE at a time. The list is a fragment,
+    so showing more corrections reruns only the list.
+    """
+    corrections = st.session_state["corrections_llm"]
+    shown = st.session_state.get("corrections_shown", CORRECTIONS_PAGE_SIZE)
+    display_corrections(corrections[:shown])
+    if len(corrections) > shown:
+        st.button(f"Show more corrections ({len(corrections) - shown} more)", key="more_corrections_button", on_click=show_more_corrections)
+
+def show_more_corrections():
+    """
+    Shows the next CORRECTIONS_PAGE_SIZE corrections in the list. Used as a widget callback.
+    """
+    st.session_state["corrections_shown"] = st.session_state.get("corrections_shown", CORRECTIONS_PAGE_SIZE) + CORRECTIONS_PAGE_SIZE
+
+def display_corrections(corrections_llm : list):
+    """
+    Displays a list of corrections, colored by type.
+
+    Args:
+        corrections_llm (list): The corrections to display.
+    """
+    for correction in corrections_llm:
+        if correction["suggestion"] is not None:
+            suggestion = html.escape(correction["suggestion"])
+        else:
+            suggestion = ""
+        if "\n" in correction['error']:
+            continue
+        if correction["type"] == "spelling":
+            st.write(f"<div class='item-spelling' title='{html.escape(suggestion)}'>{correction['error']} → <span style='color: red'><b>{correction['suggestion']}</b></span><br><small>Spelling mistake</small></div>",	unsafe_allow_html=True)
+            continue
+        if correction["type"] == "grammar":
+            st.write(f"<div class='item-grammar' title='{html.escape(suggestion)}'>{correction['error']} → <span style='color: blue'><b>{correction['suggestion']}</b></span><br><small>Grammar mistake</small></div>",	unsafe_allow_html=True)
+            continue
+        if correction["type"] == "style":
+            st.write(f"<div class='item-style' title='{html.escape(suggestion)}'>{correction['error']} → <span style='color: green'><b>{correction['suggestion']}</b></span><br><small>Style suggestion</small></div>",	unsafe_allow_html=True)
+            continue
+        #else:
+        #    st.write(f"<div class='item-other' title='{html.escape(correction['suggestion'])}'>{correction['error']} → <span style='color: purple'><b>{correction['suggestion']}</b></span><br><small>Other</small></div>",	unsafe_allow_html=True)
+
+def get_partial(key : str):
+    """
+    Returns the items of a streamed analysis that have been generated so far.
+
+    Args:
+        key (str): The session state key of the analysis.
+
+    Returns:
+        list: The items, or an empty list if the analysis isn't streaming.
+    """
+    return st.session_state.get("partial_analysis", {}).get(key, [])
+
+def display_preview(feedback_type : str, partial : list):
+    """
+    Displays a read-only preview of the arguments or corrections generated so far.
+    The preview is redrawn many times per run, so it doesn't use keyed containers or widgets.
+
+    Args:
+        feedback_type (str): "Arguments" or "Corrections".
+        partial (list): The items generated so far.
+    """
+    preview_container = st.container(height=650, border=False)
+    with preview_container:
+        if feedback_type == "Arguments":
+            for argument in partial:
+                with st.container(border=True):
+                    st.markdown(f"Full argument: **{argument['context'].replace('*', '')}**")
+                    st.markdown(f"**Claim**: {argument['claim']}")
+                    st.markdown(f"**Evidence**: {argument['evidence']}")
+                    st.markdown(f"**What is wrong with this argument?** {argument['feedback']}")
+                    st.markdown(f"**How to improve this argument?** {argument['actionable_feedback']}")
+        elif feedback_type == "Corrections":
+            display_corrections(partial)
+
+def get_normalized_text():
+    """
+    Returns the normalized paper text, built once per uploaded text.
+    The LLM output is anchored in the prepared text it was generated from, and mapped on to the displayed text.
+
+    Returns:
+        NormalizedText: The normalized copy of the prepared text of st.session_state["text"].
+    """
+    prepared = get_prepared_text()
+    normalized = st.session_state.get("normalized_text")
+    if normalized is None or normalized.prepared is not prepared:
+        normalized = NormalizedText(prepared.text, prepared)
+        st.session_state["normalized_text"] = normalized
+    return normalized
+
+def build_argument_highlights(arguments : list = None):
+    """
+    Builds the highlights of the arguments in the paper text.
+
+    Args:
+        arguments (list): The arguments to highlight. Defaults to st.session_state["arguments"].
+
+    Returns:
+        tuple: The resolved highlight spans, and a dict with the position in the text of each found argument by its index.
+    """
+    if arguments is None:
+        arguments = st.session_state["arguments"]
+    located = []
+    positions = {}
+    for i, start, end in locate_arguments(get_normalized_text(), [argument['context'] for argument in arguments]):
+        located.append({
+            "error": arguments[i]['context'],
+            "offset": start,
+            "length": end - start,
+            "type": "argument"
+        })
+        positions[i] = start
+    return resolve_spans(argument_spans(st.session_state["text"], CorrectionStore.from_items(located))), positions
+
+def build_correction_highlights(corrections : list = None):
+    """
+    Builds the highlights of the corrections in the paper text.
+
+    Args:
+        corrections (CorrectionStore): The corrections to highlight. Defaults to st.session_state["corrections_llm"].
+
+    Returns:
+        tuple: The resolved highlight spans, and a dict with the position in the text of each found correction by its index.
+    """
+    if corrections is None:
+        corrections = st.session_state["corrections_llm"]
+    corrections = CorrectionStore.from_items(corrections)
+    located = locate_highlights(corrections, get_normalized_text())
+    positions = {i: start for i, start, _ in located}
+    return resolve_spans(correction_spans(corrections, located)), positions
+
+def get_segments():
+    """
+    Returns the pages of the paper text the paper pane is windowed over, built once per uploaded text.
+    Texts without page offsets are split into paragraph-aligned pages of about SEGMENT_SIZE characters.
+
+    Returns:
+        list: Tuples (start, end) per page, in document order.
+    """
+    text = st.session_state["text"]
+    cached = st.session_state.get("text_segments")
+    if cached is not None and cached[0] is text:
+        return cached[1]
+    page_offsets = st.session_state.get("page_offsets")
+    if page_offsets:
+        ends = [offset - len(PARAGRAPH_SEPARATOR) for offset in page_offsets[1:]] + [len(text)]
+        segments = list(zip(page_offsets, ends))
+    else:
+        segments = []
+        for start, end in paragraph_spans(text):
+            if segments and end - segments[-1][0] <= SEGMENT_SIZE:
+                segments[-1] = (segments[-1][0], end)
+            else:
+                segments.append((start, end))
+    st.session_state["text_segments"] = (text, segments)
+    # A new text starts on its first page
+    st.session_state.pop("paper_page", None)
+    return segments
+
+def is_windowed():
+    """
+    Returns whether the paper is longer than the window of the paper pane.
+
+    Returns:
+        bool: True if the paper pane shows a selection of the pages.
+    """
+    return len(get_segments()) > WINDOW_PAGES
+
+def page_of(position : int):
+    """
+    Returns the page of the paper pane that contains a position in the text.
+
+    Args:
+        position (int): The position in the text.
+
+    Returns:
+        int: The page number, starting at 1.
+    """
+    return max(1, bisect_right([start for start, _ in get_segments()], position))
+
+def show_in_paper(position : int):
+    """
+    Selects the page that contains a position in the paper pane.
+    Used as a widget callback, so the page is selected before the pane is rendered.
+
+    Args:
+        position (int): The position in the text.
+    """
+    st.session_state["paper_page"] = page_of(position)
+
+def turn_page(step : int):
+    """
+    Selects the previous or next page in the paper pane. Used as a widget callback.
+
+    Args:
+        step (int): -1 for the previous page, 1 for the next.
+    """
+    st.session_state["paper_page"] = min(max(st.session_state.get("paper_page", 1) + step, 1), len(get_segments()))
+
+def display_item_jump():
+    """
+    Displays a selection of the highlighted arguments or corrections that shows the page of the selected
+    one in the paper pane, if the paper is windowed. One widget for all items, a button per item would be too many.
+    """
+    feedback_type = st.session_state["feedback_type"]
+    if feedback_type == "General" or FEEDBACK_TYPE_KEYS[feedback_type] not in st.session_state or not is_windowed():
+        return
+    if feedback_type == "Arguments":
+        arguments = st.session_state["arguments"]
+        _, positions = render_cached(feedback_type, "arguments", build_argument_highlights)
+        labels = {i: f"{arguments[i]['claim']} (page {page_of(position)})" for i, position in positions.items()}
+    else:
+        corrections = st.session_state["corrections_llm"]
+        _, positions = render_cached(feedback_type, "corrections_llm", build_correction_highlights)
+        labels = {i: f"{corrections.errors[i]} → {corrections.suggestions[i]} (page {page_of(position)})" for i, position in positions.items()}
+    key = f"{feedback_type.lower()}_jump"
+    def jump():
+        i = st.session_state[key]
+        if i is not None and i in positions:
+            show_in_paper(positions[i])
+    label = f"Show {'an argument' if feedback_type == 'Arguments' else 'a correction'} in the paper"
+    st.selectbox(label, sorted(positions), index=None, key=key, on_change=jump, format_func=labels.get,
+                 placeholder=f"{label}...", label_visibility="collapsed")
+
+def display_paper_navigation():
+    """
+    Displays the page selection of the paper pane, if the paper is longer than the window.
+    """
+    segments = get_segments()
+    if len(segments) <= WINDOW_PAGES:
+        return
+    # Set before the widget is created, the page can be out of range after a new upload
+    st.session_state["paper_page"] = min(max(st.session_state.get("paper_page", 1), 1), len(segments))
+    page = st.session_state["paper_page"]
+    previous_col, page_col, next_col = st.columns([1, 2, 1], vertical_alignment="center")
+    with previous_col:
+        st.button("Previous", key="paper_previous", disabled=page == 1, on_click=turn_page, args=(-1,))
+    with page_col:
+        st.number_input(f"Page (of {len(segments)})", min_value=1, max_value=len(segments), step=1, key="paper_page")
+    with next_col:
+        st.button("Next", key="paper_next", disabled=page == len(segments), on_click=turn_page, args=(1,))
+
+@st.fragment
+def display_paper():
+    """
+    Displays the paper pane: the page navigation, the selection of an item to show and the paper text.
+    The pane is a fragment, so turning a page or jumping to an item reruns only the pane.
+    """
+    display_paper_navigation()
+    display_item_jump()
+    text_container = st.container(height=705, border=False, key="text_container")
+    with text_container:
+        display_text()
+
+def display_window(spans : list):
+    """
+    Displays the pages of the paper in the window of the paper pane with their highlights:
+    the selected page and the pages after it, WINDOW_PAGES in total. Each page is rendered on its own,
+    spans that cross a page boundary are split over the pages.
+
+    Args:
+        spans (list): The resolved highlight spans, with offsets into the whole text.
+    """
+    text = st.session_state["text"]
+    segments = get_segments()
+    if len(segments) <= WINDOW_PAGES:
+        st.markdown(render_range(text, spans, 0, len(text)), unsafe_allow_html=True)
+        return
+    first = st.session_state.get("paper_page", 1) - 1
+    for page, (start, end) in enumerate(segments[first:first + WINDOW_PAGES], start=first + 1):
+        st.caption(f"Page {page} of {len(segments)}")
+        st.markdown(render_range(text, spans, start, end), unsafe_allow_html=True)
+
 def display_text():
     """
     Displays the paper text with highlights based on the selected feedback type.
     - For 'General': shows the plain text.
     - For 'Arguments': highlights argument sections.
     - For 'Corrections': highlights corrections.
+    Only the pages in the window of the paper pane are rendered (see display_window).
+    The highlights are reused across reruns until the text or the highlighted list changes.
+    While arguments or corrections are streaming in, the items generated so far are highlighted (uncached).
     """
     feedback_type = st.session_state["feedback_type"]
 
-    if feedback_type == "General":
-        st.markdown(st.session_state["text"], unsafe_allow_html=True)
+    if feedback_type != "General" and FEEDBACK_TYPE_KEYS[feedback_type] not in st.session_state:
+        partial = get_partial(FEEDBACK_TYPE_KEYS[feedback_type])
+        if not partial:
+            display_window([])
+        elif feedback_type == "Arguments":
+            display_window(build_argument_highlights(partial)[0])
+        else:
+            display_window(build_correction_highlights(partial)[0])
     elif feedback_type == "Arguments":
-        arguments = st.session_state["arguments"]
-        text = st.session_state["text"]
-        all_arguments = []
-        for argument in arguments:
-            all_arguments.append(argument['context'])
-        corrections = []
-        normalized_text = text.replace("\n", " ")
-        for arg in all_arguments:
-            start = normalized_text.find(arg.replace('\n',' '))
-            if start != -1:
-                corrections.append({
-                    "error": arg.replace('\n',' '),
-                    "suggestion": ["Correction"],
-                    "offset": start,
-                    "length": len(arg),
-                    "type": "argument"
-                })
-            else:
-                start = normalized_text.find(arg[0:50])
-                if start != -1:
-                    corrections.append({
-                        "error": arg.replace('\n',' '),
-                        "suggestion": ["Correction"],
-                        "offset": start,
-                        "length": len(arg),
-                        "type": "argument"
-                    })
-                else:
-                    update_normalizes_text = normalized_text
-                    counter = update_normalizes_text.count("  ")
-                    update_normalizes_text = update_normalizes_text.replace("  ", " ")
-                    start = update_normalizes_text.find(arg)
-                    if start != -1:
-                        corrections.append({
-                        "error": arg.replace('\n',' '),
-                        "suggestion": ["Correction"],
-                        "offset": start + counter,
-                        "length": len(arg),
-                        "type": "argument"
-                        })
-                    else:
-                        print(f"Could not find argument: {arg}")
-                        print(f"-------")
-        highlighted_text = highlight_text_arguments(st.session_state["text"], corrections)
-        st.markdown(highlighted_text, unsafe_allow_html=True)
+        spans, _ = render_cached(feedback_type, "arguments", build_argument_highlights)
+        display_window(spans)
     elif feedback_type == "Corrections":
-        corrections = st.session_state["corrections_llm"]
-        highlighted_text = highlight_text_corrections(st.session_state["text"], corrections)
-        st.markdown(highlighted_text, unsafe_allow_html=True)
+        spans, _ = render_cached(feedback_type, "corrections_llm", build_correction_highlights)
+        display_window(spans)
     else:
-        st.markdown(st.session_state["text"], unsafe_allow_html=True)
-        
+        display_window([])
+
 def display_message(text, citations):
     """
     Displays a chat message and its citations.
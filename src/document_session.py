@@ -0,0 +1,223 @@
+"""
+document_session.py
+
+Provides document sessions: the paper draft is registered once with the LLM provider, and the
+instruction-only prompts (argument extraction and the continuations of its truncated lists) are
+issued against it, instead of sending the full text with every request. Corrections are requested
+for short drafts or for windows of long ones (see text_corrections.py), both below the provider's
+minimum cache size, so their text is always sent inline with the same prompt layout.
+
+Features:
+- Gemini context caching: one cached content per model, created on first use and shared by all requests
+- Automatic fallback to sending the text inline for short texts, models without caching, or failed cache creation
+- Sessions of short texts (e.g. correction windows) are not registered, so they never evict the paper's session
+- Caches are recreated before they expire; an evicted session's caches are left to expire, so requests in flight can finish
+- Local stand-in that never contacts the provider, for tests and offline runs
+- Bounded registry of sessions shared by all Streamlit sessions and threads
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Texts shorter than this many characters are sent inline; the provider doesn't cache small
+# contents (the minimum is a few thousand tokens) and inline requests are cheap for them
+MIN_CACHE_CHARS = 16000
+# Lifetime of a provider cache in seconds, and how long before expiry it is recreated
+CACHE_TTL = 900
+TTL_MARGIN = 60
+# Maximum number of document sessions kept in the registry
+MAX_SESSIONS = 32
+
+# How the document is presented to the model, both in a provider cache and inline
+DOCUMENT_TEMPLATE = "The user's paper draft:\n{text}"
+
+class DocumentSession:
+    """
+    A paper draft registered with the Gemini API.
+    Thread-safe: the analysis threads of one upload share the session.
+
+    Attributes:
+        api_key (str): The Gemini API key.
+        text (str): The document text.
+        ttl (int): Lifetime of a provider cache in seconds.
+        uploads (int): Number of times the full text was sent (cache creations and inline requests).
+        cached_requests (int): Number of requests issued against a provider cache.
+    """
+
+    def __init__(self, api_key : str, text : str, ttl : int = CACHE_TTL):
+        self.api_key = api_key
+        self.text = text
+        self.ttl = ttl
+        self.uploads = 0
+        self.cached_requests = 0
+        self._lock = threading.Lock()
+        # Cache name and expiry time per model
+        self._caches = {}
+        # Models for which no cache could be created
+        self._uncached = set()
+
+    def prepare(self, model : str, prompt : str, config : dict):
+        """
+        Builds the contents and config of a request to a model.
+
+        Args:
+            model (str): The model the request is sent to.
+            prompt (str): The instruction-only prompt.
+            config (dict): The generation config.
+
+        Returns:
+            tuple: The contents and the config of the request.
+        """
+        name = self._cache_name(model)
+        if name is None:
+            with self._lock:
+                self.uploads += 1
+            return [DOCUMENT_TEMPLATE.format(text=self.text), prompt], config
+        with self._lock:
+            self.cached_requests += 1
+        config = dict(config)
+        config["cached_content"] = name
+        return prompt, config
+
+    def request_failed(self, model : str, error : Exception):
+        """
+        Forgets the cache of a model if the request failed because the cache is gone.
+
+        Args:
+            model (str): The model the request was sent to.
+            error (Exception): The error raised by the request.
+        """
+        code = getattr(error, "code", None)
+        if code in (403, 404):
+            with self._lock:
+                if self._caches.pop(model, None) is not None:
+                    print(f"Cached document for {model} is no longer available")
+
+    def _cache_name(self, model : str):
+        """
+        Returns the name of the provider cache for a model, creating it if needed.
+
+        Returns:
+            str: The cache name, or None if the text has to be sent inline.
+        """
+        if len(self.text) < MIN_CACHE_CHARS:
+            return None
+        # Holding the lock while creating makes concurrent requests wait for one creation
+        with self._lock:
+            if model in self._uncached:
+                return None
+            cache = self._caches.get(model)
+            if cache is not None and time.time() < cache[1] - TTL_MARGIN:
+                return cache[0]
+            name = self._create_cache(model)
+            if name is None:
+                self._uncached.add(model)
+                return None
+            self.uploads += 1
+            self._caches[model] = (name, time.time() + self.ttl)
+            return name
+
+    def _create_cache(self, model : str):
+        """
+        Registers the document with the provider for a model.
+
+        Returns:
+            str: The cache name, or None if the model doesn't support caching.
+        """
+        from src.llm_client import get_client
+        try:
+            cache = get_client(self.api_key).caches.create(model=model, config={
+                "contents": [DOCUMENT_TEMPLATE.format(text=self.text)],
+                "ttl": f"{self.ttl}s",
+                "display_name": "paper-draft",
+            })
+        except Exception as e:
+            print(f"Could not cache the document for {model}, sending it inline: {e}")
+            return None
+        print(f"Cached the document for {model} as {cache.name}")
+        return cache.name
+
+    def close(self):
+        """
+        Deletes the provider caches of the session. Only call it when no request uses the session anymore.
+        """
+        from src.llm_client import get_client
+        with self._lock:
+            caches = list(self._caches.values())
+            self._caches.clear()
+        for name, _ in caches:
+            try:
+                get_client(self.api_key).caches.delete(name=name)
+            except Exception as e:
+                print(f"Could not delete cached document {name}: {e}")
+
+    def stats(self):
+        """
+        Returns the usage statistics of the session.
+
+        Returns:
+            dict: Uploads of the full text, requests against a cache, and the cached models.
+        """
+        with self._lock:
+            return {"uploads": self.uploads, "cached_requests": self.cached_requests, "cached_models": list(self._caches)}
+
+class LocalDocumentSession(DocumentSession):
+    """
+    Stand-in for DocumentSession that never contacts the provider.
+    The text is registered once locally and sent inline with each request, so prompts are
+    identical to those of a real session; uploads and requests are counted the same way.
+    """
+
+    def _create_cache(self, model : str):
+        print(f"Registered the document locally for {model}")
+        return f"local/{model}"
+
+    def prepare(self, model : str, prompt : str, config : dict):
+        if self._cache_name(model) is not None:
+            with self._lock:
+                self.cached_requests += 1
+        else:
+            with self._lock:
+                self.uploads += 1
+        return [DOCUMENT_TEMPLATE.format(text=self.text), prompt], config
+
+    def close(self):
+        with self._lock:
+            self._caches.clear()
+
+_lock = threading.Lock()
+_sessions = OrderedDict()
+
+def get_document_session(api_key : str, text : str, local : bool = False):
+    """
+    Returns the document session of a text, creating it on first use.
+    Sessions are shared by everyone who analyses the same text with the same API key;
+    the least recently used session is dropped when the registry is full. Its provider caches are
+    not deleted, requests in other threads may still use them; they expire after CACHE_TTL.
+    A text shorter than MIN_CACHE_CHARS gets a new session that isn't registered: it never holds a
+    provider cache, so there is nothing to share, and windows and revised regions don't fill the registry.
+
+    Args:
+        api_key (str): The Gemini API key.
+        text (str): The document text.
+        local (bool): If True, return a LocalDocumentSession.
+
+    Returns:
+        DocumentSession: The session.
+    """
+    if len(text) < MIN_CACHE_CHARS:
+        return LocalDocumentSession(api_key, text) if local else DocumentSession(api_key, text)
+    key = (api_key, hashlib.sha256(text.encode("utf-8")).hexdigest(), local)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = LocalDocumentSession(api_key, text) if local else DocumentSession(api_key, text)
+            _sessions[key] = session
+            if len(_sessions) > MAX_SESSIONS:
+                _, evicted = _sessions.popitem(last=False)
+                print(f"Dropped the document session of {len(evicted.text)} characters, its caches expire on their own")
+        else:
+            _sessions.move_to_end(key)
+    return session
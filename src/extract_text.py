@@ -0,0 +1,94 @@
+"""
+extract_text.py
+
+Provides in-memory text extraction from uploaded PDF files.
+The PDF is opened straight from the uploaded bytes, so no temporary files are written
+and concurrent sessions can't interfere with each other.
+
+Features:
+- Opens PDFs from memory with pymupdf
+- Extracts pages in parallel with a process pool for large documents
+- Returns the text together with a per-page offset table
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+
+# Documents with at least this many pages are extracted with a process pool
+PARALLEL_PAGE_THRESHOLD = 40
+
+# Separator between paragraphs (text blocks) and between pages
+PARAGRAPH_SEPARATOR = "\n\n"
+
+def extract_page_text(page):
+    """
+    Extracts the text of a single page, one paragraph per text block.
+
+    Args:
+        page: A pymupdf page.
+
+    Returns:
+        str: The paragraphs of the page, separated by blank lines.
+    """
+    paragraphs = []
+    for block in page.get_text("blocks", sort=False):
+        # Block type 0 is text, 1 is an image
+        if block[6] != 0:
+            continue
+        paragraph = block[4].strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+    return PARAGRAPH_SEPARATOR.join(paragraphs)
+
+def _extract_pages(data : bytes, start : int, stop : int):
+    """
+    Extracts the text of a range of pages. Runs in a worker process.
+
+    Args:
+        data (bytes): The PDF file contents.
+        start (int): Index of the first page.
+        stop (int): Index after the last page.
+
+    Returns:
+        list: The text of each page in the range.
+    """
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        return [extract_page_text(doc[page_nr]) for page_nr in range(start, stop)]
+
+def extract_text(data : bytes, max_workers : int = None):
+    """
+    Extracts the text of a PDF file held in memory.
+
+    Args:
+        data (bytes): The PDF file contents, e.g. bytes(uploaded_file.getbuffer()).
+        max_workers (int): Maximum number of worker processes for large documents.
+            Defaults to the number of CPUs. With 1, the pages are extracted in this process.
+
+    Returns:
+        tuple: The extracted text, and a list with the offset in the text where each page starts.
+    """
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        page_count = doc.page_count
+        if page_count < PARALLEL_PAGE_THRESHOLD or max_workers == 1:
+            pages = [extract_page_text(page) for page in doc]
+        else:
+            pages = None
+
+    if pages is None:
+        workers = min(max_workers or os.cpu_count() or 1, page_count)
+        chunk_size = math.ceil(page_count / workers)
+        ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+        pages = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_pages, data, start, stop) for start, stop in ranges]
+            for future in futures:
+                pages.extend(future.result())
+
+    page_offsets = []
+    offset = 0
+    for page_text in pages:
+        page_offsets.append(offset)
+        offset += len(page_text) + len(PARAGRAPH_SEPARATOR)
+    return PARAGRAPH_SEPARATOR.join(pages), page_offsets
@@ -6,12 +6,18 @@ Handles argument extraction using LLMs (Google Gemini), and generates relevant l
 
 Features:
 - Extracts arguments from paper drafts using LLMs
-- Generates relevant scientific papers to improve or counter arguments
+- Generates relevant scientific papers to improve or counter arguments (see literature.py)
 """
 
 import streamlit as st
-import json
 from pydantic import BaseModel
+from src.cache import ANALYSIS_CACHE, schema_of
+from src.llm_client import GEMINI_MODELS
+from src.json_parsing import generate_items, stream_items
+from src.document_session import get_document_session
+from src.render_cache import bump_version
+from src.literature import request_literature
+from src.preprocess import get_prepared_text
 
 class Argument(BaseModel):
     """
@@ -32,17 +38,10 @@ class Argument(BaseModel):
     feedback: str
     actionable_feedback: str
 
-def generate_arguments():
-    """
-    Extracts arguments from the user's paper draft using Google Gemini LLM.
-    Stores the results in Streamlit session state as a list of arguments.
+# Seconds after which the argument request is also sent to the fallback model
+HEDGE_AFTER = 45
 
-    Handles retries with different Gemini models if the first attempt fails.
-    Cleans up and parses the LLM response as JSON.
-    """
-    import google.genai
-    text = st.session_state["text"]
-    prompt = f"""Given the user's paper draft, identify each argument that could be improved.
+ARGUMENTS_PROMPT = """Given the user's paper draft, identify each argument that could be improved.
                  Keep the length of the arguments to a maximum of a few sentences, within one paragraph.
                 Each argument should be treated as a standalone unit and should include the following details:
                 - context: The full argument. Please keep any mistakes or errors in the text as they are. Please keep the text as it is, within a single paragraph.
@@ -51,106 +50,68 @@ def generate_arguments():
                   - evidence: Factual or logical support for the claim.
                 - counterargument: Empty by default. This will be filled in later.
                 - feedback: Analysis of the arguments weaknesses, such as logical fallacies, lack of clarity, or weak evidence.
-                - actionable_feedback: Specific steps to improve the argument.
-                
-                The paper draft:	{text}"""
-
-    client = google.genai.Client(api_key=str(st.secrets["GEMINI_API_KEY"]))
-    try:
-        print("Trying gemini-2.0-flash...")
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Argument],
-            }
-        )
-        print("Response from gemini-2.0-flash: ", response)
-        arguments = response.text
-    except:
-        print("Error generating content with gemini-2.0-flash. Trying gemini-2.0-flash-lite...")
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-lite", 
-                contents=prompt,
-                config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Argument],
-            }
-            )
-            arguments = response.text
-        except:
-            print("Error generating content with gemini-2.0-flash-lite. Trying gemini-1.5-flash...")
-            try:
-                response = client.models.generate_content(
-                    model="gemini-1.5-flash", 
-                    contents=prompt,
-                    config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Argument],
-            }
-                )
-                arguments = response.text
-            except:
-                print("Error generating content with all three models.")
-                return
-    print(f"Response: {arguments}")
-    # Clean up the response text
-    if arguments.startswith("```json") and arguments.endswith("```"):
-        arguments = arguments[7:-3].strip()
-    try:
-        st.session_state["arguments"] = json.loads(arguments)
-        st.session_state["updated_arguments"] = [False] * len(st.session_state["arguments"])
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}. Retrying...")
-        generate_arguments() 
-        
+                - actionable_feedback: Specific steps to improve the argument."""
+
+def generate_arguments():
+    """
+    Extracts arguments from the user's paper draft using Google Gemini LLM.
+    Stores the results in Streamlit session state as a list of arguments.
+    """
+    arguments = extract_arguments(get_prepared_text().text, str(st.secrets["GEMINI_API_KEY"]))
+    if arguments is None:
+        return
+    st.session_state["arguments"] = arguments
+    st.session_state["updated_arguments"] = [False] * len(arguments)
+    bump_version("arguments")
+
+def extract_arguments(text : str, api_key : str, use_cache : bool = True, on_item=None):
+    """
+    Extracts arguments from a paper draft using Google Gemini LLM.
+    Does not touch Streamlit session state, so it can run outside the script thread.
+
+    Retries, timeouts and fallback to other Gemini models are handled by the shared LLM client.
+    The text is registered once in a document session, the prompt only carries the instructions.
+    The response is parsed tolerantly, a truncated list is completed with a bounded number of extra requests.
+
+    Args:
+        text (str): The paper draft text.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        on_item: If given, the response is streamed and this callback is called with each
+            argument as soon as it has been generated.
+
+    Returns:
+        list: The extracted arguments as dicts, or None if all models failed.
+    """
+    cache_key = ANALYSIS_CACHE.key(text, ARGUMENTS_PROMPT, GEMINI_MODELS, schema_of(Argument))
+    cached = ANALYSIS_CACHE.get(cache_key, bypass=not use_cache)
+    if cached is not None:
+        print("Using cached arguments")
+        return cached
+
+    document = get_document_session(api_key, text)
+    describe = lambda argument: argument["context"]
+    if on_item is not None:
+        arguments, complete = stream_items(api_key, ARGUMENTS_PROMPT, Argument, describe, on_item, document=document)
+    else:
+        arguments, complete = generate_items(api_key, ARGUMENTS_PROMPT, Argument, describe, hedge_after=HEDGE_AFTER, document=document)
+    if arguments is None:
+        return None
+    print(f"Extracted {len(arguments)} arguments")
+    # Only complete lists are cached, an incomplete one is tried again on the next upload
+    if complete:
+        ANALYSIS_CACHE.set(cache_key, arguments, bypass=not use_cache)
+    return arguments
+
 
 def generate_papers(argument_nr : int):
     """
-    Generates a list of relevant scientific papers to improve or counter a given argument.
+    Generates a list of relevant scientific papers to improve or counter a given argument, in the background.
+    If the literature is already being prefetched, that request is reused instead of starting a new one.
+    Used as the callback of the literature button, so the argument card shows the request as soon as it reruns
+    and picks up the result itself.
 
     Args:
         argument_nr (int): The index of the argument in st.session_state["arguments"].
     """
-    argument = st.session_state["arguments"][argument_nr]
-    agent = st.session_state["agent"]
-
-    # Actually generate the papers
-    prompt = f"""
-            Given the following argument that is part of the user's paper draft, 
-            provide a list of at most three relevant scientific papers that can be used to improve or counter the argument.
-            The argument is: {argument['context']}
-
-            Format your response as a JSON object with the following fields:
-            - papers: A list of papers that can be used to improve or counter the argument, existing of:
-                - title: The title of the paper.
-                - authors: The authors of the paper.
-                - year: The year of publication.
-                - url: A link to the paper.
-                - abstract: A short summary of the paper.
-            - general: How the provided papers can improve the argument.
-        """
-    response = agent.run(prompt)
-
-    response_text = response.content
-    # Remove extra characters from the response
-    start_json = response_text.find("{")
-    end_json = response_text.rfind("}")
-    response_text = response_text[start_json:end_json + 1]
-    try:
-        response_json = json.loads(response_text) 
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-        generate_papers(argument_nr)  # Retry if there's an error
-
-    argument["counterargument"] = response_json
-    st.session_state["arguments"][argument_nr] = argument
-    st.write(st.session_state["arguments"])
-    
-    # Update the session state to indicate that the argument has been updated
-    update_status = st.session_state["updated_arguments"]
-    update_status[argument_nr] = True
-    st.session_state["updated_arguments"] = update_status
-    st.rerun()
+    request_literature(argument_nr)
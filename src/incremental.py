@@ -0,0 +1,260 @@
+"""
+incremental.py
+
+Re-analyses a revised version of the user's paper draft incrementally.
+The paragraphs of the new text are hashed and diffed against the previous version. Corrections and
+arguments in unchanged paragraphs are carried over, with their offsets shifted through the diff,
+and only the changed paragraphs are sent to the LLM. The analysis time for a small edit scales with
+the size of the edit instead of the size of the paper.
+
+Features:
+- Paragraph-level diff of two versions (difflib on paragraph hashes)
+- Carry-over of corrections and arguments (including loaded literature) from unchanged paragraphs
+- Corrections and arguments for the changed regions only, analysed concurrently
+- Full analysis when most of the text changed
+"""
+
+import difflib
+import hashlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from src.find_arguments import extract_arguments
+from src.spelling import check_spelling, spelling_available
+from src.text_corrections import find_corrections, merge_window_corrections, paragraph_spans
+from src.text_index import NormalizedText, locate_arguments, locate_corrections
+from src.tracing import propagate, span
+
+# Fraction of changed characters above which the revised draft is analysed from scratch
+MAX_CHANGED_FRACTION = 0.5
+# Maximum number of changed regions analysed at the same time
+MAX_REGION_WORKERS = 4
+
+def _paragraph_hash(paragraph : str):
+    return hashlib.sha1(paragraph.encode("utf-8")).digest()
+
+class ParagraphDiff:
+    """
+    Paragraph-level diff between two versions of a text.
+
+    Attributes:
+        moves (list): Tuples (old_start, old_end, shift) per unchanged paragraph. A position in
+            [old_start, old_end) of the old text is at position + shift in the new text.
+        regions (list): Tuples (start, end) of the runs of new or edited paragraphs in the new text.
+        changed_chars (int): Number of characters of the new text in changed regions.
+    """
+
+    def __init__(self, old_text : str, new_text : str):
+        old_paragraphs = paragraph_spans(old_text)
+        new_paragraphs = paragraph_spans(new_text)
+        matcher = difflib.SequenceMatcher(None,
+                                          [_paragraph_hash(old_text[start:end]) for start, end in old_paragraphs],
+                                          [_paragraph_hash(new_text[start:end]) for start, end in new_paragraphs],
+                                          autojunk=False)
+        self.moves = []
+        self.regions = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for (old_start, old_end), (new_start, _) in zip(old_paragraphs[i1:i2], new_paragraphs[j1:j2]):
+                    self.moves.append((old_start, old_end, new_start - old_start))
+            elif j2 > j1:
+                self.regions.append((new_paragraphs[j1][0], new_paragraphs[j2 - 1][1]))
+        self.changed_chars = sum(end - start for start, end in self.regions)
+        self._starts = [old_start for old_start, _, _ in self.moves]
+
+    def shift(self, start : int, end : int):
+        """
+        Maps a span of the old text to the new text.
+
+        Args:
+            start (int): Start of the span in the old text.
+            end (int): End of the span in the old text.
+
+        Returns:
+            int: The start of the span in the new text, or None if the span isn't inside one unchanged paragraph.
+        """
+        i = bisect_right(self._starts, start) - 1
+        if i < 0:
+            return None
+        old_start, old_end, shift = self.moves[i]
+        if end > old_end:
+            return None
+        return start + shift
+
+def incremental_diff(old_text : str, new_text : str):
+    """
+    Diffs a revised draft against the previous version, if an incremental analysis is worthwhile.
+
+    Args:
+        old_text (str): The previous version.
+        new_text (str): The revised version.
+
+    Returns:
+        ParagraphDiff: The diff, or None if more than MAX_CHANGED_FRACTION of the new text changed.
+    """
+    diff = ParagraphDiff(old_text, new_text)
+    print(f"Revised draft: {len(diff.regions)} changed regions, {diff.changed_chars} of {len(new_text)} characters")
+    if diff.changed_chars > MAX_CHANGED_FRACTION * len(new_text):
+        return None
+    return diff
+
+def _locate_corrections(text : str, corrections : list):
+    """
+    Finds the corrections in a text. Offsets that already point at the error are used as they are,
+    only the others are searched for, so the full text is scanned only if some can't be anchored.
+
+    Returns:
+        list: Tuples (correction, start, end), see locate_corrections.
+    """
+    located = []
+    missing = []
+    for correction in corrections:
+        start = correction.get("offset", -1)
+        if start >= 0 and correction["error"] and text.startswith(correction["error"], start):
+            located.append((correction, start, start + len(correction["error"])))
+        else:
+            missing.append(correction)
+    if missing:
+        located += locate_corrections(NormalizedText(text), missing)
+    return located
+
+def _locate_arguments(text : str, contexts : list):
+    """
+    Finds the arguments in a text, by exact match first and with locate_arguments for the others.
+
+    Returns:
+        list: Tuples (argument index, start, end), see locate_arguments.
+    """
+    located = []
+    missing = []
+    for i, context in enumerate(contexts):
+        start = text.find(context) if context else -1
+        if start != -1:
+            located.append((i, start, start + len(context)))
+        else:
+            missing.append(i)
+    if missing:
+        located += [(missing[j], start, end) for j, start, end in locate_arguments(NormalizedText(text), [contexts[i] for i in missing])]
+    return located
+
+def carry_over_corrections(diff : ParagraphDiff, old_text : str, corrections : list):
+    """
+    Returns the corrections of the previous version that lie in unchanged paragraphs, with their offsets in the new text.
+
+    Args:
+        diff (ParagraphDiff): The diff between the versions.
+        old_text (str): The previous version.
+        corrections (list): The corrections of the previous version.
+
+    Returns:
+        list: Copies of the carried-over corrections.
+    """
+    carried = []
+    for correction, start, end in _locate_corrections(old_text, corrections):
+        new_start = diff.shift(start, end)
+        if new_start is None:
+            continue
+        correction = dict(correction)
+        correction["offset"] = new_start
+        correction["length"] = end - start
+        carried.append(correction)
+    return carried
+
+def carry_over_arguments(diff : ParagraphDiff, old_text : str, arguments : list):
+    """
+    Returns the arguments of the previous version that lie in unchanged paragraphs, with their literature.
+
+    Args:
+        diff (ParagraphDiff): The diff between the versions.
+        old_text (str): The previous version.
+        arguments (list): The arguments of the previous version.
+
+    Returns:
+        list: Copies of the carried-over arguments.
+    """
+    located = _locate_arguments(old_text, [argument["context"] for argument in arguments])
+    return [dict(arguments[i]) for i, start, end in sorted(located) if diff.shift(start, end) is not None]
+
+def _analyse_regions(diff : ParagraphDiff, text : str, analyse):
+    """
+    Runs an analysis on every changed region concurrently.
+
+    Returns:
+        list: Tuples (base_offset, region_text, result) per region, in document order.
+    """
+    def run(start, end):
+        return start, text[start:end], analyse(text[start:end])
+    with ThreadPoolExecutor(max_workers=MAX_REGION_WORKERS) as executor:
+        futures = [executor.submit(propagate(run), start, end) for start, end in diff.regions]
+        return [future.result() for future in futures]
+
+def update_corrections(old_text : str, old_corrections : list, text : str, api_key : str, use_cache : bool = True, on_item=None):
+    """
+    Finds the corrections of a revised draft, carrying over those of the previous version in
+    unchanged paragraphs and correcting only the changed paragraphs with the LLM.
+    The local spelling pass takes milliseconds, so it checks the whole revised draft.
+    Does not touch Streamlit session state, so it can run outside the script thread.
+
+    Args:
+        old_text (str): The previous version.
+        old_corrections (list): The corrections of the previous version, as dicts or a CorrectionStore.
+        text (str): The revised version.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        on_item: Optional callback for streamed corrections, see find_corrections.
+
+    Returns:
+        list: The corrections as dicts, or None if a changed region failed.
+    """
+    diff = incremental_diff(old_text, text)
+    if diff is None:
+        return find_corrections(text, api_key, use_cache, None, on_item)
+    with span("incremental", analysis="corrections_llm", regions=len(diff.regions), changed_chars=diff.changed_chars) as update_span:
+        spelling = check_spelling(text) if spelling_available() else []
+        if spelling:
+            old_corrections = [correction for correction in old_corrections if correction["type"] != "spelling"]
+        carried = carry_over_corrections(diff, old_text, old_corrections)
+        update_span.set(carried=len(carried), spelling=len(spelling))
+        if on_item is not None:
+            for correction in spelling + carried:
+                on_item(correction)
+        results = _analyse_regions(diff, text, lambda region: find_corrections(region, api_key, use_cache, None, on_item, spelling=False))
+        if any(corrections is None for _, _, corrections in results):
+            return None
+        corrections = merge_window_corrections(results)
+        if spelling:
+            corrections = [correction for correction in corrections if correction["type"] != "spelling"]
+        return sorted(spelling + carried + corrections, key=lambda x: x["offset"])
+
+def update_arguments(old_text : str, old_arguments : list, text : str, api_key : str, use_cache : bool = True, on_item=None):
+    """
+    Extracts the arguments of a revised draft, carrying over those of the previous version in
+    unchanged paragraphs and extracting arguments only from the changed paragraphs.
+    Does not touch Streamlit session state, so it can run outside the script thread.
+
+    Args:
+        old_text (str): The previous version.
+        old_arguments (list): The arguments of the previous version.
+        text (str): The revised version.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        on_item: Optional callback for streamed arguments, see extract_arguments.
+
+    Returns:
+        list: The arguments as dicts in document order, or None if a changed region failed.
+    """
+    diff = incremental_diff(old_text, text)
+    if diff is None:
+        return extract_arguments(text, api_key, use_cache, on_item)
+    with span("incremental", analysis="arguments", regions=len(diff.regions), changed_chars=diff.changed_chars) as update_span:
+        carried = carry_over_arguments(diff, old_text, old_arguments)
+        update_span.set(carried=len(carried))
+        if on_item is not None:
+            for argument in carried:
+                on_item(argument)
+        results = _analyse_regions(diff, text, lambda region: extract_arguments(region, api_key, use_cache, on_item))
+        if any(arguments is None for _, _, arguments in results):
+            return None
+        arguments = carried + [argument for _, _, region_arguments in results for argument in region_arguments]
+        # Keep the cards in document order, arguments that can't be found go last
+        positions = {i: start for i, start, _ in _locate_arguments(text, [argument["context"] for argument in arguments])}
+        return [arguments[i] for i in sorted(range(len(arguments)), key=lambda i: positions.get(i, len(text)))]
@@ -0,0 +1,235 @@
+"""
+jobs.py
+
+Provides process-wide background job queues for LLM work.
+Jobs run on a worker pool outside the Streamlit script run, so reruns never block on LLM calls and
+in-flight work survives reruns and reconnects. Sessions keep only job IDs in session state and
+pick up progress and results when the page polls.
+
+Features:
+- Job IDs with status, progress (streamed items) and results held outside the script run
+- Duplicate jobs (same kind and document) are merged into one, also across sessions
+- Finished jobs are kept for a retention period, so a reconnecting session finds the result
+- Queued jobs are cancelled when no session is waiting for them anymore
+- Future-like interface (done, result, exception, cancelled)
+"""
+
+import hashlib
+import itertools
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from src.tracing import propagate
+
+# Seconds a finished job is kept after it finished
+JOB_RETENTION = 600
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_job_ids = itertools.count(1)
+
+class JobFailed(Exception):
+    """
+    Raised for a job that finished without a result, so it is not merged with later submissions.
+    """
+
+def document_key(text : str):
+    """
+    Returns the key of a document for deduplicating jobs about it.
+
+    Args:
+        text (str): The paper draft text.
+
+    Returns:
+        str: The hex SHA-256 digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class Job:
+    """
+    A unit of background work.
+
+    Attributes:
+        job_id (str): Unique ID of the job.
+        key (tuple): Deduplication key, jobs with the same key are merged.
+        status (str): queued, running, done, failed or cancelled.
+        created (float): Time the job was submitted.
+        finished (float): Time the job finished, or None.
+    """
+
+    def __init__(self, queue_name : str, key : tuple):
+        self.job_id = f"{queue_name}-{next(_job_ids)}"
+        self.key = key
+        self.status = QUEUED
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+        self._items = []
+        self._holders = 1
+        self._future = None
+
+    def add_item(self, item):
+        """
+        Reports a partial result, e.g. an item of a streamed list. Called from the worker.
+
+        Args:
+            item: The item.
+        """
+        with self._lock:
+            self._items.append(item)
+
+    def items(self):
+        """
+        Returns the partial results reported so far.
+
+        Returns:
+            list: A copy of the items.
+        """
+        with self._lock:
+            return list(self._items)
+
+    # Future interface, for callers that already handle futures
+    def done(self):
+        return self._future.done()
+
+    def cancelled(self):
+        return self._future.cancelled()
+
+    def result(self, timeout : float = None):
+        return self._future.result(timeout)
+
+    def exception(self, timeout : float = None):
+        return self._future.exception(timeout)
+
+    def hold(self):
+        """
+        Registers one more session waiting for the job.
+        """
+        with self._lock:
+            self._holders += 1
+
+    def release(self):
+        """
+        Unregisters a session waiting for the job. A queued job nobody waits for anymore is cancelled.
+        """
+        with self._lock:
+            self._holders -= 1
+            holders = self._holders
+        if holders <= 0 and self._future.cancel():
+            self.status = CANCELLED
+            self.finished = time.time()
+
+    def _run(self, fn):
+        self.status = RUNNING
+        try:
+            result = fn(self)
+            if result is None:
+                raise JobFailed("The job finished without a result")
+        except BaseException:
+            self.status = FAILED
+            raise
+        finally:
+            self.finished = time.time()
+        self.status = DONE
+        return result
+
+class JobQueue:
+    """
+    A named worker pool running jobs, with deduplication of jobs by key.
+
+    Attributes:
+        name (str): Name of the queue, used in job IDs and thread names.
+        max_workers (int): Maximum number of jobs running at the same time.
+    """
+
+    def __init__(self, name : str, max_workers : int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"jobs-{name}")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+
+    def submit(self, key : tuple, fn):
+        """
+        Submits a job, or joins the job with the same key if it is queued, running or finished successfully.
+        A job returning None counts as failed, failed and cancelled jobs are submitted again.
+
+        Args:
+            key (tuple): Deduplication key, e.g. (kind, text hash).
+            fn: Function called with the Job on a worker thread. It can report partial results
+                with job.add_item and returns the result of the job.
+
+        Returns:
+            Job: The job.
+        """
+        with self._lock:
+            self._prune()
+            job = self._by_key.get(key)
+            if job is not None and job.status not in (FAILED, CANCELLED):
+                job.hold()
+                return job
+            job = Job(self.name, key)
+            job._future = self._executor.submit(propagate(job._run), fn)
+            self._jobs[job.job_id] = job
+            self._by_key[key] = job
+            return job
+
+    def get(self, job_id : str):
+        """
+        Returns a job by its ID.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            Job: The job, or None if it is unknown or expired.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """
+        Returns the number of jobs per status.
+
+        Returns:
+            dict: Count per status.
+        """
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _prune(self):
+        """
+        Forgets jobs that finished more than JOB_RETENTION seconds ago. Called with the lock held.
+        """
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > JOB_RETENTION:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+def job_outcome(job):
+    """
+    Returns the outcome of a finished job.
+
+    Args:
+        job (Job): The finished job.
+
+    Returns:
+        tuple: The result (None if the job failed) and the error message (None if it succeeded).
+    """
+    try:
+        return job.result(), None
+    except CancelledError:
+        return None, "The request was cancelled."
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,315 @@
+"""
+json_parsing.py
+
+Provides tolerant parsing of the JSON lists returned by the LLMs.
+A malformed or truncated response no longer triggers a full new generation: every complete
+item that validates against its model is kept, and only the missing tail is requested again,
+within a hard retry budget.
+
+Features:
+- Strips markdown code fences around JSON
+- Salvages complete, valid items from truncated or partly malformed arrays
+- Requests only the missing tail of a truncated list, with a bounded number of retries
+- Tolerant parsing of single JSON objects (used for literature suggestions)
+- Incremental parsing of streamed arrays, yielding each item as soon as its object closes
+- Tracing span per parsed response
+"""
+
+import json
+from pydantic import ValidationError
+from src.llm_client import LLMError, generate_content, generate_content_stream
+from src.tracing import span
+
+# Maximum number of extra requests for one list (continuations or full retries)
+MAX_PARSE_RETRIES = 2
+
+CONTINUATION_PROMPT = """{prompt}
+
+                 Your previous answer was cut off. It already contained {count} items, the last one being:
+                 {last_item}
+                 Return only the remaining items that come after this one, as a JSON list in the same format.
+                 Return an empty list if there are no remaining items."""
+
+_decoder = json.JSONDecoder()
+
+def strip_fences(raw : str):
+    """
+    Removes markdown code fences around a JSON response.
+
+    Args:
+        raw (str): The response text.
+
+    Returns:
+        str: The response without fences and surrounding whitespace.
+    """
+    raw = raw.strip()
+    if raw.startswith("```"):
+        newline = raw.find("\n")
+        raw = raw[newline + 1:] if newline != -1 else raw[3:]
+        if raw.rstrip().endswith("```"):
+            raw = raw.rstrip()[:-3]
+    return raw.strip()
+
+def parse_items(raw : str, item_model):
+    """
+    Parses a JSON list, keeping every complete item that validates against the item model.
+
+    Args:
+        raw (str): The response text.
+        item_model: The pydantic model of the list items.
+
+    Returns:
+        tuple: The valid items as dicts, and whether the list was complete (closing bracket reached,
+            or the end of a response with objects but no list).
+    """
+    text = strip_fences(raw)
+    items = []
+    position = text.find("[")
+    # Some responses contain a single object instead of a list, it is complete once it has been decoded
+    bare = position == -1
+    if bare:
+        position = text.find("{")
+        if position == -1:
+            return items, False
+        text = text[:position] + "[" + text[position:]
+    position += 1
+    decoded = False
+
+    while True:
+        # Skip whitespace and separators between items
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text):
+            return items, bare and decoded
+        if text[position] == "]":
+            return items, True
+        try:
+            item, position = _decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            # Truncated or malformed tail, keep what was complete
+            return items, False
+        decoded = True
+        try:
+            items.append(item_model.model_validate(item).model_dump())
+        except ValidationError as e:
+            print(f"Skipping invalid item: {e.errors()[0]['msg']}")
+
+def _parse_traced(raw : str, item_model):
+    """
+    Parses a JSON list with parse_items and records it as a tracing span.
+    """
+    with span("json_parse", item_model=item_model.__name__, response_chars=len(raw)) as parse_span:
+        items, complete = parse_items(raw, item_model)
+        parse_span.set(items=len(items), complete=complete)
+    return items, complete
+
+def parse_object(raw : str):
+    """
+    Parses the first JSON object in a response, ignoring text around it.
+
+    Args:
+        raw (str): The response text.
+
+    Returns:
+        dict: The parsed object, or None if no complete object was found.
+    """
+    text = strip_fences(raw)
+    position = text.find("{")
+    while position != -1:
+        try:
+            item, _ = _decoder.raw_decode(text, position)
+            if isinstance(item, dict):
+                return item
+        except json.JSONDecodeError:
+            pass
+        position = text.find("{", position + 1)
+    return None
+
+class IncrementalArrayParser:
+    """
+    Parses a JSON array of objects from a stream of text chunks.
+    Each character is scanned once; an object is decoded and validated as soon as its closing brace arrives.
+
+    Attributes:
+        complete (bool): Whether the closing bracket of the array was reached.
+    """
+
+    def __init__(self, item_model):
+        self.item_model = item_model
+        self.complete = False
+        self._text = ""
+        self._position = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = 0
+
+    def feed(self, chunk : str):
+        """
+        Adds a chunk of the stream.
+
+        Args:
+            chunk (str): The next text chunk.
+
+        Returns:
+            list: The items (as dicts) that were completed by this chunk and validate against the item model.
+        """
+        items = []
+        text = self._text + chunk
+        position = self._position
+        while position < len(text) and not self.complete:
+            char = text[position]
+            if not self._started:
+                self._started = char == "["
+            elif self._depth == 0:
+                if char == "{":
+                    self._item_start = position
+                    self._depth = 1
+                elif char == "]":
+                    self.complete = True
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._validate(text[self._item_start:position + 1])
+                    if item is not None:
+                        items.append(item)
+            position += 1
+
+        # Only keep the unfinished object, everything before it has been consumed
+        if self._depth > 0:
+            self._text = text[self._item_start:]
+            self._position = position - self._item_start
+            self._item_start = 0
+        else:
+            self._text = ""
+            self._position = 0
+        return items
+
+    def _validate(self, raw_item : str):
+        try:
+            return self.item_model.model_validate(json.loads(raw_item)).model_dump()
+        except (json.JSONDecodeError, ValidationError) as e:
+            print(f"Skipping invalid streamed item: {e}")
+            return None
+
+def _complete_items(api_key : str, prompt : str, item_model, describe, items : list, config : dict, max_retries : int, on_item=None, **kwargs):
+    """
+    Requests the missing tail of a truncated list (or the full list if nothing was parsed),
+    within the retry budget. New items are appended to `items`; items that equal one already
+    parsed are dropped, a continuation often repeats the last item.
+
+    Returns:
+        bool: Whether the list is complete.
+    """
+    complete = False
+    retries = 0
+    seen = {json.dumps(item, sort_keys=True) for item in items}
+    while not complete and retries < max_retries:
+        retries += 1
+        if items:
+            print(f"Response was cut off after {len(items)} items, requesting the rest...")
+            request = CONTINUATION_PROMPT.format(prompt=prompt, count=len(items), last_item=describe(items[-1]))
+        else:
+            print("Could not parse any items from the response, retrying...")
+            request = prompt
+        try:
+            raw, _ = generate_content(api_key, request, config=config, **kwargs)
+        except LLMError as e:
+            print(e)
+            break
+        more_items, complete = _parse_traced(raw, item_model)
+        new_items = []
+        for item in more_items:
+            key = json.dumps(item, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                new_items.append(item)
+        if len(new_items) < len(more_items):
+            print(f"Dropped {len(more_items) - len(new_items)} repeated items")
+        more_items = new_items
+        items.extend(more_items)
+        if on_item is not None:
+            for item in more_items:
+                on_item(item)
+    return complete
+
+def _list_config(item_model):
+    return {
+        'response_mime_type': 'application/json',
+        'response_schema': list[item_model],
+    }
+
+def generate_items(api_key : str, prompt : str, item_model, describe, max_retries : int = MAX_PARSE_RETRIES, **kwargs):
+    """
+    Generates a JSON list of items with the LLM client and parses it tolerantly.
+    If the list is truncated, only the missing tail is requested again.
+    If nothing could be parsed, the full request is retried. Both count against max_retries.
+
+    Args:
+        api_key (str): The Gemini API key.
+        prompt (str): The prompt asking for the list.
+        item_model: The pydantic model of the list items.
+        describe: Function returning a short description of an item, used to tell the model where to continue.
+        max_retries (int): Maximum number of extra requests.
+        **kwargs: Passed on to generate_content (e.g. hedge_after).
+
+    Returns:
+        tuple: The valid items (or None if the first request failed), and whether the list is complete.
+    """
+    config = _list_config(item_model)
+    try:
+        raw, _ = generate_content(api_key, prompt, config=config, **kwargs)
+    except LLMError as e:
+        print(e)
+        return None, False
+    items, complete = _parse_traced(raw, item_model)
+    if not complete:
+        complete = _complete_items(api_key, prompt, item_model, describe, items, config, max_retries, **kwargs)
+    return items, complete
+
+def stream_items(api_key : str, prompt : str, item_model, describe, on_item, max_retries : int = MAX_PARSE_RETRIES, **kwargs):
+    """
+    Streams a JSON list of items and calls `on_item` for each item as soon as its object closes.
+    A truncated or broken stream is completed like in generate_items.
+
+    Args:
+        api_key (str): The Gemini API key.
+        prompt (str): The prompt asking for the list.
+        item_model: The pydantic model of the list items.
+        describe: Function returning a short description of an item, used to tell the model where to continue.
+        on_item: Callback called with each valid item. Runs on the calling thread.
+        max_retries (int): Maximum number of extra requests.
+        **kwargs: Passed on to generate_content for the extra requests (the document session also to the stream).
+
+    Returns:
+        tuple: The valid items (or None if no model answered), and whether the list is complete.
+    """
+    config = _list_config(item_model)
+    parser = IncrementalArrayParser(item_model)
+    items = []
+    try:
+        for chunk in generate_content_stream(api_key, prompt, config=config, document=kwargs.get("document")):
+            for item in parser.feed(chunk):
+                items.append(item)
+                on_item(item)
+    except LLMError as e:
+        print(e)
+        return None, False
+    except Exception as e:
+        print(f"Stream broke off after {len(items)} items: {e}")
+    complete = parser.complete
+    if not complete:
+        complete = _complete_items(api_key, prompt, item_model, describe, items, config, max_retries, on_item, **kwargs)
+    return items, complete
@@ -0,0 +1,322 @@
+"""
+literature.py
+
+Provides literature suggestions for the arguments in the user's paper draft.
+Requests run as background jobs on a process-wide queue (see jobs.py) with a bounded number of
+concurrent requests, so literature for all arguments can be loaded at once and the top arguments
+can be prefetched while the user reads the general feedback. The page never waits for a request,
+results are picked up whenever it runs.
+
+Features:
+- Literature suggestions for a single argument
+- Bounded concurrent fan-out over all arguments ("Load all literature")
+- Speculative background prefetch, released when the session ends or a new paper is uploaded
+- Identical requests of different sessions are merged into one job
+- Results are written to session state from the script thread only, for all arguments or for one argument card
+- Requests carry the passages relevant to the argument instead of the full paper
+"""
+
+import copy
+import weakref
+import streamlit as st
+from src.assistant import create_agent
+from src.json_parsing import MAX_PARSE_RETRIES, parse_object
+from src.render_cache import bump_version
+from src.retrieval import get_passage_index
+from src.jobs import JobQueue, document_key, job_outcome
+from src.tracing import span
+
+# Maximum number of literature requests running at the same time, over all sessions
+LITERATURE_WORKERS = 8
+# Number of arguments prefetched while the user reads the general feedback
+PREFETCH_COUNT = 3
+
+LITERATURE_PROMPT = """
+            Given the following argument that is part of the user's paper draft,
+            provide a list of at most three relevant scientific papers that can be used to improve or counter the argument.
+            The argument is: {context}
+
+            Format your response as a JSON object with the following fields:
+            - papers: A list of papers that can be used to improve or counter the argument, existing of:
+                - title: The title of the paper.
+                - authors: The authors of the paper.
+                - year: The year of publication.
+                - url: A link to the paper.
+                - abstract: A short summary of the paper.
+            - general: How the provided papers can improve the argument.
+        """
+
+# Process-wide queue running the literature requests of all sessions
+LITERATURE_JOBS = JobQueue("literature", LITERATURE_WORKERS)
+
+def fetch_literature(index, api_key : str, context : str, max_retries : int = MAX_PARSE_RETRIES):
+    """
+    Asks a feedback assistant for relevant scientific papers to improve or counter an argument.
+    Uses its own agent, so it can run next to other requests and outside the script thread.
+    Only the passages of the paper that are relevant to the argument are sent along.
+
+    Args:
+        index (PassageIndex): The passage index of the paper draft.
+        api_key (str): The Perplexity API key.
+        context (str): The full argument.
+        max_retries (int): Maximum number of extra requests if the response can't be parsed.
+
+    Returns:
+        dict: The literature with 'papers' and 'general' fields, or None if no valid response was received.
+    """
+    agent = create_agent(index.summary, api_key)
+    prompt = index.scoped_prompt(LITERATURE_PROMPT.format(context=context), query=context)
+    with span("literature", model=agent.model.id, prompt_chars=len(prompt)) as literature_span:
+        for attempt in range(max_retries + 1):
+            response = agent.run(prompt)
+            literature = parse_object(response.content or "")
+            literature_span.set(attempts=attempt + 1, response_chars=len(response.content or ""))
+            if literature is not None and "papers" in literature and "general" in literature:
+                return literature
+            print(f"Could not parse literature response (attempt {attempt + 1} of {max_retries + 1})")
+        literature_span.set(parsed=False)
+    return None
+
+def _release_jobs(jobs : dict):
+    """
+    Releases the jobs of a fetcher, cancelling those that are queued and not shared with another session.
+    """
+    for job in list(jobs.values()):
+        job.release()
+    jobs.clear()
+
+class LiteratureFetcher:
+    """
+    Tracks the literature jobs of one session on the process-wide literature queue.
+    The jobs are released, cancelling queued requests no other session waits for, when the fetcher
+    is cancelled or garbage collected together with the session state it is stored in.
+    """
+
+    def __init__(self, index, api_key : str):
+        self._index = index
+        self._api_key = api_key
+        self._document = document_key(index.text)
+        self._jobs = {}
+        # The finalizer must not reference self, so the fetcher can be collected with the session
+        self._release = weakref.finalize(self, _release_jobs, self._jobs)
+
+    def submit(self, argument_nr : int, context : str):
+        """
+        Starts fetching literature for an argument, unless it is already being fetched.
+
+        Args:
+            argument_nr (int): The index of the argument.
+            context (str): The full argument.
+
+        Returns:
+            Job: The job of the request.
+        """
+        job = self._jobs.get(argument_nr)
+        if job is None or (job.done() and job.exception() is not None):
+            if job is not None:
+                job.release()
+            index, api_key = self._index, self._api_key
+            job = LITERATURE_JOBS.submit(("literature", self._document, context), lambda job: fetch_literature(index, api_key, context))
+            self._jobs[argument_nr] = job
+        return job
+
+    def jobs(self):
+        """
+        Returns the jobs of all submitted requests that haven't been collected yet.
+
+        Returns:
+            dict: Job per argument index.
+        """
+        return dict(self._jobs)
+
+    def pending(self, argument_nr : int):
+        """
+        Returns whether the request for an argument is still queued or running.
+
+        Args:
+            argument_nr (int): The index of the argument.
+
+        Returns:
+            bool: True if the request hasn't finished yet.
+        """
+        job = self._jobs.get(argument_nr)
+        return job is not None and not job.done()
+
+    def pop(self, argument_nr : int):
+        """
+        Forgets the request for an argument after its result has been collected.
+
+        Args:
+            argument_nr (int): The index of the argument.
+        """
+        job = self._jobs.pop(argument_nr, None)
+        if job is not None:
+            job.release()
+
+    def cancel(self):
+        """
+        Releases all requests. Queued requests are cancelled, unless another session waits for them too.
+        Running requests finish, but their results are dropped.
+        """
+        self._release()
+
+def get_literature_fetcher():
+    """
+    Returns the literature fetcher of the current session, creating it if needed.
+
+    Returns:
+        LiteratureFetcher: The fetcher for the passage index of st.session_state["text"].
+    """
+    fetcher = st.session_state.get("literature_fetcher")
+    if fetcher is None:
+        fetcher = LiteratureFetcher(get_passage_index(), str(st.secrets["PERPLEXITY_API_KEY"]))
+        st.session_state["literature_fetcher"] = fetcher
+    return fetcher
+
+def cancel_literature():
+    """
+    Cancels all literature requests of the current session, e.g. when a new paper is uploaded.
+    """
+    st.session_state.pop("literature_failed", None)
+    fetcher = st.session_state.pop("literature_fetcher", None)
+    if fetcher is not None:
+        fetcher.cancel()
+
+def store_literature(argument_nr : int, literature : dict):
+    """
+    Stores the literature of an argument in session state and marks the argument as updated.
+    Must be called from the Streamlit script thread.
+
+    Args:
+        argument_nr (int): The index of the argument.
+        literature (dict): The literature returned by fetch_literature. It is copied, a merged job
+            returns the same result to every session that joined it.
+    """
+    st.session_state["arguments"][argument_nr]["counterargument"] = copy.deepcopy(literature)
+    update_status = st.session_state["updated_arguments"]
+    update_status[argument_nr] = True
+    st.session_state["updated_arguments"] = update_status
+    bump_version("arguments")
+
+def _collect(fetcher, argument_nr : int, job):
+    """
+    Stores the result of a finished request, or records its error.
+
+    Returns:
+        bool: True if literature was stored.
+    """
+    fetcher.pop(argument_nr)
+    literature, error = job_outcome(job)
+    if literature is None:
+        print(f"Loading literature for argument {argument_nr} failed: {error}")
+        st.session_state.setdefault("literature_failed", set()).add(argument_nr)
+        return False
+    store_literature(argument_nr, literature)
+    return True
+
+def collect_literature():
+    """
+    Stores the results of all finished background requests in session state.
+
+    Returns:
+        int: The number of arguments that received literature.
+    """
+    fetcher = st.session_state.get("literature_fetcher")
+    if fetcher is None:
+        return 0
+    collected = 0
+    for argument_nr, job in fetcher.jobs().items():
+        if job.done():
+            collected += _collect(fetcher, argument_nr, job)
+    return collected
+
+def collect_argument_literature(argument_nr : int):
+    """
+    Stores the result of the background request for one argument in session state, if it finished.
+    Lets the card of the argument pick up its literature without collecting the others.
+
+    Args:
+        argument_nr (int): The index of the argument.
+
+    Returns:
+        bool: True if the request finished, with or without literature.
+    """
+    fetcher = st.session_state.get("literature_fetcher")
+    if fetcher is None:
+        return False
+    job = fetcher.jobs().get(argument_nr)
+    if job is None or not job.done():
+        return False
+    _collect(fetcher, argument_nr, job)
+    return True
+
+def request_literature(argument_nr : int):
+    """
+    Starts loading literature for one argument in the background, reusing a prefetch that is already running.
+    The result is stored by collect_literature on a later run.
+
+    Args:
+        argument_nr (int): The index of the argument in st.session_state["arguments"].
+    """
+    st.session_state.get("literature_failed", set()).discard(argument_nr)
+    get_literature_fetcher().submit(argument_nr, st.session_state["arguments"][argument_nr]["context"])
+
+def request_all_literature():
+    """
+    Starts loading literature for every argument that doesn't have it yet. At most LITERATURE_WORKERS
+    requests run at the same time, the results are stored by collect_literature as they finish.
+    """
+    for argument_nr in range(len(st.session_state["arguments"])):
+        if not st.session_state["updated_arguments"][argument_nr]:
+            request_literature(argument_nr)
+
+def literature_pending(argument_nr : int):
+    """
+    Returns whether literature for an argument is being loaded.
+
+    Args:
+        argument_nr (int): The index of the argument.
+
+    Returns:
+        bool: True if a request for the argument is queued or running.
+    """
+    fetcher = st.session_state.get("literature_fetcher")
+    return fetcher is not None and fetcher.pending(argument_nr)
+
+def literature_failed(argument_nr : int):
+    """
+    Returns whether the last request for an argument failed.
+
+    Args:
+        argument_nr (int): The index of the argument.
+
+    Returns:
+        bool: True if no literature could be loaded.
+    """
+    return argument_nr in st.session_state.get("literature_failed", set())
+
+def literature_running():
+    """
+    Returns whether this session is waiting for literature requests.
+
+    Returns:
+        bool: True if any request hasn't been collected yet.
+    """
+    fetcher = st.session_state.get("literature_fetcher")
+    return fetcher is not None and bool(fetcher.jobs())
+
+def prefetch_literature(count : int = PREFETCH_COUNT):
+    """
+    Speculatively starts fetching literature for the first arguments in the background.
+    Does not wait for the results, they are picked up by collect_literature on a later run.
+    Arguments whose request failed are left to the user, who can try again on the argument card.
+
+    Args:
+        count (int): The number of arguments to prefetch.
+    """
+    if "arguments" not in st.session_state:
+        return
+    fetcher = get_literature_fetcher()
+    for argument_nr, argument in enumerate(st.session_state["arguments"][:count]):
+        if not st.session_state["updated_arguments"][argument_nr] and not literature_failed(argument_nr):
+            fetcher.submit(argument_nr, argument["context"])
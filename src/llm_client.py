@@ -0,0 +1,471 @@
+"""
+llm_client.py
+
+Provides the shared Google Gemini client used for argument extraction and corrections.
+Replaces the per-call clients and nested fallback ladders with one request path that has
+timeouts, retries and model fallback built in.
+
+Features:
+- One google.genai client per API key, shared by all sessions and threads
+- Per-request timeouts and exponential backoff with jitter for transient errors
+- Per-model health tracking: a failing model is skipped for a cooldown window
+- Optional hedged requests to the next model when the current one is slow, the slower one gives up once the other answered
+- Per-model latency and error statistics
+- A tracing span per attempt with model, attempt number, prompt/response sizes and token counts
+- Streaming responses with fallback to the next model before the first chunk
+- Requests against a registered document session (see document_session.py)
+- Optional limit on the number of requests and streams in flight in the process, e.g. for batch runs
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from src.tracing import Span, propagate, record, span
+
+# Gemini models to try, in order of preference
+GEMINI_MODELS = ["gemini-2.0-flash", "gemini-2.0-flash-lite", "gemini-1.5-flash"]
+
+# Timeout per request in seconds
+REQUEST_TIMEOUT = 120
+# Retries per model for transient errors (timeouts, rate limits, server errors)
+MAX_RETRIES = 2
+# Base and maximum delay in seconds for exponential backoff
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 16.0
+# Consecutive failures after which a model is skipped, and for how long in seconds
+FAILURE_THRESHOLD = 3
+COOLDOWN = 60
+# Number of latencies kept per model for the statistics
+LATENCY_WINDOW = 200
+
+class LLMError(Exception):
+    """
+    Raised when no model returned a response.
+    """
+
+class Superseded(Exception):
+    """
+    Raised by a hedged request that gives up because the other request already answered.
+    """
+
+class ModelHealth:
+    """
+    Tracks the health and latency of one model.
+
+    Attributes:
+        model (str): The model name.
+        calls (int): Number of requests.
+        errors (int): Number of failed requests.
+        consecutive_failures (int): Number of failures since the last success.
+        open_until (float): Time until which the model is skipped.
+        latencies (deque): Latencies in seconds of the most recent successful requests.
+    """
+
+    def __init__(self, model : str):
+        self.model = model
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def available(self):
+        """
+        Returns whether the model is outside its cooldown window.
+        """
+        return time.time() >= self.open_until
+
+    def record_success(self, latency : float):
+        self.calls += 1
+        self.consecutive_failures = 0
+        self.latencies.append(latency)
+
+    def record_failure(self):
+        self.calls += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.open_until = time.time() + COOLDOWN
+            print(f"Skipping {self.model} for {COOLDOWN} seconds after {self.consecutive_failures} failures")
+
+    def stats(self):
+        """
+        Returns the statistics of the model.
+
+        Returns:
+            dict: Calls, errors, error rate, p50/p95/mean latency and whether the model is available.
+        """
+        latencies = sorted(self.latencies)
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": self.errors / self.calls if self.calls else 0.0,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+            "available": self.available(),
+        }
+
+_lock = threading.Lock()
+_clients = {}
+_health = {}
+# Threads for hedged requests, shared by all sessions
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+# Slots of the requests in flight in this process, None for no limit (see set_request_limit)
+_request_slots = None
+
+def set_request_limit(limit : int):
+    """
+    Limits the number of requests in flight in this process. Requests over the limit wait for a slot.
+    A stream holds a slot until it has been read completely or fails.
+
+    Args:
+        limit (int): The maximum number of requests, or None for no limit.
+    """
+    global _request_slots
+    _request_slots = threading.BoundedSemaphore(limit) if limit else None
+
+def request_slot():
+    """
+    Returns a context manager that holds one request slot, see set_request_limit.
+    Also used around requests to other providers, e.g. the feedback assistant.
+
+    Returns:
+        The context manager.
+    """
+    return _request_slots if _request_slots is not None else nullcontext()
+
+def get_client(api_key : str):
+    """
+    Returns the shared google.genai client for an API key.
+
+    Args:
+        api_key (str): The Gemini API key.
+
+    Returns:
+        google.genai.Client: The client.
+    """
+    import google.genai
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = google.genai.Client(api_key=api_key)
+            _clients[api_key] = client
+        return client
+
+def get_health(model : str):
+    """
+    Returns the health tracker of a model.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        ModelHealth: The tracker.
+    """
+    with _lock:
+        health = _health.get(model)
+        if health is None:
+            health = ModelHealth(model)
+            _health[model] = health
+        return health
+
+def model_stats():
+    """
+    Returns the latency and error statistics of every model that was used.
+
+    Returns:
+        dict: Statistics per model name.
+    """
+    with _lock:
+        trackers = list(_health.values())
+    return {health.model: health.stats() for health in trackers}
+
+def is_retryable(error : Exception):
+    """
+    Returns whether an error is transient, so the same model can be tried again.
+
+    Args:
+        error (Exception): The error raised by the request.
+
+    Returns:
+        bool: True for timeouts, connection errors, rate limits and server errors.
+    """
+    import httpx
+    from google.genai import errors
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, errors.ServerError):
+        return True
+    if isinstance(error, errors.APIError):
+        return error.code == 429
+    return False
+
+def backoff_delay(attempt : int):
+    """
+    Returns the delay before a retry, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the retry, starting at 0.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def contents_size(contents):
+    """
+    Returns the number of characters in the contents of a request.
+
+    Args:
+        contents: A string or a list of strings.
+
+    Returns:
+        int: The number of characters.
+    """
+    if isinstance(contents, str):
+        return len(contents)
+    return sum(len(part) for part in contents if isinstance(part, str))
+
+def usage_attributes(usage):
+    """
+    Returns the token counts of a response as span attributes.
+
+    Args:
+        usage: The usage_metadata of a response, or None.
+
+    Returns:
+        dict: prompt_tokens, response_tokens and cached_tokens, where known.
+    """
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": usage.prompt_token_count,
+        "response_tokens": usage.candidates_token_count,
+        "cached_tokens": usage.cached_content_token_count,
+    }
+
+def _check_superseded(stop : threading.Event, model : str):
+    """
+    Raises Superseded if a hedged request doesn't need this request anymore.
+    """
+    if stop is not None and stop.is_set():
+        raise Superseded(f"The hedged request to {model} isn't needed anymore")
+
+def _request(api_key : str, model : str, prompt, config : dict, timeout : float, document=None, attempt : int = 0, stop : threading.Event = None):
+    """
+    Sends a single request to a model and records its outcome.
+    With `stop`, the request is dropped if the event is set by the time it gets its slot.
+
+    Returns:
+        str: The response text.
+    """
+    health = get_health(model)
+    request_config = dict(config)
+    request_config["http_options"] = {"timeout": int(timeout * 1000)}
+    if document is not None:
+        prompt, request_config = document.prepare(model, prompt, request_config)
+    with span("llm_attempt", model=model, attempt=attempt, prompt_chars=contents_size(prompt),
+              cached="cached_content" in request_config) as attempt_span:
+        try:
+            # The latency is measured from the moment the request gets its slot
+            with request_slot():
+                _check_superseded(stop, model)
+                tic = time.time()
+                response = get_client(api_key).models.generate_content(model=model, contents=prompt, config=request_config)
+            text = response.text
+            if text is None:
+                raise LLMError(f"Empty response from {model}")
+        except Superseded:
+            raise
+        except Exception as e:
+            health.record_failure()
+            if document is not None:
+                document.request_failed(model, e)
+            raise
+        health.record_success(time.time() - tic)
+        attempt_span.set(response_chars=len(text), **usage_attributes(response.usage_metadata))
+    return text
+
+def _request_with_retries(api_key : str, model : str, prompt, config : dict, timeout : float, retries : int, document=None, stop : threading.Event = None):
+    """
+    Sends a request to a model, retrying transient errors with backoff.
+    With `stop`, no further attempt is made once the event is set.
+
+    Returns:
+        str: The response text.
+    """
+    attempt = 0
+    while True:
+        try:
+            return _request(api_key, model, prompt, config, timeout, document, attempt, stop)
+        except Superseded:
+            raise
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e) or not get_health(model).available():
+                raise
+            delay = backoff_delay(attempt)
+            print(f"Request to {model} failed ({e}). Retrying in {delay:.1f} seconds...")
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+            _check_superseded(stop, model)
+            attempt += 1
+
+def _hedged_request(api_key : str, model : str, fallback : str, prompt, config : dict, timeout : float, retries : int, hedge_after : float, document=None):
+    """
+    Sends a request to a model and, if it hasn't answered after `hedge_after` seconds,
+    the same request to the fallback model. The first successful response wins; the other request
+    is cancelled if it hasn't started, and otherwise gives up before its next attempt.
+
+    Returns:
+        tuple: The response text and the model that produced it.
+    """
+    stop = threading.Event()
+    primary = _hedge_executor.submit(propagate(_request_with_retries), api_key, model, prompt, config, timeout, retries, document, stop)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        try:
+            return primary.result(), model
+        except Exception as e:
+            print(f"Error generating content with {model}: {e}. Trying {fallback}...")
+            return _request_with_retries(api_key, fallback, prompt, config, timeout, retries, document), fallback
+
+    print(f"{model} is slow, hedging with {fallback}...")
+    futures = {primary: model, _hedge_executor.submit(propagate(_request_with_retries), api_key, fallback, prompt, config, timeout, retries, document, stop): fallback}
+    error = None
+    try:
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                future_model = futures.pop(future)
+                try:
+                    return future.result(), future_model
+                except Exception as e:
+                    error = e
+    finally:
+        # The answer of the other request isn't needed anymore, it shouldn't hold a slot or spend quota
+        stop.set()
+        for future in futures:
+            future.cancel()
+    raise error
+
+def generate_content(api_key : str, prompt, config : dict = None, models : list = None,
+                     timeout : float = REQUEST_TIMEOUT, retries : int = MAX_RETRIES, hedge_after : float = None, document=None):
+    """
+    Generates content with the first model that answers.
+    Models in their cooldown window are skipped, unless no other model is left.
+
+    Args:
+        api_key (str): The Gemini API key.
+        prompt: The contents of the request.
+        config (dict): The generation config, e.g. response_mime_type and response_schema.
+        models (list): Models in order of preference. Defaults to GEMINI_MODELS.
+        timeout (float): Timeout per request in seconds.
+        retries (int): Retries per model for transient errors.
+        hedge_after (float): If set, send the request to the next model as well when
+            the current one hasn't answered after this many seconds.
+        document (DocumentSession): If given, the prompt is an instruction issued against this document.
+
+    Returns:
+        tuple: The response text and the name of the model that produced it.
+
+    Raises:
+        LLMError: If every model failed.
+    """
+    config = config or {}
+    models = models or GEMINI_MODELS
+    candidates = [model for model in models if get_health(model).available()] or list(models)
+
+    errors = []
+    i = 0
+    while i < len(candidates):
+        model = candidates[i]
+        try:
+            if hedge_after is not None and i + 1 < len(candidates):
+                text, used_model = _hedged_request(api_key, model, candidates[i + 1], prompt, config, timeout, retries, hedge_after, document)
+                return text, used_model
+            print(f"Trying {model}...")
+            return _request_with_retries(api_key, model, prompt, config, timeout, retries, document), model
+        except Exception as e:
+            print(f"Error generating content with {model}: {e}")
+            errors.append(f"{model}: {e}")
+        # A hedged request already tried the next model as well
+        i += 2 if hedge_after is not None and i + 1 < len(candidates) else 1
+    raise LLMError("Error generating content with all models. " + "; ".join(errors))
+
+def generate_content_stream(api_key : str, prompt, config : dict = None, models : list = None, timeout : float = REQUEST_TIMEOUT, document=None):
+    """
+    Streams content from the first model that starts answering.
+    A model that fails before sending anything is skipped in favour of the next one.
+    Streams are not retried or hedged: once text has been sent, a failure is raised to the caller.
+
+    Args:
+        api_key (str): The Gemini API key.
+        prompt: The contents of the request.
+        config (dict): The generation config, e.g. response_mime_type and response_schema.
+        models (list): Models in order of preference. Defaults to GEMINI_MODELS.
+        timeout (float): Timeout per request in seconds.
+        document (DocumentSession): If given, the prompt is an instruction issued against this document.
+
+    Yields:
+        str: The text chunks of the response.
+
+    Raises:
+        LLMError: If every model failed before sending anything.
+    """
+    request_config = dict(config or {})
+    request_config["http_options"] = {"timeout": int(timeout * 1000)}
+    models = models or GEMINI_MODELS
+    candidates = [model for model in models if get_health(model).available()] or list(models)
+
+    errors = []
+    for model in candidates:
+        health = get_health(model)
+        contents, model_config = prompt, request_config
+        if document is not None:
+            contents, model_config = document.prepare(model, prompt, request_config)
+        started = False
+        # The span is recorded by hand, a with block can't be suspended at each yield
+        stream_span = Span("llm_stream", {"model": model, "prompt_chars": contents_size(contents),
+                                          "cached": "cached_content" in model_config})
+        response_chars = 0
+        usage = None
+        tic = time.time()
+        try:
+            print(f"Streaming from {model}...")
+            # The stream holds its slot until it has been read, the latency is measured from the moment it gets it
+            with request_slot():
+                tic = time.time()
+                for chunk in get_client(api_key).models.generate_content_stream(model=model, contents=contents, config=model_config):
+                    usage = chunk.usage_metadata or usage
+                    if chunk.text:
+                        if not started:
+                            stream_span.set(first_chunk=time.time() - tic)
+                        started = True
+                        response_chars += len(chunk.text)
+                        yield chunk.text
+        except Exception as e:
+            health.record_failure()
+            stream_span.set(error=type(e).__name__, response_chars=response_chars)
+            record(stream_span, time.time() - tic, "error")
+            if document is not None:
+                document.request_failed(model, e)
+            if started:
+                raise
+            print(f"Error streaming content with {model}: {e}")
+            errors.append(f"{model}: {e}")
+            continue
+        health.record_success(time.time() - tic)
+        stream_span.set(response_chars=response_chars, **usage_attributes(usage))
+        record(stream_span, time.time() - tic)
+        return
+    raise LLMError("Error streaming content with all models. " + "; ".join(errors))
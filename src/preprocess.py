@@ -0,0 +1,271 @@
+"""
+preprocess.py
+
+Prepares the extracted paper text for the LLM prompts.
+The text extracted by pymupdf keeps the layout of the PDF: words hyphenated at line breaks, hard
+line wraps, ligature characters, running headers and footers, page numbers and the reference list.
+None of these help the analyses, they only cost tokens and confuse the model. The paper pane keeps
+showing the extracted text, so the prepared text comes with a compact offset map back to it.
+
+Features:
+- Dehyphenation of words split at line breaks, and joining of wrapped lines into paragraphs
+- Ligature fixes (e.g. "ﬁ" to "fi") and removal of soft hyphens
+- Detection of headers, footers and page numbers repeated across pages
+- Removal of the references section (an appendix after it is kept)
+- Offset map from the prepared text to the displayed text, one entry per edit
+"""
+
+import re
+from array import array
+from bisect import bisect_right
+import streamlit as st
+from src.extract_text import PARAGRAPH_SEPARATOR
+
+# Replacements of ligature characters and soft hyphens
+LIGATURES = {"ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl", "ﬅ": "st", "ﬆ": "st", "\u00ad": ""}
+# Line breaks within a paragraph, with the hyphen of a word split at the break
+LINE_BREAK = re.compile(r"(?P<hyphen>(?<=\w)[-\u00ad])?[ \t]*(?<!\n)\n(?!\n)[ \t]*|[" + "".join(LIGATURES) + "]")
+REFERENCES_HEADING = re.compile(r"\n\s*(?:\d+\.?\s*)?(references|bibliography|works cited)\s*\n", re.IGNORECASE)
+APPENDIX_HEADING = re.compile(r"\n\s*(?:[A-Z0-9]+\.?\s*)?(appendix|appendices|supplementary material)\b", re.IGNORECASE)
+PAGE_NUMBER = re.compile(r"(page\s*)?\d{1,4}(\s*(/|of)\s*\d{1,4})?", re.IGNORECASE)
+DIGITS = re.compile(r"\d+")
+
+# Number of paragraphs at the top and bottom of each page that can be a header or footer
+HEADER_PARAGRAPHS = 2
+# Paragraphs longer than this aren't headers or footers
+HEADER_MAX_LENGTH = 150
+# A header or footer is repeated on at least this many pages, and on at least this fraction of the pages
+HEADER_MIN_PAGES = 3
+HEADER_MIN_FRACTION = 0.5
+
+class PreparedText:
+    """
+    The text sent to the LLM, with a map back to the displayed text.
+    The map holds one segment per edit: within a segment, positions map one to one.
+
+    Attributes:
+        display (str): The extracted text, as shown in the paper pane.
+        text (str): The prepared text.
+        prepared_starts (array): Start of each segment in the prepared text.
+        display_starts (array): Start of each segment in the displayed text.
+        skipped (list): The edits that were not applied, because they overlap an earlier replacement
+            (edits within a deleted range are not skipped, they are deleted with it).
+    """
+
+    def __init__(self, display : str, edits : list):
+        """
+        Args:
+            display (str): The extracted text.
+            edits (list): Tuples (start, end, replacement) of the edits to the extracted text.
+                A deletion that overlaps an earlier edit removes the rest of its range,
+                other edits that overlap an earlier edit are skipped.
+        """
+        self.display = display
+        self.prepared_starts = array("I")
+        self.display_starts = array("I")
+        self.skipped = []
+        parts = []
+        length = 0
+        position = 0
+        deleted = False
+        for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], -edit[1])):
+            if start < position:
+                # Edits within a deleted range are deleted with it
+                if deleted and end <= position:
+                    continue
+                if replacement:
+                    self.skipped.append((start, end, replacement))
+                    continue
+                # Overlapping deletions are merged
+                start = position
+                if end <= start:
+                    continue
+            self._add_segment(length, position)
+            parts.append(display[position:start])
+            length += start - position
+            # A replacement longer than the text it replaces maps its extra characters to the last replaced one
+            for i in range(len(replacement)):
+                self._add_segment(length, start + min(i, end - start - 1))
+                length += 1
+            parts.append(replacement)
+            position = end
+            deleted = not replacement
+        self._add_segment(length, position)
+        parts.append(display[position:])
+        self.text = "".join(parts)
+
+    def _add_segment(self, prepared_start : int, display_start : int):
+        if self.prepared_starts:
+            last = len(self.prepared_starts) - 1
+            # Continues the previous segment
+            if self.display_starts[last] + prepared_start - self.prepared_starts[last] == display_start:
+                return
+            # The previous segment is empty
+            if self.prepared_starts[last] == prepared_start:
+                self.display_starts[last] = display_start
+                return
+        self.prepared_starts.append(prepared_start)
+        self.display_starts.append(display_start)
+
+    def to_display_position(self, position : int):
+        """
+        Maps a position of the prepared text to the displayed text.
+
+        Args:
+            position (int): The position in the prepared text.
+
+        Returns:
+            int: The position in the displayed text.
+        """
+        i = bisect_right(self.prepared_starts, position) - 1
+        return self.display_starts[i] + position - self.prepared_starts[i]
+
+    def to_display(self, start : int, end : int):
+        """
+        Maps a range of the prepared text to the displayed text.
+
+        Args:
+            start (int): Start in the prepared text (inclusive).
+            end (int): End in the prepared text (exclusive).
+
+        Returns:
+            tuple: (start, end) in the displayed text.
+        """
+        if end <= start:
+            position = self.to_display_position(start) if start < len(self.text) else len(self.display)
+            return position, position
+        return self.to_display_position(start), self.to_display_position(end - 1) + 1
+
+def _paragraphs(text : str, start : int, end : int):
+    """
+    Returns the (start, end) positions of the paragraphs of a page.
+    """
+    paragraphs = []
+    while start < end:
+        separator = text.find(PARAGRAPH_SEPARATOR, start, end)
+        if separator == -1:
+            separator = end
+        if separator > start:
+            paragraphs.append((start, separator))
+        start = separator + len(PARAGRAPH_SEPARATOR)
+    return paragraphs
+
+def find_headers(text : str, page_offsets : list):
+    """
+    Finds running headers, footers and page numbers: paragraphs at the top or bottom of a page
+    that repeat (up to their numbers) on many pages, and page numbers. A paragraph that is just a
+    number is only a page number if it is the first or last paragraph of its page, and the number
+    increases in step with the pages on at least two pages. A year on the title page or a table
+    cell at the bottom of a page is kept.
+
+    Args:
+        text (str): The extracted text.
+        page_offsets (list): The offset in the text where each page starts.
+
+    Returns:
+        list: Tuples (start, end) of the paragraphs.
+    """
+    page_ends = [offset - len(PARAGRAPH_SEPARATOR) for offset in page_offsets[1:]] + [len(text)]
+    candidates = []
+    pages_per_key = {}
+    # Page numbers by their difference to the page index, which is the same on all numbered pages
+    page_numbers = []
+    pages_per_shift = {}
+    for page_nr, (page_start, page_end) in enumerate(zip(page_offsets, page_ends)):
+        paragraphs = _paragraphs(text, page_start, page_end)
+        for start, end in paragraphs[:HEADER_PARAGRAPHS] + paragraphs[-HEADER_PARAGRAPHS:]:
+            if end - start > HEADER_MAX_LENGTH:
+                continue
+            number = PAGE_NUMBER.fullmatch(text[start:end].strip())
+            if number is not None:
+                if (start, end) in (paragraphs[0], paragraphs[-1]):
+                    shift = int(DIGITS.search(number.group()).group()) - page_nr
+                    page_numbers.append((start, end, shift))
+                    pages_per_shift.setdefault(shift, set()).add(page_nr)
+                continue
+            key = DIGITS.sub("#", " ".join(text[start:end].lower().split()))
+            candidates.append((start, end, key))
+            pages_per_key.setdefault(key, set()).add(page_nr)
+    min_pages = max(HEADER_MIN_PAGES, HEADER_MIN_FRACTION * len(page_offsets))
+    headers = set()
+    for start, end, key in candidates:
+        if len(pages_per_key[key]) >= min_pages:
+            headers.add((start, end))
+    for start, end, shift in page_numbers:
+        if len(pages_per_shift[shift]) > 1:
+            headers.add((start, end))
+    return sorted(headers)
+
+def find_references(text : str):
+    """
+    Finds the references section: from the last references heading up to an appendix or the end of the text.
+
+    Args:
+        text (str): The extracted text.
+
+    Returns:
+        tuple: (start, end) of the section, or None if there is no references heading.
+    """
+    headings = list(REFERENCES_HEADING.finditer(text))
+    if not headings:
+        return None
+    start = headings[-1].start()
+    appendix = APPENDIX_HEADING.search(text, headings[-1].end())
+    return start, appendix.start() if appendix is not None else len(text)
+
+def prepare_text(text : str, page_offsets : list = None):
+    """
+    Prepares the extracted text for the LLM prompts.
+
+    Args:
+        text (str): The extracted text.
+        page_offsets (list): The offset in the text where each page starts, used to find headers and footers.
+
+    Returns:
+        PreparedText: The prepared text with its offset map.
+    """
+    edits = []
+    headers = find_headers(text, page_offsets) if page_offsets else []
+    for start, end in headers:
+        # Remove the paragraph with its separator
+        if text.startswith(PARAGRAPH_SEPARATOR, end):
+            edits.append((start, end + len(PARAGRAPH_SEPARATOR), ""))
+        else:
+            edits.append((max(0, start - len(PARAGRAPH_SEPARATOR)), end, ""))
+    references = find_references(text)
+    if references is not None:
+        edits.append((*references, ""))
+
+    for match in LINE_BREAK.finditer(text):
+        if match.group() in LIGATURES:
+            edits.append((match.start(), match.end(), LIGATURES[match.group()]))
+        elif match.group("hyphen") is None:
+            edits.append((match.start(), match.end(), " "))
+        else:
+            # A split word is joined, a hyphenated compound (e.g. "state-of-the-\nart", "Monte-\nCarlo") keeps its hyphen
+            word_start = match.start()
+            while word_start > 0 and (text[word_start - 1].isalnum() or text[word_start - 1] == "-"):
+                word_start -= 1
+            compound = match.group("hyphen") == "-" and ("-" in text[word_start:match.start()] or not text[match.end():match.end() + 1].islower())
+            edits.append((match.start(), match.end(), "-" if compound else ""))
+
+    prepared = PreparedText(text, edits)
+    # Deletions are always applied, overlapping ones are merged, so only line break and ligature fixes can be skipped
+    print(f"Prepared text: {len(text)} to {len(prepared.text)} characters, {len(headers)} headers and footers removed, "
+          f"references {'removed' if references is not None else 'not found'}, {len(prepared.skipped)} overlapping fixes skipped, "
+          f"{len(prepared.prepared_starts)} map entries")
+    return prepared
+
+def get_prepared_text():
+    """
+    Returns the prepared paper text, built once per uploaded text.
+
+    Returns:
+        PreparedText: The prepared copy of st.session_state["text"].
+    """
+    text = st.session_state["text"]
+    prepared = st.session_state.get("prepared_text")
+    if prepared is None or prepared.display is not text:
+        prepared = prepare_text(text, st.session_state.get("page_offsets"))
+        st.session_state["prepared_text"] = prepared
+    return prepared
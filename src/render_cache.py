@@ -0,0 +1,87 @@
+"""
+render_cache.py
+
+Provides memoization of the paper highlights across Streamlit reruns.
+Every interaction reruns the feedback page, but the highlights only change when the
+paper, the selected feedback type or the arguments/corrections change. The cached highlight spans
+are rendered page by page, only for the pages shown in the paper pane (see display_text.py).
+
+Features:
+- Render cache keyed on (text hash, feedback type, version of the highlighted list)
+- Version counters bumped whenever arguments or corrections are updated
+- Hit rate and build time reporting, with a tracing span per build
+"""
+
+import hashlib
+import streamlit as st
+from src.tracing import span
+
+def bump_version(key : str):
+    """
+    Marks a session state list as updated, invalidating the highlights built from it.
+
+    Args:
+        key (str): The session state key that was updated, e.g. "arguments" or "corrections_llm".
+    """
+    version_key = f"{key}_version"
+    st.session_state[version_key] = st.session_state.get(version_key, 0) + 1
+
+def text_hash(text : str):
+    """
+    Returns a hash of the paper text, computed once per text.
+
+    Args:
+        text (str): The paper text.
+
+    Returns:
+        str: The hex SHA-1 digest of the text.
+    """
+    cached = st.session_state.get("text_hash")
+    if cached is not None and cached[0] is text:
+        return cached[1]
+    digest = hashlib.sha1(text.encode("utf8")).hexdigest()
+    st.session_state["text_hash"] = (text, digest)
+    return digest
+
+def render_cached(feedback_type : str, source_key : str, build):
+    """
+    Returns the highlights for a feedback type, building them only if the text or its source list changed.
+    Only the latest highlights per feedback type are kept.
+
+    Args:
+        feedback_type (str): The selected feedback type.
+        source_key (str): The session state key of the list the highlights are built from.
+        build: Function without arguments that builds the highlights, returning the spans and
+            the position of each highlighted item.
+
+    Returns:
+        tuple: The highlight spans and the item positions, as returned by build.
+    """
+    cache = st.session_state.setdefault("render_cache", {})
+    stats = st.session_state.setdefault("render_stats", {"hits": 0, "misses": 0, "build_time": 0.0})
+    key = (text_hash(st.session_state["text"]), feedback_type, st.session_state.get(f"{source_key}_version", 0))
+
+    entry = cache.get(feedback_type)
+    if entry is not None and entry[0] == key:
+        stats["hits"] += 1
+        return entry[1]
+
+    with span("highlight", feedback_type=feedback_type, text_chars=len(st.session_state["text"])) as highlight_span:
+        rendered = build()
+        highlight_span.set(spans=len(rendered[0]))
+    stats["misses"] += 1
+    stats["build_time"] += highlight_span.duration
+    cache[feedback_type] = (key, rendered)
+    print(f"Render cache hit rate {render_hit_rate():.0%}")
+    return rendered
+
+def render_hit_rate():
+    """
+    Returns the fraction of render lookups in this session that were served from the cache.
+
+    Returns:
+        float: The hit rate, 0 if nothing was rendered yet.
+    """
+    stats = st.session_state.get("render_stats", {"hits": 0, "misses": 0})
+    total = stats["hits"] + stats["misses"]
+    return stats["hits"] / total if total else 0.0
@@ -0,0 +1,121 @@
+"""
+render_spans.py
+
+Provides a single-pass HTML renderer for highlight spans in the paper text.
+Instead of rebuilding the whole string once per highlight, all spans are collected first,
+overlaps are resolved with a sweep line, and the HTML is emitted in one linear pass.
+
+Features:
+- Span list with start/end offsets and opening/closing markup
+- Sweep-line resolution of overlapping spans (contained spans nest, partial overlaps are split)
+- Linear rendering with a list-join builder
+- Rendering of a range of the text (e.g. one page), with the spans that cross its boundaries split
+"""
+
+import heapq
+from typing import NamedTuple
+
+class Span(NamedTuple):
+    """
+    A highlighted range of the text.
+
+    Attributes:
+        start (int): Start offset in the text (inclusive).
+        end (int): End offset in the text (exclusive).
+        open_tag (str): Markup inserted before the range.
+        close_tag (str): Markup inserted after the range.
+    """
+    start: int
+    end: int
+    open_tag: str
+    close_tag: str = "</span>"
+
+def resolve_spans(spans):
+    """
+    Resolves overlapping spans into a properly nested list.
+    Spans are swept in order of their start. A span that lies within an open span is nested in it.
+    A span that partially overlaps an open span is split: the overlapping part is nested,
+    the remainder is put back in the sweep and starts where the open span ends.
+
+    Args:
+        spans (iterable): Span objects. Empty spans are dropped.
+
+    Returns:
+        list: Properly nested spans, sorted by start and then by decreasing end.
+    """
+    # Heap ordered by start, then outer spans (larger end) first, then input order
+    heap = [(span.start, -span.end, i, span) for i, span in enumerate(spans) if span.start < span.end]
+    heapq.heapify(heap)
+    counter = len(heap)
+    resolved = []
+    open_ends = []  # Ends of the currently open spans, innermost last
+    while heap:
+        start, _, _, span = heapq.heappop(heap)
+        while open_ends and open_ends[-1] <= start:
+            open_ends.pop()
+        end = span.end
+        if open_ends and end > open_ends[-1]:
+            # Partial overlap with the innermost open span: nest the overlapping part
+            # and sweep the remainder again once that span has closed
+            inner_end = open_ends[-1]
+            remainder = span._replace(start=inner_end)
+            heapq.heappush(heap, (remainder.start, -remainder.end, counter, remainder))
+            counter += 1
+            end = inner_end
+        resolved.append(span._replace(end=end))
+        open_ends.append(end)
+    return resolved
+
+def render_spans(text : str, spans):
+    """
+    Renders the text with the given spans as HTML in a single pass.
+
+    Args:
+        text (str): The original text.
+        spans (iterable): Span objects with offsets into the text. Spans outside the text are clipped.
+
+    Returns:
+        str: The text with the markup of every span inserted.
+    """
+    length = len(text)
+    clipped = (span._replace(start=max(span.start, 0), end=min(span.end, length)) for span in spans)
+    parts = []
+    position = 0
+    open_spans = []  # (end, close_tag) of the open spans, innermost last
+    for span in resolve_spans(clipped):
+        while open_spans and open_spans[-1][0] <= span.start:
+            end, close_tag = open_spans.pop()
+            parts.append(text[position:end])
+            parts.append(close_tag)
+            position = end
+        parts.append(text[position:span.start])
+        parts.append(span.open_tag)
+        position = span.start
+        open_spans.append((span.end, span.close_tag))
+    while open_spans:
+        end, close_tag = open_spans.pop()
+        parts.append(text[position:end])
+        parts.append(close_tag)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+def render_range(text : str, spans, start : int, end : int):
+    """
+    Renders a range of the text with the spans that overlap it.
+    Spans that cross the boundaries of the range are closed at its end and reopened at its start,
+    so consecutive ranges show the same highlights as the whole text rendered at once.
+
+    Args:
+        text (str): The original text.
+        spans (list): Span objects with offsets into the whole text, preferably resolved (see resolve_spans),
+            so every range nests overlapping spans the same way.
+        start (int): Start of the range (inclusive).
+        end (int): End of the range (exclusive).
+
+    Returns:
+        str: The text of the range with the markup of the overlapping spans inserted.
+    """
+    clipped = [span._replace(start=max(span.start, start) - start, end=min(span.end, end) - start)
+               for span in spans if span.start < end and span.end > start]
+    return render_spans(text[start:end], clipped)
@@ -0,0 +1,185 @@
+"""
+retrieval.py
+
+Provides local retrieval over the user's paper draft for the feedback assistant.
+Instead of sending the full paper with every request, the paper is split into passages that are
+indexed once per upload, and each request only carries a short document summary plus the
+passages that are most relevant to it.
+
+Features:
+- Splits the prepared paper text (see preprocess.py) into paragraph-sized passages
+- BM25 ranking with an in-memory inverted index, built once per uploaded text
+- Short extractive document summary for the assistant's description
+- Builds request prompts with the top-k relevant passages
+"""
+
+import heapq
+import math
+import re
+from collections import Counter
+import streamlit as st
+from src.extract_text import PARAGRAPH_SEPARATOR
+from src.preprocess import get_prepared_text
+
+# Paragraphs are merged into passages of at least this many characters
+PASSAGE_SIZE = 600
+# Number of passages sent with each request
+TOP_K = 6
+# Maximum length in characters of the document summary
+SUMMARY_LENGTH = 1500
+# BM25 parameters: term frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN = re.compile(r"\w+")
+# Common words of chat questions that say nothing about which passage is meant
+STOPWORDS = frozenset("""a about an and are as at be by can could do does for from how i in is it me my
+    of on or paper please should tell that the this to what when where which who why with would you your""".split())
+
+SCOPED_PROMPT = """The following passages from the user's paper draft are the most relevant to this request:
+
+{passages}
+
+{request}"""
+
+def tokenize(text : str):
+    """
+    Splits a text into lowercase word tokens.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The tokens, without stopwords.
+    """
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+def split_passages(text : str, passage_size : int = PASSAGE_SIZE):
+    """
+    Splits a text into passages of whole paragraphs, merging short paragraphs with the next ones.
+
+    Args:
+        text (str): The paper draft text.
+        passage_size (int): Minimum length of a passage in characters.
+
+    Returns:
+        list: The passages, in document order.
+    """
+    passages = []
+    current = []
+    length = 0
+    for paragraph in text.split(PARAGRAPH_SEPARATOR):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        current.append(paragraph)
+        length += len(paragraph)
+        if length >= passage_size:
+            passages.append(PARAGRAPH_SEPARATOR.join(current))
+            current = []
+            length = 0
+    if current:
+        passages.append(PARAGRAPH_SEPARATOR.join(current))
+    return passages
+
+def document_summary(passages : list, max_length : int = SUMMARY_LENGTH):
+    """
+    Builds a short extractive summary of the document: its opening (title and abstract
+    in most papers), cut at a sentence boundary.
+
+    Args:
+        passages (list): The passages of the document.
+        max_length (int): Maximum length of the summary in characters.
+
+    Returns:
+        str: The summary.
+    """
+    opening = PARAGRAPH_SEPARATOR.join(passages)[:max_length]
+    if len(opening) == max_length:
+        end = opening.rfind(". ")
+        if end > max_length // 2:
+            opening = opening[:end + 1]
+        opening += " [...]"
+    return opening
+
+class PassageIndex:
+    """
+    BM25 index over the passages of one paper draft.
+
+    Attributes:
+        text (str): The indexed text.
+        passages (list): The passages, in document order.
+        summary (str): A short summary of the document.
+    """
+
+    def __init__(self, text : str, passage_size : int = PASSAGE_SIZE):
+        self.text = text
+        self.passages = split_passages(text, passage_size)
+        self.summary = document_summary(self.passages)
+        # Inverted index: term -> list of (passage id, term frequency)
+        self._postings = {}
+        self._lengths = []
+        for passage_id, passage in enumerate(self.passages):
+            tokens = tokenize(passage)
+            self._lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self._postings.setdefault(term, []).append((passage_id, frequency))
+        self._average_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        count = len(self.passages)
+        self._idf = {term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                     for term, postings in self._postings.items()}
+
+    def search(self, query : str, k : int = TOP_K):
+        """
+        Returns the passages most relevant to a query.
+
+        Args:
+            query (str): The query.
+            k (int): The maximum number of passages.
+
+        Returns:
+            list: Tuples of (passage id, score), best first. Passages without matching terms are left out.
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            idf = self._idf[term]
+            for passage_id, frequency in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[passage_id] / self._average_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def scoped_prompt(self, request : str, query : str = None, k : int = TOP_K):
+        """
+        Builds a request that carries the passages most relevant to it.
+        The passages are given in document order.
+
+        Args:
+            request (str): The request for the assistant.
+            query (str): The text to retrieve passages for. Defaults to the request.
+            k (int): The maximum number of passages.
+
+        Returns:
+            str: The request with the relevant passages, or the request alone if no passage matches.
+        """
+        hits = sorted(passage_id for passage_id, _ in self.search(query or request, k))
+        if not hits:
+            return request
+        passages = PARAGRAPH_SEPARATOR.join(f"[Passage {passage_id + 1}] {self.passages[passage_id]}" for passage_id in hits)
+        return SCOPED_PROMPT.format(passages=passages, request=request)
+
+def get_passage_index():
+    """
+    Returns the passage index of the uploaded text, built once per upload.
+
+    Returns:
+        PassageIndex: The index of the prepared text of st.session_state["text"].
+    """
+    text = get_prepared_text().text
+    index = st.session_state.get("passage_index")
+    if index is None or index.text is not text:
+        index = PassageIndex(text)
+        st.session_state["passage_index"] = index
+    return index
@@ -0,0 +1,198 @@
+"""
+spelling.py
+
+Provides a local spelling pre-pass for the corrections, so the LLM only has to find grammar and
+style errors. Words are checked against a symmetric-delete (SymSpell) index of an English frequency
+dictionary, plus a domain word list learned from the paper itself: technical terms that occur
+repeatedly in the paper are accepted, and misspellings of them are corrected to them.
+The corrections carry exact offsets into the text.
+
+Uses the symspellpy package and its bundled dictionary. Without it, spelling is left to the LLM.
+
+Features:
+- Exact-offset spelling corrections (Correction dicts with type "spelling") in milliseconds per paper
+- Domain words learned from the paper (repeated words that aren't in the dictionary)
+- Skips names, acronyms, contractions, words with digits, URLs, hyphenated line breaks and the references
+- Dictionary index loaded once per process, can be warmed up in the background
+"""
+
+import re
+import threading
+from collections import Counter
+
+try:
+    from symspellpy import SymSpell, Verbosity
+except ImportError:
+    SymSpell = None
+
+# Maximum edit distance of a suggestion, and for short words
+MAX_EDIT_DISTANCE = 2
+SHORT_WORD_EDIT_DISTANCE = 1
+# Words up to this length only get suggestions within SHORT_WORD_EDIT_DISTANCE
+SHORT_WORD_LENGTH = 5
+# Words shorter than this are not checked, there are too many valid short words
+MIN_WORD_LENGTH = 4
+# Prefix length of the symmetric-delete index
+PREFIX_LENGTH = 7
+# Words not in the dictionary that occur at least this often in the paper are domain words
+DOMAIN_MIN_COUNT = 2
+# Characters of context before and after the error
+CONTEXT_CHARS = 20
+
+DICTIONARY_FILE = "frequency_dictionary_en_82_765.txt"
+# Apostrophes within a word belong to it, so contractions aren't split into misspelled halves
+WORD = re.compile(r"[A-Za-z]+(?:['’][A-Za-z]+)*")
+APOSTROPHES = "'’"
+POSSESSIVE_SUFFIXES = ("'s", "’s")
+REFERENCES_HEADING = re.compile(r"\n\s*(references|bibliography|works cited)\s*\n", re.IGNORECASE)
+# A word next to one of these characters is part of a URL, an identifier or a hyphenated word
+JOINERS = "-/@_\\"
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+_warm_up_started = False
+
+def spelling_available():
+    """
+    Returns whether the local spelling engine can be used.
+
+    Returns:
+        bool: True if symspellpy is installed.
+    """
+    return SymSpell is not None
+
+def get_dictionary():
+    """
+    Returns the symmetric-delete index of the English dictionary, loading it on first use.
+    Loading takes a few seconds, the index is shared by all sessions of the process.
+
+    Returns:
+        SymSpell: The index.
+    """
+    global _dictionary
+    with _dictionary_lock:
+        if _dictionary is None:
+            from importlib.resources import files
+            dictionary = SymSpell(max_dictionary_edit_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH)
+            dictionary.load_dictionary(str(files("symspellpy") / DICTIONARY_FILE), term_index=0, count_index=1)
+            _dictionary = dictionary
+        return _dictionary
+
+def warm_up():
+    """
+    Loads the dictionary index on a daemon thread, once per process, so the first spelling check doesn't wait for it.
+    """
+    global _warm_up_started
+    if not spelling_available() or _warm_up_started:
+        return
+    _warm_up_started = True
+    threading.Thread(target=get_dictionary, name="spelling-warm-up", daemon=True).start()
+
+def _checked_form(word : str):
+    """
+    Returns the part of a word that is spell-checked: contractions (e.g. "wasn't") are skipped,
+    possessives are checked without their "'s".
+
+    Returns:
+        str: The word to check, or None.
+    """
+    apostrophes = sum(word.count(apostrophe) for apostrophe in APOSTROPHES)
+    if not apostrophes:
+        return word
+    if apostrophes == 1 and word.endswith(POSSESSIVE_SUFFIXES):
+        return word[:-2]
+    return None
+
+def _is_checked(text : str, word : str, start : int, stop : int):
+    """
+    Returns whether a word at a position should be spell-checked.
+    """
+    # Acronyms and CamelCase identifiers
+    if not word[1:].islower():
+        return False
+    before = text[start - 1:start]
+    after = text[stop:stop + 2]
+    if before and (before in JOINERS or before == "." or before.isdigit()):
+        return False
+    if after and (after[0] in JOINERS or after[0].isdigit() or (after[0] == "." and after[1:].isalpha())):
+        return False
+    previous = text[max(0, start - CONTEXT_CHARS):start].rstrip()[-1:]
+    # Second half of a word hyphenated at a line break
+    if previous == "-":
+        return False
+    # Capitalized words in the middle of a sentence are names
+    if word[0].isupper() and previous not in ("", ".", "!", "?"):
+        return False
+    return True
+
+def _context(text : str, start : int, stop : int):
+    """
+    Returns a few words around an error.
+    """
+    context_start = text.rfind(" ", 0, max(0, start - CONTEXT_CHARS)) + 1
+    context_end = text.find(" ", stop + CONTEXT_CHARS)
+    if context_end == -1:
+        context_end = len(text)
+    return text[context_start:context_end].replace("\n", " ")
+
+def check_spelling(text : str):
+    """
+    Finds spelling mistakes in a text.
+    Words that aren't in the dictionary but occur at least DOMAIN_MIN_COUNT times are treated as
+    domain terms. Unknown words without a close suggestion are left alone.
+
+    Args:
+        text (str): The paper draft text.
+
+    Returns:
+        list: Corrections as dicts (see Correction) with type "spelling" and exact offsets, sorted by offset.
+    """
+    dictionary = get_dictionary()
+    references = REFERENCES_HEADING.search(text)
+    end = references.start() if references is not None else len(text)
+    # Contractions and possessives are resolved once per distinct word, not per occurrence
+    forms = {}
+    counts = Counter()
+    for word, count in Counter(WORD.findall(text, 0, end)).items():
+        form = forms[word] = _checked_form(word)
+        if form is not None:
+            counts[form.lower()] += count
+    unknown = {word for word in counts if len(word) >= MIN_WORD_LENGTH and word not in dictionary.words}
+    domain_words = {word for word in unknown if counts[word] >= DOMAIN_MIN_COUNT}
+
+    # Misspellings of domain terms are corrected to them, so the domain words get their own small index
+    domain = SymSpell(max_dictionary_edit_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH)
+    for word in domain_words:
+        domain.create_dictionary_entry(word, counts[word])
+
+    suggestions = {}
+    for word in unknown - domain_words:
+        distance = SHORT_WORD_EDIT_DISTANCE if len(word) <= SHORT_WORD_LENGTH else MAX_EDIT_DISTANCE
+        candidates = domain.lookup(word, Verbosity.TOP, distance) + dictionary.lookup(word, Verbosity.TOP, distance)
+        if candidates:
+            suggestions[word] = min(candidates, key=lambda candidate: (candidate.distance, -candidate.count)).term
+
+    # Only the occurrences of misspelled words are checked for names, URLs and hyphenation
+    misspelled = {word: form for word, form in forms.items() if form is not None and form.lower() in suggestions}
+    corrections = []
+    for match in WORD.finditer(text, 0, end):
+        word = misspelled.get(match.group())
+        if word is None:
+            continue
+        start = match.start()
+        stop = start + len(word)
+        if not _is_checked(text, word, start, stop):
+            continue
+        suggestion = suggestions[word.lower()]
+        if word[0].isupper():
+            suggestion = suggestion[0].upper() + suggestion[1:]
+        corrections.append({
+            "error": word,
+            "context": _context(text, start, stop),
+            "suggestion": suggestion,
+            "offset": start,
+            "length": len(word),
+            "type": "spelling",
+        })
+    print(f"Spelling: {len(corrections)} mistakes, {len(domain_words)} domain words learned")
+    return corrections
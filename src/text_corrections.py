@@ -7,14 +7,29 @@ identify errors and generate suggestions.
 
 Features:
 - Extracts corrections from paper drafts using LLMs
+- Spelling mistakes are found locally with exact offsets, the LLM only looks for grammar and style
+- Corrects long drafts in concurrent, paragraph-aligned windows
+- Short drafts and windows are corrected with their text inline, they are below the provider's minimum cache size
 - Highlights arguments and corrections in the paper text
+- Stored corrections are validated once into a compact CorrectionStore (see correction_store.py)
 """
 
-import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import html
 from pydantic import BaseModel
+from src.cache import ANALYSIS_CACHE, schema_of
+from src.llm_client import GEMINI_MODELS
+from src.json_parsing import generate_items, stream_items
+from src.document_session import get_document_session
+from src.render_spans import Span, render_spans
+from src.text_index import NormalizedText, locate_corrections
+from src.render_cache import bump_version
+from src.correction_store import CorrectionStore
+from src.spelling import check_spelling, spelling_available
+from src.preprocess import get_prepared_text
+from src.tracing import propagate, span
 
 class Correction(BaseModel):
     """
@@ -35,69 +50,287 @@ class Correction(BaseModel):
     length: int
     type: str
 
-def get_corrections_llm():
-    """
-    Uses Google Gemini LLM to extract corrections from the user's paper draft.
-    Stores the results in Streamlit session state as a list of corrections.
-    """
-    import google.genai
-    text = st.session_state["text"]
-    prompt = f"""You are a language correction system. Given a text, identify each error (spelling, grammar, style, ...).
+# Texts longer than this many characters are corrected in windows
+CHUNK_THRESHOLD = 12000
+# Window size and overlap in characters for chunked corrections
+WINDOW_SIZE = 8000
+WINDOW_OVERLAP = 600
+# Maximum number of windows corrected at the same time
+MAX_CORRECTION_WORKERS = 4
+
+# Spelling is checked locally (see spelling.py), so the LLM only looks for grammar and style errors.
+# Line breaks, hyphenation and the references are removed from the text beforehand (see preprocess.py)
+CORRECTIONS_PROMPT = """You are a language correction system. Given the text of the user's paper draft, identify each grammar and style error.
+                 Don't include spelling mistakes, they are found separately.
+                 Don't include errors that are part of the citation or references.
+                 Each error should include the following details:
+                 - error: The exact error in the text.
+                 - context: Few words before and after the text containing the error.
+                 - suggestion: The most likely suggestion	for the error.
+                 - offset: The starting position of the error in the text, counted in characters from the start of the text.
+                 - length: The length of the error in the text.
+                 - type: The type of error (grammar or style)."""
+
+# Used instead when the local spelling engine isn't installed
+ALL_CORRECTIONS_PROMPT = """You are a language correction system. Given the text of the user's paper draft, identify each error (spelling, grammar, style, ...).
                  Don't include errors that are part of the citation or references.
-                 Ignore errors pertaining to symbols used like \\n, hyphens to split words between lines, ....
                  Each error should include the following details:
                  - error: The exact error in the text.
                  - context: Few words before and after the text containing the error.
                  - suggestion: The most likely suggestion	for the error.
                  - offset: The starting position of the error in the text, counted in characters from the start of the text.
                  - length: The length of the error in the text.
-                 - type: The type of error (spelling, grammar, style, ...).
-                 
-                 Here's the text: {text}"""
- 
-    client = google.genai.Client(api_key=str(st.secrets["GEMINI_API_KEY"]))
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Correction],
-            }
-        )
-        corrections = response.text
-    except:
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-lite", 
-                contents=prompt,
-                config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Correction],
-            }
-            )
-            corrections = response.text
-        except:
-            try:
-                response = client.models.generate_content(
-                    model="gemini-1.5-flash", 
-                    contents=prompt,
-                    config={
-                'response_mime_type': 'application/json',
-                'response_schema': list[Correction],
-            }
-                )
-                corrections = response.text
-            except:
-                print("Error generating content with all three models.")
-                return
-    if corrections.startswith("```json") and corrections.endswith("```"):
-        corrections = corrections[7:-3].strip()
-    try:
-        st.session_state["corrections_llm"] = json.loads(corrections) 
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-        get_corrections_llm()  # Retry if something fails 
+                 - type: The type of error (spelling, grammar, style, ...)."""
+
+def get_corrections_llm():
+    """
+    Uses Google Gemini LLM to extract corrections from the user's paper draft.
+    Stores the results in Streamlit session state as a CorrectionStore.
+    """
+    corrections = find_corrections(get_prepared_text().text, str(st.secrets["GEMINI_API_KEY"]))
+    if corrections is None:
+        return
+    st.session_state["corrections_llm"] = CorrectionStore.from_items(corrections)
+    bump_version("corrections_llm")
+
+def find_corrections(text : str, api_key : str, use_cache : bool = True, chunked : bool = None, on_item=None, spelling : bool = True):
+    """
+    Finds the corrections in a paper draft. Spelling mistakes are found locally, with exact offsets
+    (see spelling.py), grammar and style errors by Google Gemini LLM.
+    Without the local spelling engine, the LLM looks for spelling mistakes as well.
+    Does not touch Streamlit session state, so it can run outside the script thread.
+
+    Args:
+        text (str): The paper draft text.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        chunked (bool): If True, correct the text in windows (see find_corrections_chunked).
+            Defaults to chunking texts longer than CHUNK_THRESHOLD characters.
+        on_item: If given, responses are streamed and this callback is called with each
+            correction as soon as it has been generated. In chunked mode it is called from the
+            window threads, with offsets relative to the window.
+        spelling (bool): If False, skip the local spelling pass.
+
+    Returns:
+        list: The corrections as dicts, or None if all models failed.
+    """
+    if not (spelling and spelling_available()):
+        return find_llm_corrections(text, api_key, use_cache, chunked, on_item)
+    with span("spelling", chars=len(text)) as spelling_span:
+        spelling_corrections = check_spelling(text)
+        spelling_span.set(corrections=len(spelling_corrections))
+    if on_item is not None:
+        for correction in spelling_corrections:
+            on_item(correction)
+    corrections = find_llm_corrections(text, api_key, use_cache, chunked, on_item)
+    if corrections is None:
+        return None
+    # The LLM may still report spelling mistakes, the local ones have exact offsets
+    corrections = [correction for correction in corrections if correction["type"] != "spelling"]
+    return sorted(spelling_corrections + corrections, key=lambda x: x["offset"])
+
+def find_llm_corrections(text : str, api_key : str, use_cache : bool = True, chunked : bool = None, on_item=None):
+    """
+    Uses Google Gemini LLM to extract corrections from a paper draft.
+    Only grammar and style errors are requested if spelling is checked locally.
+
+    Args:
+        text (str): The paper draft text.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        chunked (bool): If True, correct the text in windows, see find_corrections.
+        on_item: Optional callback for streamed corrections, see find_corrections.
+
+    Returns:
+        list: The corrections as dicts, or None if all models failed.
+    """
+    if chunked is None:
+        chunked = len(text) > CHUNK_THRESHOLD
+    if chunked:
+        return find_corrections_chunked(text, api_key, use_cache, on_item=on_item)
+
+    prompt = CORRECTIONS_PROMPT if spelling_available() else ALL_CORRECTIONS_PROMPT
+    cache_key = ANALYSIS_CACHE.key(text, prompt, GEMINI_MODELS, schema_of(Correction))
+    cached = ANALYSIS_CACHE.get(cache_key, bypass=not use_cache)
+    if cached is not None:
+        print("Using cached corrections")
+        return cached
+
+    # The prompt carries only the instructions, the text is added by the document session. Unchunked texts
+    # and windows are shorter than MIN_CACHE_CHARS, so it is always sent inline and the session isn't registered
+    document = get_document_session(api_key, text)
+    describe = lambda correction: f'{correction["error"]} ({correction["context"]})'
+    if on_item is not None:
+        corrections, complete = stream_items(api_key, prompt, Correction, describe, on_item, document=document)
+    else:
+        corrections, complete = generate_items(api_key, prompt, Correction, describe, document=document)
+    if corrections is None:
+        return None
+    # Only complete lists are cached, an incomplete one is tried again on the next upload
+    if complete:
+        ANALYSIS_CACHE.set(cache_key, corrections, bypass=not use_cache)
+    return corrections
+
+def paragraph_spans(text : str):
+    """
+    Returns the position of each paragraph in a text. Paragraphs are separated by blank lines.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: Tuples (start, end) per paragraph, in document order.
+    """
+    paragraphs = []
+    start = 0
+    for separator in re.finditer(r"\n\s*\n", text):
+        paragraphs.append((start, separator.start()))
+        start = separator.end()
+    paragraphs.append((start, len(text)))
+    return paragraphs
+
+def split_windows(text : str, window_size : int = WINDOW_SIZE, overlap : int = WINDOW_OVERLAP):
+    """
+    Splits a text into paragraph-aligned windows.
+    Consecutive windows share the trailing paragraphs of the previous window (up to `overlap`
+    characters), so errors at a window boundary are seen with their context at least once.
+
+    Args:
+        text (str): The text to split.
+        window_size (int): Maximum window size in characters. Paragraphs longer than this get a window of their own.
+        overlap (int): Maximum number of characters repeated from the previous window.
+
+    Returns:
+        list: Tuples (base_offset, window_text), where base_offset is the position of the window in the text.
+    """
+    paragraphs = paragraph_spans(text)
+    windows = []
+    first = 0
+    while first < len(paragraphs):
+        last = first
+        while last + 1 < len(paragraphs) and paragraphs[last + 1][1] - paragraphs[first][0] <= window_size:
+            last += 1
+        base = paragraphs[first][0]
+        windows.append((base, text[base:paragraphs[last][1]]))
+        if last + 1 == len(paragraphs):
+            break
+        # Start the next window with the trailing paragraphs that fit in the overlap
+        next_first = last + 1
+        while next_first - 1 > first and paragraphs[last][1] - paragraphs[next_first - 1][0] <= overlap:
+            next_first -= 1
+        first = next_first
+    return windows
+
+def locate_correction(window : str, correction : dict):
+    """
+    Finds the position of a correction in the window it was generated for.
+    The offset counted by the model is only used to pick between multiple occurrences.
+
+    Args:
+        window (str): The window text.
+        correction (dict): The correction with error, context and offset.
+
+    Returns:
+        int: The position of the error in the window, or -1 if it can't be found.
+    """
+    error = correction["error"]
+    if not error:
+        return -1
+    context = correction.get("context") or ""
+    context_start = window.find(context) if context else -1
+    if context_start != -1:
+        error_incontext = context.find(error)
+        if error_incontext != -1:
+            return context_start + error_incontext
+    # Pick the occurrence of the error closest to the offset the model counted
+    best = -1
+    position = window.find(error)
+    while position != -1:
+        if best == -1 or abs(position - correction["offset"]) < abs(best - correction["offset"]):
+            best = position
+        position = window.find(error, position + 1)
+    return best
+
+def merge_window_corrections(window_results : list):
+    """
+    Merges corrections of overlapping windows into document coordinates.
+
+    Args:
+        window_results (list): Tuples (base_offset, window_text, corrections) per window.
+
+    Returns:
+        list: The corrections with offsets relative to the full text, sorted by offset and without duplicates.
+    """
+    merged = {}
+    for base, window, corrections in window_results:
+        for correction in corrections:
+            position = locate_correction(window, correction)
+            if position == -1:
+                print(f"Failed to locate correction in window: {correction}")
+                continue
+            correction = dict(correction)
+            correction["offset"] = base + position
+            correction["length"] = len(correction["error"])
+            # Windows overlap, so the same error can be reported twice
+            merged.setdefault((correction["offset"], correction["error"]), correction)
+    return sorted(merged.values(), key=lambda x: x["offset"])
+
+def find_corrections_chunked(text : str, api_key : str, use_cache : bool = True, max_workers : int = MAX_CORRECTION_WORKERS, on_item=None):
+    """
+    Extracts corrections from a long text by correcting paragraph-aligned windows concurrently
+    and merging the results back into document coordinates.
+
+    Args:
+        text (str): The paper draft text.
+        api_key (str): The Gemini API key.
+        use_cache (bool): If False, bypass the analysis cache.
+        max_workers (int): Maximum number of windows corrected at the same time.
+        on_item: Optional callback for streamed corrections, see find_corrections.
+
+    Returns:
+        list: The corrections as dicts, or None if every window failed.
+    """
+    windows = split_windows(text)
+    print(f"Correcting {len(windows)} windows of the text...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(propagate(find_llm_corrections), window, api_key, use_cache, False, on_item) for _, window in windows]
+        results = [future.result() for future in futures]
+
+    window_results = [(base, window, corrections) for (base, window), corrections in zip(windows, results) if corrections is not None]
+    if not window_results:
+        return None
+    return merge_window_corrections(window_results)
+
+# Underline color per correction type
+CORRECTION_COLORS = {
+    "spelling": "red",
+    "grammar": "blue",
+    "style": "green",
+}
+
+def argument_spans(text, corrections):
+    """
+    Builds the highlight spans of argument sections in the text.
+
+    Args:
+        text (str): The original text.
+        corrections (CorrectionStore): The located arguments, with offset and length.
+
+    Returns:
+        list: The Span objects.
+    """
+    spans = []
+    for start, length in zip(corrections.offsets, corrections.lengths):
+        end = start + length
+        # Highlight each paragraph of the argument separately, so no span crosses a blank line
+        paragraph_start = start
+        paragraph_end = text.find("\n\n", paragraph_start, end)
+        while paragraph_end != -1:
+            spans.append(Span(paragraph_start, paragraph_end, '<span class="argumentintext">'))
+            paragraph_start = paragraph_end + 2
+            paragraph_end = text.find("\n\n", paragraph_start, end)
+        spans.append(Span(paragraph_start, end, '<span class="argumentintext">'))
+    return spans
 
 def highlight_text_arguments(text, corrections):
     """
@@ -105,99 +338,60 @@ def highlight_text_arguments(text, corrections):
 
     Args:
         text (str): The original text.
-        corrections (list): List of corrections (dicts) with offset and length.
-    """
-    highlighted_text = text
-    for correction in sorted(corrections, key=lambda x: x["offset"], reverse=True):
-        start = correction["offset"]
-        end = start + correction["length"]
-        error_text = text[start:end]
-        # If there are double newlines, split and wrap each line separately
-        if "\n\n" in error_text:
-            lines = error_text.split("\n\n")
-            updated_text = ""
-            for line in lines:
-                if lines.index(line) != len(lines) - 1:
-                    updated_text += f'<span class="argumentintext">{line}</span>\n\n'
-                else:
-                    updated_text += f'<span class="argumentintext">{line}</span>'
-            highlighted_text = (
-                highlighted_text[:start] +
-                updated_text +
-                highlighted_text[end:]
-            )
-        else:
-            highlighted_text = (
-                highlighted_text[:start] +
-                f'<span class="argumentintext">{error_text}</span>' +
-                highlighted_text[end:]
-            )
-        
-    return highlighted_text
-
-def highlight_text_corrections(text, corrections):
+        corrections (list): List of corrections (dicts) with offset and length, or a CorrectionStore.
+
+    Returns:
+        str: The text with arguments highlighted.
+    """
+    return render_spans(text, argument_spans(text, CorrectionStore.from_items(corrections)))
+
+def locate_highlights(corrections, normalized):
+    """
+    Finds the corrections that can be highlighted in the text.
+
+    Args:
+        corrections (CorrectionStore): The corrections.
+        normalized (NormalizedText): The normalized copy of the text.
+
+    Returns:
+        list: Tuples (index, start, end) with the index of the correction in the store, see locate_corrections.
+    """
+    indices = [i for i in corrections.of_type(*CORRECTION_COLORS) if "\n" not in corrections.errors[i]]
+    items = [corrections.item(i) for i in indices]
+    index_of = {id(item): i for item, i in zip(items, indices)}
+    return [(index_of[id(item)], start, end) for item, start, end in locate_corrections(normalized, items)]
+
+def correction_spans(corrections, located):
+    """
+    Builds the highlight spans of located corrections, colored underlines for the different error types.
+
+    Args:
+        corrections (CorrectionStore): The corrections.
+        located (list): Tuples (index, start, end), see locate_highlights.
+
+    Returns:
+        list: The Span objects.
+    """
+    spans = []
+    for i, start, end in located:
+        suggestion = html.escape(corrections.suggestions[i])
+        color = CORRECTION_COLORS[corrections.type_of(i)]
+        spans.append(Span(start, end, f'<span style="border-bottom: 3px solid {color};" title="Suggestion: {suggestion}">'))
+    return spans
+
+def highlight_text_corrections(text, corrections, normalized=None):
     """
     Highlights corrections in the text using colored underlines for different error types.
 
     Args:
         text (str): The original text.
-        corrections (list): List of corrections (dicts) with offset, length, type, and suggestion.
+        corrections (list): List of corrections (dicts) with offset, length, type, and suggestion, or a CorrectionStore.
+        normalized (NormalizedText): Optional normalized copy of the text, built if not given.
 
     Returns:
         str: The text with corrections highlighted.
     """
-    highlighted_text = text
-    normalized_text = highlighted_text.replace("\n", " ")
-    normalized_text = normalized_text.replace("’", "'")
-    
-    for correction in sorted(corrections, key=lambda x: x["offset"], reverse=True):
-        normalized_context = correction["context"].replace("\n", " ")
-
-        error = correction["error"]
-        if normalized_text.count(error) == 1:
-            start = normalized_text.find(error)
-            end = start + correction["length"]
-        else:
-            context_start = normalized_text.find(normalized_context)
-            error_incontext = normalized_context.find(correction["error"])
-        
-            if context_start == -1 or error_incontext == -1:
-                print(f"Failed to process correction: {correction}")
-                continue
-            else:
-                calculated_offset = context_start + error_incontext
-                start = calculated_offset
-                end = start + correction["length"]
-        
-        if start < 0 or end > len(highlighted_text):
-            print(f"Skipping invalid correction: {correction}")
-            continue
-        
-        if correction["suggestion"] is not None:
-            suggestion = html.escape(correction["suggestion"])
-        else:
-            suggestion = ""
-            
-        if "\n" in correction["error"]:
-            continue
-        
-        # Highlight based on error type
-        if correction["type"] == "spelling":
-            highlighted_text = (
-                highlighted_text[:start] +
-                f'<span style="border-bottom: 3px solid red;" title="Suggestion: {suggestion}">{highlighted_text[start:end]}</span>' +
-                highlighted_text[end:]
-            )
-        elif correction["type"] == "grammar":
-            highlighted_text = (
-                highlighted_text[:start] +
-                f'<span style="border-bottom: 3px solid blue;" title="Suggestion: {suggestion}">{highlighted_text[start:end]}</span>' +
-                highlighted_text[end:]
-            )
-        elif correction["type"] == "style":
-            highlighted_text = (
-                highlighted_text[:start] +
-                f'<span style="border-bottom: 3px solid green;" title="Suggestion: {suggestion}">{highlighted_text[start:end]}</span>' +
-                highlighted_text[end:]
-            )
-    return highlighted_text
+    if normalized is None:
+        normalized = NormalizedText(text)
+    corrections = CorrectionStore.from_items(corrections)
+    return render_spans(text, correction_spans(corrections, locate_highlights(corrections, normalized)))
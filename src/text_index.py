@@ -0,0 +1,328 @@
+"""
+text_index.py
+
+Provides the normalization layer and multi-pattern index used to anchor LLM output in the paper text.
+The LLM returns errors, contexts and arguments as strings, so their positions have to be found
+in the text. All strings are matched in a single Aho-Corasick pass over a normalized copy of the
+text, and positions are mapped back to the original text through a compact offset array.
+
+Features:
+- Whitespace and quote normalization with a normalized-to-original offset map
+- Positions in a prepared text are mapped on to the displayed text
+- Aho-Corasick index matching all patterns in one pass
+- Anchoring of corrections and arguments, with a bounded fuzzy fallback for near matches
+"""
+
+import difflib
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+
+# Characters replaced during normalization
+QUOTE_TRANSLATION = str.maketrans({"’": "'", "‘": "'", "“": '"', "”": '"'})
+WHITESPACE = re.compile(r"\s+")
+
+# Number of occurrences stored per pattern, the total count is always kept
+MAX_OCCURRENCES = 32
+# Size of the shingles used for the fuzzy fallback
+SHINGLE_SIZE = 24
+# Length of the prefix used to anchor arguments that don't match in full
+PREFIX_SIZE = 50
+# Minimum similarity for a fuzzy match to be accepted
+FUZZY_THRESHOLD = 0.8
+
+def normalize(text : str):
+    """
+    Normalizes a pattern the same way normalize_text normalizes the paper text.
+
+    Args:
+        text (str): The pattern.
+
+    Returns:
+        str: The pattern with quotes unified and whitespace runs collapsed to single spaces.
+    """
+    return WHITESPACE.sub(" ", text.translate(QUOTE_TRANSLATION)).strip()
+
+class NormalizedText:
+    """
+    A normalized copy of a text with a map back to the original positions.
+
+    Attributes:
+        original (str): The original text.
+        text (str): The normalized text. Whitespace runs are collapsed to a single space and quotes are unified.
+        positions (array): For each position in the normalized text, the position in the original text.
+        prepared (PreparedText): If the original text is a prepared text (see preprocess.py), positions
+            are mapped on to the displayed text through its offset map.
+    """
+
+    def __init__(self, original : str, prepared=None):
+        self.original = original
+        self.prepared = prepared
+        parts = []
+        positions = array("I")
+        translated = original.translate(QUOTE_TRANSLATION)
+        position = 0
+        for match in WHITESPACE.finditer(translated):
+            parts.append(translated[position:match.start()])
+            positions.extend(range(position, match.start()))
+            parts.append(" ")
+            positions.append(match.start())
+            position = match.end()
+        parts.append(translated[position:])
+        positions.extend(range(position, len(translated)))
+        self.text = "".join(parts)
+        self.positions = positions
+
+    def to_normalized(self, position : int):
+        """
+        Maps a position in the original text, e.g. an offset counted by the model, to the normalized text.
+
+        Args:
+            position (int): Position in the original text, or in the prepared text for a prepared text.
+
+        Returns:
+            int: The first position in the normalized text at or after it.
+        """
+        return bisect_left(self.positions, position)
+
+    def to_original(self, start : int, end : int):
+        """
+        Maps a range of the normalized text to the original text.
+
+        Args:
+            start (int): Start in the normalized text (inclusive).
+            end (int): End in the normalized text (exclusive).
+
+        Returns:
+            tuple: (start, end) in the original text, or in the displayed text for a prepared text.
+        """
+        if end <= start:
+            position = self.positions[start] if start < len(self.positions) else len(self.original)
+            start, end = position, position
+        else:
+            start, end = self.positions[start], self.positions[end - 1] + 1
+        if self.prepared is not None:
+            return self.prepared.to_display(start, end)
+        return start, end
+
+class PatternIndex:
+    """
+    Aho-Corasick automaton that finds all occurrences of many patterns in a single pass.
+    Identical patterns are stored once.
+
+    Attributes:
+        patterns (list): The distinct patterns, indexed by pattern id.
+    """
+
+    def __init__(self):
+        self.patterns = []
+        self._ids = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._built = False
+
+    def add(self, pattern : str):
+        """
+        Adds a pattern to the index.
+
+        Args:
+            pattern (str): The pattern to find. Empty patterns never match.
+
+        Returns:
+            int: The id of the pattern.
+        """
+        if pattern in self._ids:
+            return self._ids[pattern]
+        pattern_id = len(self.patterns)
+        self.patterns.append(pattern)
+        self._ids[pattern] = pattern_id
+        if not pattern:
+            return pattern_id
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append(pattern_id)
+        self._built = False
+        return pattern_id
+
+    def _build(self):
+        """
+        Computes the failure links with a breadth-first traversal of the trie.
+        """
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail_child = self._goto[fail].get(char, 0)
+                self._fail[child] = fail_child if fail_child != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+        self._built = True
+
+    def search(self, text : str):
+        """
+        Finds the occurrences of all patterns in the text.
+
+        Args:
+            text (str): The text to search.
+
+        Returns:
+            tuple: A list with the number of occurrences per pattern id,
+                and a list with the start positions (at most MAX_OCCURRENCES) per pattern id.
+        """
+        if not self._built:
+            self._build()
+        counts = [0] * len(self.patterns)
+        occurrences = [[] for _ in self.patterns]
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_id in out[node]:
+                counts[pattern_id] += 1
+                if len(occurrences[pattern_id]) < MAX_OCCURRENCES:
+                    occurrences[pattern_id].append(position - len(patterns[pattern_id]) + 1)
+        return counts, occurrences
+
+def _shingles(pattern : str):
+    """
+    Returns (offset, shingle) pairs at the start, middle and end of a pattern.
+    """
+    if len(pattern) <= SHINGLE_SIZE:
+        return []
+    middle = (len(pattern) - SHINGLE_SIZE) // 2
+    return [(offset, pattern[offset:offset + SHINGLE_SIZE]) for offset in (0, middle, len(pattern) - SHINGLE_SIZE)]
+
+def _fuzzy_start(normalized : NormalizedText, pattern : str, shingle_ids, occurrences):
+    """
+    Bounded fuzzy fallback: every shingle occurrence votes for the start it implies,
+    and the best candidate is accepted if it is similar enough to the pattern.
+    The similarity check only looks at a window of the pattern's length.
+
+    Returns:
+        int: The start of the match in the normalized text, or -1.
+    """
+    votes = Counter()
+    for offset, shingle_id in shingle_ids:
+        for position in occurrences[shingle_id]:
+            votes[max(position - offset, 0)] += 1
+    for start, _ in votes.most_common(3):
+        candidate = normalized.text[start:start + len(pattern)]
+        matcher = difflib.SequenceMatcher(None, pattern, candidate, autojunk=False)
+        if matcher.quick_ratio() >= FUZZY_THRESHOLD and matcher.ratio() >= FUZZY_THRESHOLD:
+            return start
+    return -1
+
+def _nearest(text : str, pattern : str, expected : int):
+    """
+    Finds the occurrence of a pattern closest to an expected position, searching from it in both directions.
+
+    Returns:
+        int: The start of the occurrence, or -1.
+    """
+    after = text.find(pattern, expected)
+    before = text.rfind(pattern, 0, expected + len(pattern) - 1)
+    if before == -1 or (after != -1 and after - expected < expected - before):
+        return after
+    return before
+
+def locate_corrections(normalized : NormalizedText, corrections : list):
+    """
+    Finds the position of each correction in the text.
+    A correction whose error occurs once is anchored on the error, otherwise on its context.
+    Repeated contexts and errors are resolved to the occurrence closest to the offset counted by the model.
+
+    Args:
+        normalized (NormalizedText): The normalized paper text.
+        corrections (list): Corrections (dicts) with error, context and offset.
+
+    Returns:
+        list: Tuples (correction, start, end) with positions in the original text, for the corrections that were found.
+    """
+    index = PatternIndex()
+    items = []
+    for correction in corrections:
+        error = normalize(correction["error"])
+        context = normalize(correction.get("context") or "")
+        items.append((correction, error, context, index.add(error), index.add(context),
+                      [(offset, index.add(shingle)) for offset, shingle in _shingles(context)]))
+    counts, occurrences = index.search(normalized.text)
+
+    located = []
+    for correction, error, context, error_id, context_id, shingle_ids in items:
+        if not error:
+            continue
+        start = -1
+        # The model counts the offset in the text it was given, only the normalized copy is searched
+        expected = normalized.to_normalized(correction.get("offset", 0))
+        if counts[error_id] == 1:
+            start = occurrences[error_id][0]
+        elif counts[context_id] == 1 and error in context:
+            start = occurrences[context_id][0] + context.find(error)
+        elif counts[context_id] > 1 and error in context:
+            start = _nearest(normalized.text, context, max(expected - context.find(error), 0)) + context.find(error)
+        elif counts[error_id] > 1:
+            start = _nearest(normalized.text, error, expected)
+        elif shingle_ids:
+            context_start = _fuzzy_start(normalized, context, shingle_ids, occurrences)
+            if context_start != -1:
+                start = normalized.text.find(error, context_start, context_start + len(context) + len(error))
+        if start == -1:
+            print(f"Failed to process correction: {correction}")
+            continue
+        located.append((correction, *normalized.to_original(start, start + len(error))))
+    return located
+
+def locate_arguments(normalized : NormalizedText, contexts : list):
+    """
+    Finds the position of each argument in the text.
+    Arguments are matched in full, then on their first PREFIX_SIZE characters,
+    then with the bounded fuzzy fallback.
+
+    Args:
+        normalized (NormalizedText): The normalized paper text.
+        contexts (list): The argument texts.
+
+    Returns:
+        list: Tuples (argument index, start, end) with positions in the original text, for the arguments that were found.
+    """
+    index = PatternIndex()
+    items = []
+    for context in contexts:
+        pattern = normalize(context)
+        items.append((pattern, index.add(pattern), index.add(pattern[:PREFIX_SIZE]),
+                      [(offset, index.add(shingle)) for offset, shingle in _shingles(pattern)]))
+    counts, occurrences = index.search(normalized.text)
+
+    located = []
+    for i, (pattern, pattern_id, prefix_id, shingle_ids) in enumerate(items):
+        if not pattern:
+            continue
+        if counts[pattern_id] > 0:
+            start = occurrences[pattern_id][0]
+        elif counts[prefix_id] > 0:
+            start = occurrences[prefix_id][0]
+        else:
+            start = _fuzzy_start(normalized, pattern, shingle_ids, occurrences)
+        if start == -1:
+            print(f"Could not find argument: {contexts[i]}")
+            continue
+        end = min(start + len(pattern), len(normalized.text))
+        located.append((i, *normalized.to_original(start, end)))
+    return located
@@ -0,0 +1,380 @@
+"""
+tracing.py
+
+Provides structured tracing and metrics for the feedback pipeline, replacing ad-hoc tic/toc prints.
+Every pipeline stage and every LLM attempt is recorded as a span carrying the Streamlit session ID.
+Spans are appended to a JSONL file and aggregated into per-stage metrics that are served in the
+Prometheus text format.
+
+Features:
+- Nested spans with attributes (model, attempt, prompt/response sizes, token counts, ...)
+- Session ID and parent span propagated to worker threads
+- JSONL span log with size-based rotation (PAPERHELP_TRACE_FILE, "off" to disable), written by a background thread
+- Per-stage count, sum, errors and p50/p95 latency over a sliding window
+- Token counters per model
+- Prometheus metrics endpoint on localhost (PAPERHELP_METRICS_HOST, PAPERHELP_METRICS_PORT, "off" to disable)
+"""
+
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# File the spans are appended to, and its size in bytes after which it is rotated
+TRACE_FILE = os.environ.get("PAPERHELP_TRACE_FILE", os.path.join("logs", "traces.jsonl"))
+TRACE_MAX_BYTES = 50 * 1024 * 1024
+# Interface and port of the Prometheus metrics endpoint. It only listens on localhost unless configured otherwise,
+# the metrics aren't meant to be public on a hosted deployment
+METRICS_HOST = os.environ.get("PAPERHELP_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.environ.get("PAPERHELP_METRICS_PORT", "9464")
+# Number of durations kept per stage for the latency quantiles
+METRICS_WINDOW = 1000
+# Quantiles reported per stage
+QUANTILES = (0.5, 0.95)
+# Span attributes that are counted as tokens per model
+TOKEN_ATTRIBUTES = ("prompt_tokens", "response_tokens", "cached_tokens")
+
+_session_id = contextvars.ContextVar("session_id", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+class Span:
+    """
+    A timed pipeline stage.
+
+    Attributes:
+        name (str): The stage name, e.g. "pdf_extraction" or "llm_attempt".
+        span_id (str): Unique ID of the span.
+        parent_id (str): ID of the enclosing span, or None.
+        session_id (str): The Streamlit session the span belongs to, or None.
+        attributes (dict): Extra information about the stage.
+        duration (float): The duration in seconds, set when the span is recorded.
+    """
+
+    def __init__(self, name : str, attributes : dict):
+        parent = _current_span.get()
+        self.name = name
+        self.span_id = f"{os.getpid()}-{next(_span_ids)}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.session_id = current_session_id()
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+
+    def set(self, **attributes):
+        """
+        Adds attributes to the span.
+        """
+        self.attributes.update(attributes)
+
+    def to_dict(self, duration : float, status : str):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "session_id": self.session_id,
+            "start": self.start,
+            "duration": duration,
+            "status": status,
+            "attributes": self.attributes,
+        }
+
+class StageMetrics:
+    """
+    Aggregated metrics of one stage.
+
+    Attributes:
+        count (int): Number of spans.
+        total (float): Sum of the durations in seconds.
+        errors (int): Number of failed spans.
+        durations (deque): Durations of the most recent spans.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.durations = deque(maxlen=METRICS_WINDOW)
+
+    def quantile(self, fraction : float):
+        durations = sorted(self.durations)
+        if not durations:
+            return float("nan")
+        return durations[min(int(fraction * len(durations)), len(durations) - 1)]
+
+_lock = threading.Lock()
+_stages = {}
+_tokens = {}
+_metrics_server = None
+# Spans waiting to be written to the trace file, and the thread writing them
+_trace_queue = queue.Queue()
+_trace_writer = None
+
+def current_session_id():
+    """
+    Returns the ID of the Streamlit session the current code runs for.
+
+    Returns:
+        str: The session ID, or None outside a Streamlit session.
+    """
+    session_id = _session_id.get()
+    if session_id is not None:
+        return session_id
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except ImportError:
+        return None
+    return ctx.session_id if ctx is not None else None
+
+def set_session_id(session_id : str = None):
+    """
+    Sets the session ID for spans recorded in the current context, e.g. by the batch CLI.
+
+    Args:
+        session_id (str): The session ID. Defaults to a new random ID.
+
+    Returns:
+        str: The session ID.
+    """
+    session_id = session_id or uuid.uuid4().hex
+    _session_id.set(session_id)
+    return session_id
+
+def propagate(fn):
+    """
+    Wraps a function so it records its spans under the current session and span when it runs
+    on another thread, e.g. when it is submitted to a thread pool.
+
+    Args:
+        fn: The function.
+
+    Returns:
+        The wrapped function.
+    """
+    session_id = current_session_id()
+    parent = _current_span.get()
+    def run(*args, **kwargs):
+        session_token = _session_id.set(session_id)
+        span_token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(span_token)
+            _session_id.reset(session_token)
+    return run
+
+@contextmanager
+def span(name : str, **attributes):
+    """
+    Records the enclosed code as a span. Errors are recorded and re-raised.
+
+    Args:
+        name (str): The stage name.
+        **attributes: Attributes of the span, more can be added with Span.set.
+
+    Yields:
+        Span: The span.
+    """
+    current = Span(name, attributes)
+    token = _current_span.set(current)
+    status = "ok"
+    try:
+        yield current
+    except Exception as e:
+        status = "error"
+        current.set(error=type(e).__name__)
+        raise
+    except BaseException:
+        # Streamlit reruns and stops interrupt the script, they aren't failures of the stage
+        status = "interrupted"
+        raise
+    finally:
+        _current_span.reset(token)
+        record(current, time.time() - current.start, status)
+
+def record(current : Span, duration : float, status : str = "ok"):
+    """
+    Records a finished span: adds it to the metrics and queues it for the trace file.
+    Used directly for spans that can't be a with block, e.g. around a generator.
+
+    Args:
+        current (Span): The span.
+        duration (float): The duration in seconds.
+        status (str): "ok", "error" or "interrupted".
+    """
+    current.duration = duration
+    entry = current.to_dict(duration, status)
+    with _lock:
+        stage = _stages.get(current.name)
+        if stage is None:
+            stage = StageMetrics()
+            _stages[current.name] = stage
+        stage.count += 1
+        stage.total += duration
+        stage.durations.append(duration)
+        if status == "error":
+            stage.errors += 1
+        model = current.attributes.get("model")
+        if model is not None:
+            for attribute in TOKEN_ATTRIBUTES:
+                tokens = current.attributes.get(attribute)
+                if tokens:
+                    _tokens[(model, attribute)] = _tokens.get((model, attribute), 0) + tokens
+    _enqueue(entry)
+
+def _enqueue(entry : dict):
+    """
+    Queues a span for the trace file. The file is written by a writer thread, started on first use,
+    so recording a span never waits for disk I/O.
+    """
+    global _trace_writer
+    if TRACE_FILE.lower() == "off":
+        return
+    _trace_queue.put(entry)
+    if _trace_writer is None:
+        with _lock:
+            if _trace_writer is None:
+                _trace_writer = threading.Thread(target=_write_traces, name="trace-writer", daemon=True)
+                _trace_writer.start()
+
+def _write_traces():
+    """
+    Writes the queued spans to the trace file, all spans queued at the time in one go. Runs on the writer thread.
+    """
+    while True:
+        entries = [_trace_queue.get()]
+        while True:
+            try:
+                entries.append(_trace_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write(entries)
+        finally:
+            for _ in entries:
+                _trace_queue.task_done()
+
+def _write(entries : list):
+    """
+    Appends spans to the trace file, rotating it when it gets too large.
+    """
+    try:
+        directory = os.path.dirname(TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > TRACE_MAX_BYTES:
+            os.replace(TRACE_FILE, TRACE_FILE + ".1")
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, default=str) + "\n" for entry in entries))
+    except OSError as e:
+        print(f"Could not write trace: {e}")
+
+def flush_traces():
+    """
+    Waits until the queued spans are written to the trace file, e.g. before a process exits.
+    Registered to run at exit; worker processes that exit without running exit handlers call it themselves.
+    """
+    if _trace_writer is not None and _trace_writer.is_alive():
+        _trace_queue.join()
+
+def _reset_trace_writer():
+    """
+    Gives a forked child process its own queue, the writer thread of the parent doesn't run in it.
+    """
+    global _trace_queue, _trace_writer
+    _trace_queue = queue.Queue()
+    _trace_writer = None
+
+atexit.register(flush_traces)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_trace_writer)
+
+def stage_stats():
+    """
+    Returns the aggregated metrics of every stage.
+
+    Returns:
+        dict: Count, errors, mean, p50 and p95 duration per stage name.
+    """
+    with _lock:
+        return {name: {
+            "count": stage.count,
+            "errors": stage.errors,
+            "mean": stage.total / stage.count if stage.count else None,
+            "p50": stage.quantile(0.5),
+            "p95": stage.quantile(0.95),
+        } for name, stage in _stages.items()}
+
+def prometheus_metrics():
+    """
+    Renders the metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics.
+    """
+    lines = [
+        "# HELP paperhelp_stage_duration_seconds Duration of pipeline stages.",
+        "# TYPE paperhelp_stage_duration_seconds summary",
+    ]
+    with _lock:
+        for name, stage in sorted(_stages.items()):
+            for fraction in QUANTILES:
+                lines.append(f'paperhelp_stage_duration_seconds{{stage="{name}",quantile="{fraction}"}} {stage.quantile(fraction)}')
+            lines.append(f'paperhelp_stage_duration_seconds_sum{{stage="{name}"}} {stage.total}')
+            lines.append(f'paperhelp_stage_duration_seconds_count{{stage="{name}"}} {stage.count}')
+        lines.append("# HELP paperhelp_stage_errors_total Failed pipeline stages.")
+        lines.append("# TYPE paperhelp_stage_errors_total counter")
+        for name, stage in sorted(_stages.items()):
+            lines.append(f'paperhelp_stage_errors_total{{stage="{name}"}} {stage.errors}')
+        lines.append("# HELP paperhelp_llm_tokens_total Tokens used per model.")
+        lines.append("# TYPE paperhelp_llm_tokens_total counter")
+        for (model, kind), tokens in sorted(_tokens.items()):
+            lines.append(f'paperhelp_llm_tokens_total{{model="{model}",kind="{kind.removesuffix("_tokens")}"}} {tokens}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port : str = METRICS_PORT, host : str = METRICS_HOST):
+    """
+    Starts the Prometheus metrics endpoint (/metrics) on a daemon thread, once per process.
+
+    Args:
+        port (str): The port, or "off" to disable the endpoint.
+        host (str): The interface to listen on, e.g. "0.0.0.0" for all interfaces.
+    """
+    global _metrics_server
+    if str(port).lower() == "off":
+        return
+    with _lock:
+        if _metrics_server is not None:
+            return
+        try:
+            _metrics_server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        except OSError as e:
+            print(f"Could not start the metrics endpoint on {host}:{port}: {e}")
+            _metrics_server = False
+            return
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
@@ -0,0 +1,251 @@
+"""
+upload_store.py
+
+Provides a content-addressed store for uploaded PDFs.
+Uploads are stored once per content hash, sessions hold references to the blobs they use, and a
+background sweeper removes blobs that no live session references once they are older than the TTL
+or the store exceeds its disk quota. The extracted text is stored next to each blob, so a repeat
+upload of the same PDF skips text extraction entirely.
+
+Layout of a blob directory (STORE_DIR/<sha256>/):
+- document.pdf: the uploaded bytes
+- text.json: the extracted text and page offsets
+- refs/<session id>: one empty file per session using the blob, its modification time is the last use
+
+Features:
+- Deduplicated, atomically written blobs keyed by SHA-256
+- Per-session references, so sessions never delete each other's files
+- TTL and disk quota eviction by a background sweeper thread (least recently used first)
+- Stored extracted text per blob
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Directory of the store
+STORE_DIR = os.path.join("uploads", "store")
+# References and unreferenced blobs older than this many seconds are removed
+UPLOAD_TTL = 24 * 3600
+# Maximum total size of the store in bytes
+UPLOAD_QUOTA = 500 * 1024 * 1024
+# Seconds between two sweeps
+SWEEP_INTERVAL = 600
+
+DOCUMENT_FILE = "document.pdf"
+TEXT_FILE = "text.json"
+REFS_DIR = "refs"
+
+class UploadStore:
+    """
+    Content-addressed store of uploaded PDFs with per-session references.
+
+    Attributes:
+        directory (str): Directory of the store.
+        ttl (float): Maximum age in seconds of a reference, and of an unreferenced blob.
+        quota (int): Maximum total size of the store in bytes.
+    """
+
+    def __init__(self, directory : str = STORE_DIR, ttl : float = UPLOAD_TTL, quota : int = UPLOAD_QUOTA):
+        self.directory = directory
+        self.ttl = ttl
+        self.quota = quota
+        self._lock = threading.Lock()
+        self._sweeper = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest : str, *parts):
+        return os.path.join(self.directory, digest, *parts)
+
+    def put(self, data : bytes, session_id : str):
+        """
+        Stores an upload, unless the same content is already stored, and references it for a session.
+
+        Args:
+            data (bytes): The PDF bytes.
+            session_id (str): The session that uploaded the file.
+
+        Returns:
+            str: The content hash of the upload.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            os.makedirs(self._path(digest, REFS_DIR), exist_ok=True)
+            if not os.path.exists(self._path(digest, DOCUMENT_FILE)):
+                self._write(self._path(digest, DOCUMENT_FILE), data)
+            self._touch(digest, session_id)
+        return digest
+
+    def release(self, digest : str, session_id : str):
+        """
+        Removes the reference of a session to an upload. The blob is left for the sweeper.
+
+        Args:
+            digest (str): The content hash of the upload.
+            session_id (str): The session.
+        """
+        try:
+            os.remove(self._path(digest, REFS_DIR, session_id))
+        except FileNotFoundError:
+            pass
+
+    def document_path(self, digest : str):
+        """
+        Returns the path of a stored PDF.
+
+        Args:
+            digest (str): The content hash of the upload.
+
+        Returns:
+            str: The path.
+        """
+        return self._path(digest, DOCUMENT_FILE)
+
+    def get_text(self, digest : str):
+        """
+        Returns the text extracted from an upload earlier.
+
+        Args:
+            digest (str): The content hash of the upload.
+
+        Returns:
+            tuple: The text and the page offsets, or None if no text was stored.
+        """
+        try:
+            with open(self._path(digest, TEXT_FILE), encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return stored["text"], stored["page_offsets"]
+
+    def set_text(self, digest : str, text : str, page_offsets : list):
+        """
+        Stores the text extracted from an upload.
+
+        Args:
+            digest (str): The content hash of the upload.
+            text (str): The extracted text.
+            page_offsets (list): The start offset of each page in the text.
+        """
+        data = json.dumps({"text": text, "page_offsets": page_offsets}).encode("utf-8")
+        with self._lock:
+            if os.path.isdir(self._path(digest)):
+                self._write(self._path(digest, TEXT_FILE), data)
+
+    def _write(self, path : str, data : bytes):
+        """
+        Writes a file atomically, so a concurrent reader never sees a partial file.
+        """
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    def _touch(self, digest : str, session_id : str):
+        with open(self._path(digest, REFS_DIR, session_id), "a"):
+            pass
+        os.utime(self._path(digest, REFS_DIR, session_id))
+
+    def _blob_info(self, digest : str, now : float):
+        """
+        Removes expired references of a blob and returns its size, last use and number of live references.
+        """
+        size = 0
+        last_use = 0.0
+        for name in (DOCUMENT_FILE, TEXT_FILE):
+            try:
+                stat = os.stat(self._path(digest, name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            last_use = max(last_use, stat.st_mtime)
+        live = 0
+        refs = self._path(digest, REFS_DIR)
+        for session_id in os.listdir(refs) if os.path.isdir(refs) else []:
+            try:
+                used = os.stat(os.path.join(refs, session_id)).st_mtime
+            except FileNotFoundError:
+                continue
+            if now - used > self.ttl:
+                self.release(digest, session_id)
+            else:
+                live += 1
+                last_use = max(last_use, used)
+        return size, last_use, live
+
+    def sweep(self):
+        """
+        Removes expired references, then unreferenced blobs older than the TTL, then the least
+        recently used unreferenced blobs until the store fits in its quota.
+        Blobs referenced by a live session are never removed.
+
+        Returns:
+            int: The number of removed blobs.
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            blobs = []
+            for digest in os.listdir(self.directory):
+                if not os.path.isdir(self._path(digest)):
+                    continue
+                size, last_use, live = self._blob_info(digest, now)
+                if live == 0 and now - last_use > self.ttl:
+                    shutil.rmtree(self._path(digest), ignore_errors=True)
+                    removed += 1
+                else:
+                    blobs.append((last_use, digest, size, live))
+            total = sum(size for _, _, size, _ in blobs)
+            for last_use, digest, size, live in sorted(blobs):
+                if total <= self.quota:
+                    break
+                if live:
+                    continue
+                shutil.rmtree(self._path(digest), ignore_errors=True)
+                total -= size
+                removed += 1
+        if removed:
+            print(f"Upload store: removed {removed} blobs, {total / 1e6:.1f} MB in use")
+        return removed
+
+    def start_sweeper(self, interval : float = SWEEP_INTERVAL):
+        """
+        Starts sweeping the store on a daemon thread, once per store.
+
+        Args:
+            interval (float): Seconds between two sweeps.
+        """
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, args=(interval,), name="upload-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_forever(self, interval : float):
+        while True:
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"Upload store sweep failed: {e}")
+            time.sleep(interval)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_upload_store():
+    """
+    Returns the upload store shared by all sessions, starting its sweeper on first use.
+
+    Returns:
+        UploadStore: The store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UploadStore()
+            _store.start_sweeper()
+        return _store
@@ -0,0 +1,10 @@
+"""
+conftest.py
+
+Keeps the tests from writing to the trace log and from starting the metrics endpoint.
+"""
+
+import os
+
+os.environ.setdefault("PAPERHELP_TRACE_FILE", "off")
+os.environ.setdefault("PAPERHELP_METRICS_PORT", "off")
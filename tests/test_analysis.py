@@ -0,0 +1,47 @@
+"""
+test_analysis.py
+
+Tests for the release of a session's analysis jobs when a revised draft is uploaded.
+"""
+
+import threading
+import pytest
+from streamlit.testing.v1 import AppTest
+from src import analysis
+from src.jobs import CANCELLED, JobQueue
+
+def _archive_script():
+    from src.analysis import archive_analysis
+    archive_analysis()
+
+@pytest.fixture
+def queue(monkeypatch):
+    """
+    Replaces the analysis queue with a single worker that is busy until the test ends.
+    """
+    queue = JobQueue("analysis-test", 1)
+    monkeypatch.setattr(analysis, "ANALYSIS_JOBS", queue)
+    busy = threading.Event()
+    queue.submit(("busy",), lambda job: busy.wait() or "done")
+    yield queue
+    busy.set()
+
+def test_revision_cancels_queued_analysis(queue):
+    job = queue.submit(("arguments", "old draft"), lambda job: ["argument"])
+    app = AppTest.from_function(_archive_script)
+    app.session_state["analysis_jobs"] = {"arguments": job.job_id}
+    app.run()
+    assert not app.exception
+    assert "analysis_jobs" not in app.session_state
+    assert job.cancelled()
+    assert job.status == CANCELLED
+
+def test_revision_keeps_analysis_another_session_waits_for(queue):
+    job = queue.submit(("arguments", "old draft"), lambda job: ["argument"])
+    assert queue.submit(("arguments", "old draft"), lambda job: ["argument"]) is job
+    app = AppTest.from_function(_archive_script)
+    app.session_state["analysis_jobs"] = {"arguments": job.job_id}
+    app.run()
+    assert not job.cancelled()
+    job.release()
+    assert job.cancelled()
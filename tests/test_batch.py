@@ -0,0 +1,29 @@
+"""
+test_batch.py
+
+Tests for the naming of the batch results of PDFs with similar names.
+"""
+
+import os
+import pytest
+from src.batch import pending_documents, result_path
+
+def _write(path : str, data : bytes = b"%PDF-1.4"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+def test_pdfs_in_subfolders_get_their_own_results(tmp_path):
+    folder = str(tmp_path / "submissions")
+    for name in ("a.pdf", os.path.join("cohort", "a.pdf"), "notes.txt"):
+        _write(os.path.join(folder, name))
+    pending, done = pending_documents(folder, str(tmp_path / "results"))
+    assert (pending, done) == (["a.pdf", os.path.join("cohort", "a.pdf")], 0)
+    assert len({result_path("results", name) for name in pending}) == 2
+
+def test_pdfs_sharing_a_result_are_rejected(tmp_path):
+    folder = str(tmp_path / "submissions")
+    _write(os.path.join(folder, "a.pdf"))
+    _write(os.path.join(folder, "A.PDF"))
+    with pytest.raises(ValueError, match="share a result file"):
+        pending_documents(folder, str(tmp_path / "results"))
@@ -0,0 +1,58 @@
+"""
+test_correction_store.py
+
+Tests for the validation, queries and serialization of the CorrectionStore.
+"""
+
+import pickle
+import pytest
+from src.correction_store import CorrectionStore
+
+ITEMS = [
+    {"error": "recieved", "context": "was recieved late", "suggestion": "received", "offset": 40, "length": 8, "type": "spelling"},
+    {"error": "results is", "context": "the results is", "suggestion": "results are", "offset": 4, "length": 10, "type": "Grammar"},
+    {"error": "very unique", "context": "a very unique idea", "suggestion": None, "offset": None, "type": "style"},
+    {"error": "naïve “quote”", "context": "", "suggestion": "naive", "offset": 20, "length": 0, "type": "wording"},
+    {"error": "", "context": "no error", "suggestion": "x", "offset": 1, "type": "grammar"},
+    {"context": "missing error", "offset": 2, "type": "grammar"},
+]
+
+def test_items_are_validated_and_sorted():
+    store = CorrectionStore.from_items(ITEMS)
+    assert len(store) == 4
+    assert [item["offset"] for item in store] == [-1, 4, 20, 40]
+    assert store[0] == {"error": "very unique", "context": "a very unique idea", "suggestion": "", "offset": -1, "length": 11, "type": "style"}
+    assert store[1]["type"] == "grammar"
+    assert store[2]["type"] == "other" and store[2]["length"] == len("naïve “quote”")
+    assert store[-1]["error"] == "recieved"
+    with pytest.raises(IndexError):
+        store[4]
+
+def test_from_items_keeps_a_store():
+    store = CorrectionStore.from_items(ITEMS)
+    assert CorrectionStore.from_items(store) is store
+
+def test_of_type_and_overlapping():
+    store = CorrectionStore.from_items(ITEMS)
+    assert store.of_type("grammar") == [1]
+    assert store.of_type("spelling", "style") == [0, 3]
+    assert store.of_type("argument") == []
+    assert store.overlapping(0, 5) == [1]
+    assert store.overlapping(13, 21) == [1, 2]
+    assert store.overlapping(14, 20) == []
+    assert store.overlapping(47, 100) == [3]
+
+def test_bytes_round_trip():
+    store = CorrectionStore.from_items(ITEMS)
+    restored = CorrectionStore.from_bytes(store.to_bytes())
+    assert restored == store
+    assert restored.to_items() == store.to_items()
+    assert CorrectionStore.from_bytes(CorrectionStore.from_items([]).to_bytes()).to_items() == []
+    with pytest.raises(ValueError):
+        CorrectionStore.from_bytes(b"JSON" + store.to_bytes()[4:])
+
+def test_pickle_round_trip():
+    store = CorrectionStore.from_items(ITEMS)
+    restored = pickle.loads(pickle.dumps(store))
+    assert restored == store
+    assert restored.of_type("grammar") == store.of_type("grammar")
@@ -0,0 +1,24 @@
+"""
+test_document_session.py
+
+Tests for the registry of document sessions.
+"""
+
+from src.document_session import MAX_SESSIONS, MIN_CACHE_CHARS, get_document_session
+from src.text_corrections import CHUNK_THRESHOLD, split_windows
+
+def _paper(length : int):
+    paragraph = "The method is evaluated on every benchmark and compared with the baseline. "
+    return "\n\n".join([paragraph * 5] * (length // (len(paragraph) * 5) + 1))
+
+def test_corrections_are_below_the_cache_minimum():
+    assert CHUNK_THRESHOLD < MIN_CACHE_CHARS
+    assert all(len(window) < MIN_CACHE_CHARS for _, window in split_windows(_paper(200000)))
+
+def test_windows_do_not_evict_the_paper_session():
+    paper = _paper(200000)
+    session = get_document_session("key", paper, local=True)
+    for i in range(MAX_SESSIONS + 5):
+        window = get_document_session("key", f"Window {i}: {paper[:8000]}", local=True)
+        assert get_document_session("key", f"Window {i}: {paper[:8000]}", local=True) is not window
+    assert get_document_session("key", paper, local=True) is session
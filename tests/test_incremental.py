@@ -0,0 +1,48 @@
+"""
+test_incremental.py
+
+Tests for the paragraph diff of two versions and the carry-over of corrections and arguments.
+"""
+
+from src.incremental import ParagraphDiff, carry_over_arguments, carry_over_corrections, incremental_diff
+
+OLD = "First paragraph with a eror.\n\nSecond paragraph is edited.\n\nThird paragraph has a typpo."
+NEW = "First paragraph with a eror.\n\nA new paragraph.\n\nSecond paragraph was edited a lot.\n\nThird paragraph has a typpo."
+
+def test_regions_cover_the_changed_paragraphs():
+    diff = ParagraphDiff(OLD, NEW)
+    assert [NEW[start:end] for start, end in diff.regions] == ["A new paragraph.\n\nSecond paragraph was edited a lot."]
+    assert diff.changed_chars == len("A new paragraph.\n\nSecond paragraph was edited a lot.")
+
+def test_shift_maps_unchanged_paragraphs():
+    diff = ParagraphDiff(OLD, NEW)
+    start = OLD.index("eror")
+    assert diff.shift(start, start + 4) == start
+    start = OLD.index("typpo")
+    assert NEW[diff.shift(start, start + 5):].startswith("typpo")
+    # Spans in an edited paragraph or across a paragraph boundary have no new position
+    start = OLD.index("is edited")
+    assert diff.shift(start, start + 9) is None
+    start = OLD.index("eror")
+    assert diff.shift(start, OLD.index("Second")) is None
+
+def test_incremental_diff_gives_up_on_large_changes():
+    assert incremental_diff(OLD, NEW) is not None
+    assert incremental_diff(OLD, "Something else entirely.\n\nAnd more.") is None
+
+def test_carry_over_corrections():
+    corrections = [
+        {"error": "eror", "context": "with a eror", "suggestion": "error", "offset": OLD.index("eror"), "type": "spelling"},
+        {"error": "typpo", "context": "has a typpo", "suggestion": "typo", "offset": 0, "type": "spelling"},
+        {"error": "is edited", "context": "paragraph is edited", "suggestion": "was edited", "offset": 0, "type": "grammar"},
+    ]
+    carried = carry_over_corrections(ParagraphDiff(OLD, NEW), OLD, corrections)
+    assert [(c["error"], NEW[c["offset"]:c["offset"] + c["length"]]) for c in carried] == [("eror", "eror"), ("typpo", "typpo")]
+    assert corrections[1]["offset"] == 0
+
+def test_carry_over_arguments():
+    arguments = [{"context": "Third paragraph has a typpo.", "literature": ["kept"]},
+                 {"context": "Second paragraph is edited.", "literature": []}]
+    carried = carry_over_arguments(ParagraphDiff(OLD, NEW), OLD, arguments)
+    assert carried == [arguments[0]]
+    assert carried[0] is not arguments[0]
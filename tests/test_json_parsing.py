@@ -0,0 +1,113 @@
+"""
+test_json_parsing.py
+
+Tests for the tolerant parsing of LLM JSON lists and the completion of truncated lists.
+The LLM client is replaced by canned responses.
+"""
+
+import pytest
+from pydantic import BaseModel
+from src import json_parsing
+from src.json_parsing import IncrementalArrayParser, generate_items, parse_items, parse_object, stream_items, strip_fences
+from src.llm_client import LLMError
+
+class Item(BaseModel):
+    name: str
+    count: int = 0
+
+def _describe(item : dict):
+    return item["name"]
+
+@pytest.fixture
+def responses(monkeypatch):
+    """
+    Replaces generate_content with a queue of canned responses and records the prompts.
+    A response that is an exception is raised instead.
+    """
+    queue = []
+    prompts = []
+    def generate_content(api_key, prompt, config=None, **kwargs):
+        prompts.append(prompt)
+        response = queue.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response, "test-model"
+    monkeypatch.setattr(json_parsing, "generate_content", generate_content)
+    return queue, prompts
+
+def test_strip_fences():
+    assert strip_fences('```json\n[{"name": "a"}]\n```') == '[{"name": "a"}]'
+    assert strip_fences('  [1]  ') == "[1]"
+
+@pytest.mark.parametrize("raw, expected", [
+    ('[{"name": "a"}, {"name": "b", "count": 2}]', (["a", "b"], True)),
+    ('```json\n[{"name": "a"}]\n```', (["a"], True)),
+    ('[{"name": "a"}, {"name": "b", "cou', (["a"], False)),
+    ('[{"name": "a"}', (["a"], False)),
+    ('[{"name": "a"}, {"count": 1}, {"name": "c"}]', (["a", "c"], True)),
+    ('{"name": "a"}', (["a"], True)),
+    ('```json\n{"name": "a"}\n```', (["a"], True)),
+    ('{"name": "a"}, {"name": "b"}', (["a", "b"], True)),
+    ('{"name": "a"', ([], False)),
+    ("nothing", ([], False)),
+])
+def test_parse_items(raw, expected):
+    items, complete = parse_items(raw, Item)
+    assert ([item["name"] for item in items], complete) == expected
+
+def test_parse_object():
+    assert parse_object('Here you go: {"a": [1, 2]} and more {"b": 1}') == {"a": [1, 2]}
+    assert parse_object('{"a": 1') is None
+
+def test_incremental_parser_yields_items_as_they_close():
+    parser = IncrementalArrayParser(Item)
+    chunks = ['```json\n[{"na', 'me": "a {x}"}, {"name": "b\\"', '}"}, {"count": 1},', ' {"name": "c"}]', ' {"name": "d"}']
+    assert [[item["name"] for item in parser.feed(chunk)] for chunk in chunks] == [[], ["a {x}"], ['b"}'], ["c"], []]
+    assert parser.complete
+
+def test_truncated_list_requests_the_rest_and_drops_repeats(responses):
+    queue, prompts = responses
+    queue += ['[{"name": "a"}, {"name": "b"}, {"name": "c", "co',
+              '[{"name": "b"}, {"name": "c"}, {"name": "d"}]']
+    items, complete = generate_items("key", "List things.", Item, _describe)
+    assert [item["name"] for item in items] == ["a", "b", "c", "d"]
+    assert complete
+    assert "already contained 2 items" in prompts[1] and "b" in prompts[1]
+
+def test_retries_are_bounded(responses):
+    queue, prompts = responses
+    queue += ['[{"name": "a"}, {"na', '[{"name": "b"}, {"na', '[{"name": "c"}, {"na', '[]']
+    items, complete = generate_items("key", "List things.", Item, _describe, max_retries=2)
+    assert [item["name"] for item in items] == ["a", "b", "c"]
+    assert not complete
+    assert len(prompts) == 3
+
+def test_unparsable_response_is_retried_in_full(responses):
+    queue, prompts = responses
+    queue += ["Sorry, I can't.", '[{"name": "a"}]']
+    items, complete = generate_items("key", "List things.", Item, _describe)
+    assert [item["name"] for item in items] == ["a"]
+    assert complete
+    assert prompts == ["List things.", "List things."]
+
+def test_failed_requests(responses):
+    queue, _ = responses
+    queue.append(LLMError("down"))
+    assert generate_items("key", "List things.", Item, _describe) == (None, False)
+    queue += ['[{"name": "a"}, {"na', LLMError("down")]
+    items, complete = generate_items("key", "List things.", Item, _describe)
+    assert [item["name"] for item in items] == ["a"]
+    assert not complete
+
+def test_broken_stream_is_completed(responses, monkeypatch):
+    queue, _ = responses
+    def generate_content_stream(api_key, prompt, config=None, document=None):
+        yield '[{"name": "a"}, {"name": "b"}, '
+        raise ConnectionError("reset")
+    monkeypatch.setattr(json_parsing, "generate_content_stream", generate_content_stream)
+    queue.append('[{"name": "b"}, {"name": "c"}]')
+    streamed = []
+    items, complete = stream_items("key", "List things.", Item, _describe, streamed.append)
+    assert [item["name"] for item in items] == ["a", "b", "c"]
+    assert streamed == items
+    assert complete
@@ -0,0 +1,60 @@
+"""
+test_llm_client.py
+
+Tests for hedged requests and the limit on requests in flight. The Gemini client is replaced by a stand-in.
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from src import llm_client
+
+class FakeModels:
+    """
+    Stand-in for client.models: the slow model fails with a transient error after a delay.
+    """
+
+    def __init__(self, slow_model : str, delay : float):
+        self.slow_model = slow_model
+        self.delay = delay
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config):
+        with self._lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+        if model == self.slow_model:
+            time.sleep(self.delay)
+            raise ConnectionError("reset")
+        return SimpleNamespace(text=f"answer of {model}", usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, config):
+        for word in ("one ", "two ", "three"):
+            yield SimpleNamespace(text=word, usage_metadata=None)
+
+@pytest.fixture
+def models(monkeypatch):
+    models = FakeModels("slow-model", 0.2)
+    monkeypatch.setattr(llm_client, "get_client", lambda api_key: SimpleNamespace(models=models))
+    monkeypatch.setattr(llm_client, "backoff_delay", lambda attempt: 0.01)
+    # Imports the provider's error types up front, so retries happen while the stand-in is installed
+    llm_client.is_retryable(ConnectionError())
+    yield models
+    llm_client.set_request_limit(None)
+
+def test_hedged_loser_gives_up_after_the_winner_answered(models):
+    text, model = llm_client.generate_content("key", "prompt", models=["slow-model", "fast-model"], hedge_after=0.05, retries=2)
+    assert (text, model) == ("answer of fast-model", "fast-model")
+    # Without the stop event, the slow model would be retried twice after its first attempt failed
+    time.sleep(1.0)
+    assert models.calls["slow-model"] == 1
+
+def test_stream_holds_a_request_slot(models):
+    llm_client.set_request_limit(1)
+    stream = llm_client.generate_content_stream("key", "prompt", models=["fast-model"])
+    assert next(stream) == "one "
+    assert not llm_client._request_slots.acquire(blocking=False)
+    assert "".join(stream) == "two three"
+    assert llm_client._request_slots.acquire(blocking=False)
+    llm_client._request_slots.release()
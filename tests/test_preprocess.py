@@ -0,0 +1,82 @@
+"""
+test_preprocess.py
+
+Tests for the preparation of the extracted text and its offset map back to the displayed text.
+"""
+
+from src.extract_text import PARAGRAPH_SEPARATOR
+from src.preprocess import PreparedText, find_headers, find_references, prepare_text
+
+BODIES = ["Deep networks learn representations.", "We measure the error on held-out data.",
+          "Our method improves the baseline.", "The ablation removes each component.",
+          "Results hold across all datasets.", "We discuss the limitations here."]
+
+def _paper(last_page : str):
+    """
+    Returns a six-page text with a running head and a page number on every page, and the page offsets.
+    """
+    pages = [f"Journal of Tests {nr + 1}{PARAGRAPH_SEPARATOR}{body}{PARAGRAPH_SEPARATOR}{nr + 1}" for nr, body in enumerate(BODIES)]
+    pages[-1] = pages[-1].replace(BODIES[-1], BODIES[-1] + PARAGRAPH_SEPARATOR + last_page)
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + len(PARAGRAPH_SEPARATOR)
+    return PARAGRAPH_SEPARATOR.join(pages), offsets
+
+def test_removes_headers_and_references_but_keeps_appendix():
+    text, offsets = _paper("References\n\n[1] A. Author. A paper. 2020.\n\nAppendix A\n\nExtra proofs.")
+    prepared = prepare_text(text, offsets)
+    assert "Journal of Tests" not in prepared.text
+    assert "A. Author" not in prepared.text
+    assert "Extra proofs." in prepared.text
+    for body in BODIES:
+        assert body in prepared.text
+    assert prepared.skipped == []
+
+def test_references_on_the_last_page_are_removed_with_its_footer():
+    text, offsets = _paper("References\n\n[1] A. Author. A paper. 2020.")
+    prepared = prepare_text(text, offsets)
+    assert "References" not in prepared.text
+    assert "A. Author" not in prepared.text
+    assert prepared.text.rstrip().endswith(BODIES[-1])
+
+def test_find_references_stops_at_appendix():
+    text = "Body.\n\nReferences\n\n[1] Ref.\n\nAppendix\n\nMore."
+    start, end = find_references(text)
+    assert text[start:end].strip() == "References\n\n[1] Ref."
+
+def test_dehyphenation_and_ligatures():
+    prepared = prepare_text("The exam-\nple is ﬁne,\nthe state-of-the-\nart too.")
+    assert prepared.text == "The example is fine, the state-of-the-art too."
+
+def test_offsets_map_back_to_the_displayed_text():
+    display = "The exam-\nple is ﬁne,\nwrapped over lines."
+    prepared = prepare_text(display)
+    for word in ("is", "wrapped", "lines"):
+        start = prepared.text.index(word)
+        display_start, display_end = prepared.to_display(start, start + len(word))
+        assert display[display_start:display_end] == word
+    start = prepared.text.index("example")
+    assert display[slice(*prepared.to_display(start, start + len("example")))] == "exam-\nple"
+
+def test_overlapping_edits():
+    prepared = PreparedText("0123456789abcdefghij", [(2, 6, ""), (4, 10, ""), (5, 7, " "), (12, 14, "X"), (13, 15, "YY"), (1, 3, "")])
+    assert prepared.text == "0abXefghij"
+    assert prepared.skipped == [(13, 15, "YY")]
+    assert [prepared.to_display_position(i) for i in range(len(prepared.text))] == [0, 10, 11, 12, 14, 15, 16, 17, 18, 19]
+
+def test_numbers_that_are_not_page_numbers_are_kept():
+    pages = [f"{body}{PARAGRAPH_SEPARATOR}{nr + 1}" for nr, body in enumerate(BODIES)]
+    # A year on the title page, and table cells at the bottom of a page and above its page number
+    pages[0] = f"2024{PARAGRAPH_SEPARATOR}{pages[0]}"
+    pages[2] = f"{BODIES[2]}{PARAGRAPH_SEPARATOR}Table 1{PARAGRAPH_SEPARATOR}0.91{PARAGRAPH_SEPARATOR}17{PARAGRAPH_SEPARATOR}3"
+    pages[3] = f"{BODIES[3]}{PARAGRAPH_SEPARATOR}Table 2{PARAGRAPH_SEPARATOR}42"
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + len(PARAGRAPH_SEPARATOR)
+    text = PARAGRAPH_SEPARATOR.join(pages)
+    removed = [text[start:end] for start, end in find_headers(text, offsets)]
+    assert removed == ["1", "2", "3", "5", "6"]
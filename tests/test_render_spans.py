@@ -0,0 +1,33 @@
+"""
+test_render_spans.py
+
+Tests for the resolution of overlapping highlight spans and the single-pass renderer.
+"""
+
+import re
+from src.render_spans import Span, render_range, render_spans, resolve_spans
+
+def test_disjoint_and_nested_spans():
+    spans = [Span(4, 10, "<b>", "</b>"), Span(0, 3, "<i>", "</i>"), Span(5, 7, "<u>", "</u>")]
+    assert render_spans("abc defghi", spans) == "<i>abc</i> <b>d<u>ef</u>ghi</b>"
+
+def test_partial_overlap_is_split():
+    spans = [Span(0, 5, "<a>", "</a>"), Span(3, 8, "<b>", "</b>")]
+    assert resolve_spans(spans) == [Span(0, 5, "<a>", "</a>"), Span(3, 5, "<b>", "</b>"), Span(5, 8, "<b>", "</b>")]
+    assert render_spans("0123456789", spans) == "<a>012<b>34</b></a><b>567</b>89"
+
+def test_empty_and_out_of_range_spans():
+    spans = [Span(2, 2, "<x>"), Span(-3, 2, "<a>", "</a>"), Span(8, 20, "<b>", "</b>")]
+    assert render_spans("0123456789", spans) == "<a>01</a>234567<b>89</b>"
+
+def test_identical_spans_nest_in_input_order():
+    spans = [Span(1, 3, "<a>", "</a>"), Span(1, 3, "<b>", "</b>")]
+    assert render_spans("0123", spans) == "0<a><b>12</b></a>3"
+
+def test_ranges_render_like_the_whole_text():
+    text = "one two three four five"
+    spans = resolve_spans([Span(0, 7, "<a>", "</a>"), Span(4, 13, "<b>", "</b>"), Span(14, 18, "<c>", "</c>")])
+    boundaries = [0, 6, 10, 23]
+    pages = [render_range(text, spans, start, end) for start, end in zip(boundaries, boundaries[1:])]
+    assert pages == ["<a>one <b>tw</b></a>", "<a><b>o</b></a><b> th</b>", "<b>ree</b> <c>four</c> five"]
+    assert re.sub("<[^>]*>", "", "".join(pages)) == text
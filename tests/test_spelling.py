@@ -0,0 +1,38 @@
+"""
+test_spelling.py
+
+Tests for the local spelling pre-pass. Skipped without symspellpy.
+"""
+
+import pytest
+
+pytest.importorskip("symspellpy")
+
+from src.spelling import check_spelling
+
+def _errors(text : str):
+    return {correction["error"]: correction["suggestion"] for correction in check_spelling(text)}
+
+def test_contractions_are_not_split():
+    text = "It wasn't clear. The model doesn't converge and couldn't be trained. We’re sure they weren't wrong."
+    assert _errors(text) == {}
+
+def test_misspellings_get_exact_offsets():
+    text = "The data was recieved late."
+    [correction] = check_spelling(text)
+    assert correction["suggestion"] == "received"
+    assert text[correction["offset"]:correction["offset"] + correction["length"]] == "recieved"
+    assert correction["type"] == "spelling"
+
+def test_possessive_is_checked_without_suffix():
+    assert _errors("The modell's accuracy is high.") == {"modell": "model"}
+
+def test_skips_names_acronyms_and_references():
+    text = "We thank Jonhson for the CNNX code.\n\nReferences\n\nSmiht, J. Recieved wisdom."
+    assert _errors(text) == {}
+
+def test_repeated_terms_are_domain_words():
+    text = "The tokenizr splits words. Every tokenizr is fast. A tokeniser is not a tokenizrr."
+    errors = _errors(text)
+    assert "tokenizr" not in errors
+    assert errors.get("tokenizrr") == "tokenizr"
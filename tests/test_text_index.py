@@ -0,0 +1,75 @@
+"""
+test_text_index.py
+
+Tests for the normalized offset map and the anchoring of corrections and arguments.
+"""
+
+from src.preprocess import prepare_text
+from src.text_index import MAX_OCCURRENCES, NormalizedText, PatternIndex, locate_arguments, locate_corrections, normalize
+
+def test_normalize():
+    assert normalize("  “Quoted”\n\tand  it’s  ") == "\"Quoted\" and it's"
+
+def test_normalized_positions_map_to_the_original():
+    original = "One  two\n\nthree ‘four’"
+    normalized = NormalizedText(original)
+    assert normalized.text == "One two three 'four'"
+    start = normalized.text.index("three")
+    assert original[slice(*normalized.to_original(start, start + 5))] == "three"
+    start = normalized.text.index("two three")
+    assert original[slice(*normalized.to_original(start, start + 9))] == "two\n\nthree"
+    assert normalized.to_original(len(normalized.text), len(normalized.text)) == (len(original), len(original))
+
+def test_pattern_index_finds_overlapping_patterns():
+    index = PatternIndex()
+    ids = [index.add(pattern) for pattern in ("he", "she", "hers", "", "he")]
+    assert ids[0] == ids[4]
+    counts, occurrences = index.search("ushers she")
+    assert counts[ids[0]] == 2 and occurrences[ids[0]] == [2, 8]
+    assert counts[ids[1]] == 2 and occurrences[ids[1]] == [1, 7]
+    assert counts[ids[2]] == 1 and occurrences[ids[2]] == [2]
+    assert counts[ids[3]] == 0
+
+def test_locate_corrections():
+    text = "The results is good. The results is\nrobust, the methd works."
+    corrections = [
+        {"error": "results is", "context": "The results is robust", "offset": 0},
+        {"error": "methd", "context": "the methd works", "offset": 0},
+        {"error": "missing", "context": "not in the text", "offset": 0},
+    ]
+    located = locate_corrections(NormalizedText(text), corrections)
+    assert [(correction["error"], text[start:end]) for correction, start, end in located] == [
+        ("results is", "results is"), ("methd", "methd")]
+    # The repeated error is anchored through its context
+    assert located[0][1] == text.index("results is\n")
+
+def test_locate_arguments_with_fuzzy_fallback():
+    text = ("Introduction.\n\nWe show that sparse attention scales linearly with the length of the input sequence "
+            "while matching the accuracy of dense attention on all benchmarks.\n\nConclusion.")
+    contexts = [
+        "We show that sparse attention scales linearly with the length of the input sequence",
+        "We show that sparse atention scales linearly with the lenght of the input sequence while matching the accuracy",
+        "Something the paper never says about convolutional networks and their training budget.",
+    ]
+    located = locate_arguments(NormalizedText(text), contexts)
+    assert [i for i, _, _ in located] == [0, 1]
+    assert located[0][1] == text.index("We show that")
+    # The fuzzy match starts within the length of the typos of the real start
+    assert abs(located[1][1] - text.index("We show that")) <= 2
+
+def test_positions_map_through_the_prepared_text():
+    display = "The exam-\nple is ﬁne."
+    prepared = prepare_text(display)
+    normalized = NormalizedText(prepared.text, prepared)
+    [(_, start, end)] = locate_corrections(normalized, [{"error": "example", "context": "The example is", "offset": 0}])
+    assert display[start:end] == "exam-\nple"
+
+def test_repeated_error_is_found_near_the_offset_beyond_the_stored_occurrences():
+    sentence = "We saw the the result.\n\n"
+    text = sentence * (MAX_OCCURRENCES + 10)
+    expected = text.index("the the", len(sentence) * (MAX_OCCURRENCES + 5))
+    # The model counts in the text it was given, the double line breaks are collapsed in the normalized copy
+    [(_, start, end)] = locate_corrections(NormalizedText(text), [{"error": "the the", "context": "", "offset": expected}])
+    assert (start, end) == (expected, expected + len("the the"))
+    [(_, start, _)] = locate_corrections(NormalizedText(text), [{"error": "the the", "context": "saw the the", "offset": expected + 1}])
+    assert start == expected
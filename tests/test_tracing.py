@@ -0,0 +1,63 @@
+"""
+test_tracing.py
+
+Tests for the span log and the metrics endpoint.
+"""
+
+import json
+import threading
+import urllib.request
+import pytest
+from src import tracing
+
+@pytest.fixture
+def metrics_server(monkeypatch):
+    """
+    Lets a test start its own metrics endpoint and stops it afterwards.
+    """
+    monkeypatch.setattr(tracing, "_metrics_server", None)
+    yield
+    if tracing._metrics_server:
+        tracing._metrics_server.shutdown()
+        tracing._metrics_server.server_close()
+
+def test_metrics_endpoint_listens_on_localhost(metrics_server):
+    with tracing.span("test_stage"):
+        pass
+    tracing.start_metrics_server("0")
+    host, port = tracing._metrics_server.server_address
+    assert host == "127.0.0.1"
+    body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode("utf-8")
+    assert 'paperhelp_stage_duration_seconds_count{stage="test_stage"}' in body
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    return path
+
+def test_spans_are_written_by_the_writer_thread(trace_file):
+    threads = [threading.Thread(target=lambda: [tracing.record(tracing.Span("test_write", {"i": i}), 0.1) for i in range(50)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tracing.flush_traces()
+    entries = [json.loads(line) for line in trace_file.read_text(encoding="utf-8").splitlines()]
+    assert len(entries) == 200
+    assert all(entry["name"] == "test_write" and entry["duration"] == 0.1 for entry in entries)
+
+def test_recording_does_not_wait_for_the_file(trace_file, monkeypatch, capsys):
+    write = tracing._write
+    unblock = threading.Event()
+    monkeypatch.setattr(tracing, "_write", lambda entries: unblock.wait() and write(entries))
+    recorded = threading.Thread(target=lambda: tracing.record(tracing.Span("test_slow_disk", {}), 0.1))
+    recorded.start()
+    recorded.join(timeout=5)
+    assert not recorded.is_alive()
+    assert tracing.stage_stats()["test_slow_disk"]["count"] == 1
+    assert "took" not in capsys.readouterr().out
+    unblock.set()
+    tracing.flush_traces()
+    assert "test_slow_disk" in trace_file.read_text(encoding="utf-8")